@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, Denomination, Purchase, PurchaseItem, ChangeBreakdown
+from .models import Product, Denomination, Purchase, Register, PurchaseItem, ChangeBreakdown, EmailOutbox, IdempotencyKey
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -8,10 +8,17 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['product_id', 'name']
     readonly_fields = ['created_at', 'updated_at']
 
+@admin.register(Register)
+class RegisterAdmin(admin.ModelAdmin):
+    list_display = ['code', 'name', 'created_at']
+    search_fields = ['code', 'name']
+    readonly_fields = ['created_at']
+
 @admin.register(Denomination)
 class DenominationAdmin(admin.ModelAdmin):
-    list_display = ['value', 'count']
-    ordering = ['-value']
+    list_display = ['register', 'value', 'count']
+    list_filter = ['register']
+    ordering = ['register', '-value']
 
 class PurchaseItemInline(admin.TabularInline):
     model = PurchaseItem
@@ -25,8 +32,21 @@ class ChangeBreakdownInline(admin.TabularInline):
 
 @admin.register(Purchase)
 class PurchaseAdmin(admin.ModelAdmin):
-    list_display = ['purchase_id', 'customer_email', 'grand_total', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['purchase_id', 'customer_email', 'register', 'grand_total', 'created_at']
+    list_filter = ['register', 'created_at']
     search_fields = ['customer_email', 'purchase_id']
     readonly_fields = ['purchase_id', 'created_at']
-    inlines = [PurchaseItemInline, ChangeBreakdownInline]
\ No newline at end of file
+    inlines = [PurchaseItemInline, ChangeBreakdownInline]
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['to_email', 'subject']
+    readonly_fields = ['created_at', 'sent_at']
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['key', 'purchase', 'created_at']
+    search_fields = ['key']
+    readonly_fields = ['key', 'purchase', 'response', 'created_at']
\ No newline at end of file
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - registers catalog invalidation receivers
@@ -0,0 +1,53 @@
+"""
+Helpers shared by the benchmark management commands
+
+Benchmarks run against a scratch SQLite file so the working database is never
+touched; the default connection is pointed at it for the duration of the run.
+"""
+import shutil
+import statistics
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+
+# Settings the profiles differ in; anything a profile leaves out gets Django's default
+PROFILE_DEFAULTS = {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}
+
+
+@contextmanager
+def scratch_database(profile=None):
+    """
+    Point the default connection at a freshly migrated SQLite file inside the block
+    profile names an entry of settings.DATABASE_PROFILES; None keeps the configured one.
+    Threads started inside the block connect to the scratch file too, and so do
+    processes forked inside it.
+    """
+    connection = connections['default']
+    if connection.vendor != 'sqlite':
+        raise ValueError('Scratch benchmark databases are SQLite files')
+    original = dict(connection.settings_dict)
+    directory = tempfile.mkdtemp(prefix='billing_bench_')
+    connection.close()
+    try:
+        if profile is not None:
+            connection.settings_dict.update(PROFILE_DEFAULTS, **settings.DATABASE_PROFILES[profile])
+        connection.settings_dict['NAME'] = str(Path(directory) / 'bench.sqlite3')
+        call_command('migrate', verbosity=0, interactive=False)
+        yield connection
+    finally:
+        connection.close()
+        connection.settings_dict.clear()
+        connection.settings_dict.update(original)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def percentiles(samples):
+    """p50, p95 and p99 of a list of numbers (all equal to the sample for a single one)"""
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {'p50': value, 'p95': value, 'p99': value}
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
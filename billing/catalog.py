@@ -0,0 +1,228 @@
+"""
+In-process, read-mostly cache of product catalog data (name, price, tax)
+
+Each worker keeps a bounded LRU of catalog entries keyed by product_id. A version
+stamp lives in Django's cache framework; any product change bumps it, and every
+worker drops its local entries the next time it sees a different stamp. Stock is
+deliberately not cached and must always be read from the database; a separate
+stock version stamp lets HTTP and search caches notice checkouts.
+
+The stamps only keep workers coherent when Django's cache is shared between
+them (REDIS_URL). With a process-local backend a product edit in one worker is
+never seen by another, so entries there expire after CATALOG_CACHE_LOCAL_TTL
+seconds, checkout reads prices from the database instead, and no HTTP validators
+or search results are derived from the stamps.
+
+Async views read the stamps through the cache's async API (aget/aadd), so a
+round trip to a shared cache never blocks the event loop.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from .models import Product
+
+VERSION_CACHE_KEY = 'billing:catalog:version'
+STOCK_VERSION_CACHE_KEY = 'billing:stock:version'
+MODIFIED_CACHE_KEY = 'billing:catalog:modified'
+
+# Backends whose contents no other worker process can see
+PROCESS_LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+CatalogEntry = namedtuple('CatalogEntry', ['pk', 'product_id', 'name', 'price_per_unit', 'tax_percentage'])
+
+
+def _get_version(key):
+    """
+    Version stamp stored under `key`, shared by all workers
+    A missing stamp (first use or evicted) is seeded from the clock so it never goes backwards
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def _aget_version(key):
+    """_get_version for async code"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _bump_version(key):
+    cache.set(MODIFIED_CACHE_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def version_stamps_shared():
+    """Whether the version stamps live in a cache every worker process sees"""
+    return not isinstance(caches['default'], PROCESS_LOCAL_CACHE_BACKENDS)
+
+
+def get_catalog_version():
+    """Current catalog (name, price, tax) version stamp"""
+    return _get_version(VERSION_CACHE_KEY)
+
+
+async def aget_catalog_version():
+    return await _aget_version(VERSION_CACHE_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate every worker's catalog cache"""
+    return _bump_version(VERSION_CACHE_KEY)
+
+
+def get_stock_version():
+    """Current stock version stamp, bumped by every checkout that moves stock"""
+    return _get_version(STOCK_VERSION_CACHE_KEY)
+
+
+async def aget_stock_version():
+    return await _aget_version(STOCK_VERSION_CACHE_KEY)
+
+
+def bump_stock_version():
+    return _bump_version(STOCK_VERSION_CACHE_KEY)
+
+
+async def acatalog_validators():
+    """
+    (ETag, Last-Modified timestamp) for product API responses; they change whenever product data or stock does
+    (None, None) when the stamps are per process and miss other workers' changes
+    """
+    if not version_stamps_shared():
+        return None, None
+    etag = quote_etag(f'{await aget_catalog_version()}-{await aget_stock_version()}')
+    modified = await cache.aget(MODIFIED_CACHE_KEY)
+    return etag, int(modified) if modified is not None else None
+
+
+def catalog_condition(view):
+    """
+    django.views.decorators.http.condition for async views, with the catalog validators
+    Answers 304 while the client's copy is current; the stamps are read without blocking the loop.
+    """
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        etag, last_modified = await acatalog_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            if last_modified and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+        return response
+    return inner
+
+
+class CatalogCache:
+    """
+    Bounded LRU of CatalogEntry objects, valid for a single catalog version
+    With process-local version stamps, entries are also dropped every local_ttl seconds
+    """
+
+    def __init__(self, max_entries, local_ttl=60):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._synced_at = 0
+        self._lock = threading.Lock()
+
+    def _sync_version(self, version):
+        now = time.monotonic()
+        expired = not version_stamps_shared() and now - self._synced_at > self.local_ttl
+        if version != self._version or expired:
+            self._entries.clear()
+            self._version = version
+            self._synced_at = now
+
+    def _lookup(self, product_ids, version):
+        """(cached entries, missing IDs, version they were read under) given the current catalog version"""
+        found = {}
+        with self._lock:
+            self._sync_version(version)
+            version = self._version
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is not None:
+                    self._entries.move_to_end(product_id)
+                    found[product_id] = entry
+        missing = [product_id for product_id in product_ids if product_id not in found]
+        return found, missing, version
+
+    def _missing_rows(self, missing):
+        return Product.objects.filter(product_id__in=missing).values_list(
+            'pk', 'product_id', 'name', 'price_per_unit', 'tax_percentage'
+        )
+
+    def _store(self, loaded, version):
+        with self._lock:
+            # Do not store rows read under a version that has since been replaced
+            if self._version == version:
+                for product_id, entry in loaded.items():
+                    self._entries[product_id] = entry
+                    self._entries.move_to_end(product_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def get_many(self, product_ids):
+        """
+        Catalog entries for the given product IDs; unknown IDs are left out
+        Missing entries are loaded from the database with one query
+        """
+        found, missing, version = self._lookup(list(dict.fromkeys(product_ids)), get_catalog_version())
+        if missing:
+            loaded = {row[1]: CatalogEntry(*row) for row in self._missing_rows(missing)}
+            self._store(loaded, version)
+            found.update(loaded)
+        return found
+
+    async def aget_many(self, product_ids):
+        """get_many for async views; missing entries are loaded with the async ORM"""
+        found, missing, version = self._lookup(list(dict.fromkeys(product_ids)), await aget_catalog_version())
+        if missing:
+            loaded = {row[1]: CatalogEntry(*row) async for row in self._missing_rows(missing)}
+            self._store(loaded, version)
+            found.update(loaded)
+        return found
+
+    def get(self, product_id):
+        return self.get_many([product_id]).get(product_id)
+
+    async def aget(self, product_id):
+        return (await self.aget_many([product_id])).get(product_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+catalog = CatalogCache(
+    getattr(settings, 'CATALOG_CACHE_MAX_ENTRIES', 10000),
+    getattr(settings, 'CATALOG_CACHE_LOCAL_TTL', 60),
+)
+
+
+def invalidate_catalog():
+    """Drop this worker's entries and tell other workers to do the same"""
+    bump_catalog_version()
+    catalog.clear()
@@ -0,0 +1,127 @@
+"""
+Whole-catalog snapshots and changes feeds for client-side autocomplete
+
+A snapshot is every product as a compact [id, name, price, tax, stock] row with
+a version: the newest Product.updated_at or DeletedProduct.deleted_at, in
+microseconds since the epoch. Every write path that matters keeps updated_at
+current (saves, imports and the checkout stock decrement), and deletes leave a
+tombstone, so "changes since version N" is an indexed range scan on both.
+
+Rows carry absolute values, so applying a change twice is harmless. The feed
+therefore reaches CHANGES_OVERLAP further back than asked: a transaction that
+stamped updated_at before another but committed after it is still picked up.
+
+The JSON and gzip bodies of the full snapshot are built once per version and
+kept in this worker until the version moves on.
+"""
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Max
+from .models import DeletedProduct, Product
+
+SNAPSHOT_FIELDS = ['id', 'name', 'price', 'tax', 'stock']
+CHANGES_OVERLAP = timedelta(seconds=5)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_version(moment):
+    """Microseconds since the epoch of an aware datetime; 0 for None"""
+    return (moment - EPOCH) // timedelta(microseconds=1) if moment is not None else 0
+
+
+def from_version(version):
+    return EPOCH + timedelta(microseconds=version)
+
+
+# Newest version a datetime can represent; anything past it is not a version this server sent
+MAX_VERSION = to_version(datetime.max.replace(tzinfo=dt_timezone.utc))
+
+
+def parse_snapshot_version(value):
+    """A client's `since` version as an int, or None if it is missing, malformed or out of range"""
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        return None
+    return version if 0 <= version <= MAX_VERSION else None
+
+
+def get_catalog_snapshot_version():
+    """Version of the catalog as a whole, from the two indexed timestamps"""
+    updated = Product.objects.aggregate(latest=Max('updated_at'))['latest']
+    deleted = DeletedProduct.objects.aggregate(latest=Max('deleted_at'))['latest']
+    return max(to_version(updated), to_version(deleted))
+
+
+def catalog_snapshot_etag(request, *args, **kwargs):
+    """ETag for catalog snapshots and changes feeds; keeps the version on the request for the view"""
+    request.catalog_snapshot_version = get_catalog_snapshot_version()
+    return str(request.catalog_snapshot_version)
+
+
+def _rows(products):
+    return [
+        [product_id, name, float(price), float(tax), stock]
+        for product_id, name, price, tax, stock in products.values_list(
+            'product_id', 'name', 'price_per_unit', 'tax_percentage', 'available_stock'
+        )
+    ]
+
+
+def _encode(payload):
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    return body, gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class SnapshotCache:
+    """The encoded snapshot for the most recently requested version"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._bodies = None
+
+    def get(self, version):
+        """(json bytes, gzip bytes) of the full snapshot at version"""
+        with self._lock:
+            if self._version == version:
+                return self._bodies
+        # Read after the version: a write in between is sent again by the next changes feed
+        bodies = _encode({
+            'version': version,
+            'full': True,
+            'fields': SNAPSHOT_FIELDS,
+            'products': _rows(Product.objects.order_by('product_id')),
+            'deleted': [],
+        })
+        with self._lock:
+            self._version, self._bodies = version, bodies
+        return bodies
+
+    def clear(self):
+        with self._lock:
+            self._version = self._bodies = None
+
+
+snapshot_cache = SnapshotCache()
+
+
+def get_catalog_changes(since, version):
+    """
+    (json bytes, gzip bytes) of the products changed and the product_ids deleted since version `since`
+    A client that is ahead of the server (a restored database) gets the full snapshot instead.
+    """
+    if since > version:
+        return snapshot_cache.get(version)
+    cutoff = from_version(since) - CHANGES_OVERLAP
+    return _encode({
+        'version': version,
+        'full': False,
+        'fields': SNAPSHOT_FIELDS,
+        'products': _rows(Product.objects.filter(updated_at__gt=cutoff).order_by('updated_at')),
+        'deleted': list(
+            DeletedProduct.objects.filter(deleted_at__gt=cutoff).order_by('deleted_at').values_list('product_id', flat=True)
+        ),
+    })
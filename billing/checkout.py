@@ -0,0 +1,635 @@
+"""
+Checkout pipeline shared by the single and bulk bill endpoints
+
+Bills are validated against an in-memory snapshot of products and the shop drawer
+that is loaded once per chunk. Accepted bills update the snapshot so later bills in
+the same chunk see their effect, and the whole chunk is then written with a fixed
+number of bulk queries.
+"""
+import logging
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import partial
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .catalog import bump_stock_version, catalog, version_stamps_shared
+from .events import publish_checkout_events
+from .idempotency import build_idempotency_key, get_stored_responses
+from .invoices import build_purchase_invoice, render_checkout_invoice
+from .metrics import BILLS, CHECKOUT_RETRIES, timed_stage
+from .models import Product, Purchase, Register, PurchaseItem, ChangeBreakdown, EmailOutbox, IdempotencyKey, PurchaseInvoice, normalize_email
+from .outbox import build_invoice_email
+from .rollups import record_bill_sales
+from .utils import apply_drawer_deltas, calculate_change, decrement_product_stock, DrawerChangedError, InsufficientStockError
+
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+MAX_QUANTITY_PER_LINE = 99
+DEFAULT_CHUNK_SIZE = 25
+MAX_CHUNK_SIZE = 200
+# Transactions a bill gets when stock or the drawer keeps changing between its snapshot and its write
+MAX_CHECKOUT_ATTEMPTS = 3
+# Result of a bill whose chunk failed for a reason other than validation or a concurrent change
+UNEXPECTED_ERROR = 'An unexpected error occurred while processing this bill. Please try again or contact support if the problem persists.'
+
+logger = logging.getLogger(__name__)
+
+
+class BillValidationError(Exception):
+    """Raised with a user-facing message when a bill cannot be processed"""
+
+
+class DrawerDenomination:
+    """Lightweight stand-in for a Denomination row used by the change engine"""
+
+    def __init__(self, value, count):
+        self.value = value
+        self.count = count
+
+
+def _to_decimal(value):
+    """Convert a JSON number or string to Decimal, normalising to two decimal places"""
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def parse_bill(data):
+    """
+    Validate the shape of a bill payload without touching the database
+    Returns a dict with normalised fields; raises BillValidationError on bad input
+    """
+    if not isinstance(data, dict):
+        raise BillValidationError('Invalid request data format. Please check your input and try again.')
+
+    customer_email = data.get('customer_email')
+    amount_paid = data.get('amount_paid', 0)
+    products_data = data.get('products', [])
+    register = data.get('register') or settings.DEFAULT_REGISTER
+    customer_payment_denominations = data.get('customer_payment_denominations', {}) or {}
+
+    # 1. Validate customer email
+    if not customer_email:
+        raise BillValidationError('Customer email is required. Please enter a valid email address.')
+
+    if not isinstance(customer_email, str) or not re.match(EMAIL_PATTERN, customer_email):
+        raise BillValidationError('Please enter a valid email address format (e.g., customer@example.com)')
+
+    # 2. Validate products data
+    if not products_data:
+        raise BillValidationError('No products selected. Please add at least one product to generate a bill.')
+    if not isinstance(products_data, list):
+        raise BillValidationError('Invalid products format. Products must be a list of product lines.')
+
+    # 3. Validate amount paid
+    try:
+        amount_paid = Decimal(str(amount_paid))
+    except (ValueError, TypeError, InvalidOperation):
+        raise BillValidationError('Invalid amount paid. Please enter a valid numeric amount.')
+    if not amount_paid.is_finite():
+        raise BillValidationError('Invalid amount paid. Please enter a valid numeric amount.')
+    if amount_paid < 0:
+        raise BillValidationError('Amount paid cannot be negative. Please enter a valid amount.')
+
+    # 4. Validate customer payment denominations
+    if not isinstance(customer_payment_denominations, dict):
+        raise BillValidationError('Invalid payment denominations format. Please enter a count for each denomination.')
+    payment_counts = {}
+    for denomination_value, count in customer_payment_denominations.items():
+        try:
+            count = int(count)
+        except (ValueError, TypeError):
+            raise BillValidationError(f'Invalid denomination count for ₹{denomination_value}. Please enter a valid number.')
+        if count < 0:
+            raise BillValidationError(f'Invalid denomination count for ₹{denomination_value}. Count cannot be negative.')
+        if count > 0:
+            try:
+                value = _to_decimal(denomination_value)
+            except (ValueError, TypeError, InvalidOperation):
+                raise BillValidationError(f'Invalid denomination value or count for ₹{denomination_value}. Please check your input.')
+            if not value.is_finite():
+                raise BillValidationError(f'Invalid denomination value or count for ₹{denomination_value}. Please check your input.')
+            payment_counts[value] = payment_counts.get(value, 0) + count
+
+    # 5. Validate the register; its drawer is the only one this bill touches.
+    # A client-side copy of the drawer ("denominations") is ignored: counts only ever
+    # move by the payment taken and the change given
+    if not isinstance(register, str):
+        raise BillValidationError('Invalid register. Please select the till this bill is rung up on.')
+
+    # 6. Validate product lines
+    lines = []
+    quantities = {}
+    for item in products_data:
+        product_id = item.get('product_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity', 0) if isinstance(item, dict) else 0
+
+        if not product_id:
+            raise BillValidationError('Product ID is required for all products. Please select a valid product.')
+        if not isinstance(product_id, str):
+            raise BillValidationError('Invalid product ID. Please select a valid product.')
+
+        try:
+            quantity = int(quantity)
+        except (ValueError, TypeError):
+            raise BillValidationError(f'Invalid quantity for product {product_id}. Please enter a valid number.')
+        if quantity <= 0:
+            raise BillValidationError(f'Invalid quantity for product {product_id}. Quantity must be greater than 0.')
+        if quantity > MAX_QUANTITY_PER_LINE:
+            raise BillValidationError(f'Quantity too high for product {product_id}. Maximum allowed quantity is 9999.')
+
+        lines.append((product_id, quantity))
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    return {
+        'customer_email': customer_email,
+        'amount_paid': amount_paid,
+        'lines': lines,
+        'quantities': quantities,
+        'register': register,
+        'payment_counts': payment_counts,
+        'customer_payment_denominations': customer_payment_denominations,
+    }
+
+
+class CheckoutSnapshot:
+    """
+    Products and drawer counts loaded once per chunk of bills
+    Accepted bills are applied to the snapshot in memory so that every bill in the
+    chunk is validated against the state left by the bills before it.
+    """
+
+    def __init__(self, product_ids, register):
+        products = Product.objects.filter(product_id__in=list(product_ids))
+        if version_stamps_shared():
+            # Name, price and tax come from the catalog cache; stock is always read fresh
+            stock = dict(products.values_list('product_id', 'available_stock'))
+            rows = [
+                (product_id, entry.pk, entry.name, entry.price_per_unit, entry.tax_percentage, stock[product_id])
+                for product_id, entry in catalog.get_many(stock).items()
+            ]
+        else:
+            # Another worker's price edit never reaches this worker's cache; read prices with the stock
+            rows = products.values_list('product_id', 'pk', 'name', 'price_per_unit', 'tax_percentage', 'available_stock')
+        self.products = {
+            product_id: Product(
+                pk=pk,
+                product_id=product_id,
+                name=name,
+                price_per_unit=price,
+                tax_percentage=tax,
+                available_stock=stock
+            )
+            for product_id, pk, name, price, tax, stock in rows
+        }
+        # The register's id and drawer in one query; no rows at all means no such register
+        rows = list(Register.objects.filter(code=register).values_list('pk', 'denominations__value', 'denominations__count'))
+        if not rows:
+            raise BillValidationError(f'Register "{register}" not found. Please select a valid till.')
+        self.register = register
+        self.register_id = rows[0][0]
+        self.drawer = {value: count for _, value, count in rows if value is not None}
+        self.initial_drawer = dict(self.drawer)
+
+    def drawer_status(self, drawer=None):
+        """Drawer in the same format as utils.get_shop_drawer_status"""
+        drawer = self.drawer if drawer is None else drawer
+        return {
+            str(value): {
+                'value': value,
+                'count': drawer[value],
+                'total_value': value * drawer[value]
+            }
+            for value in sorted(drawer, reverse=True)
+        }
+
+
+def price_bill(bill, snapshot):
+    """
+    Check stock against the snapshot and compute totals, change amount and line items
+    """
+    total_amount = Decimal('0.00')
+    tax_amount = Decimal('0.00')
+    items = []
+
+    for product_id, quantity in bill['lines']:
+        product = snapshot.products.get(product_id)
+        if product is None:
+            raise BillValidationError(f'Product with ID "{product_id}" not found in the system. Please select a valid product from the list.')
+
+        requested = bill['quantities'][product_id]
+        if product.available_stock < requested:
+            raise BillValidationError(f'Insufficient stock for "{product.name}" (ID: {product_id}). Available: {product.available_stock}, Requested: {requested}. Please reduce quantity or select another product.')
+
+        item_subtotal = product.price_per_unit * quantity
+        item_tax = (item_subtotal * product.tax_percentage) / 100
+        total_amount += item_subtotal
+        tax_amount += item_tax
+
+        items.append({
+            'product': product,
+            'quantity': quantity,
+            'item_subtotal': item_subtotal,
+            'product_data': {
+                'name': product.name,
+                'product_id': product.product_id,
+                'quantity': quantity,
+                'unit_price': float(product.price_per_unit),
+                'tax_percentage': float(product.tax_percentage),
+                'subtotal': float(item_subtotal),
+                'tax_amount': float(item_tax)
+            }
+        })
+
+    # Round grand total to nearest rupee so change never contains paise
+    grand_total = (total_amount + tax_amount).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+
+    if bill['payment_counts']:
+        total_customer_payment = sum(
+            (value * count for value, count in bill['payment_counts'].items()),
+            Decimal('0.00')
+        )
+        amount_paid = total_customer_payment
+    else:
+        total_customer_payment = bill['amount_paid']
+        amount_paid = bill['amount_paid']
+
+    if total_customer_payment < grand_total:
+        shortfall = grand_total - total_customer_payment
+        raise BillValidationError(f'Insufficient payment amount. Total bill amount: ₹{grand_total}, Amount paid: ₹{total_customer_payment}, Shortfall: ₹{shortfall}. Please provide the complete payment amount.')
+
+    if total_customer_payment > grand_total * 10:
+        raise BillValidationError(f'Payment amount (₹{total_customer_payment}) is excessively high compared to bill amount (₹{grand_total}). Please verify the payment amount.')
+
+    change_amount = (total_customer_payment - grand_total).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+
+    bill.update({
+        'items': items,
+        'total_amount': total_amount,
+        'tax_amount': tax_amount,
+        'grand_total': grand_total,
+        'amount_paid': amount_paid,
+        'total_customer_payment': total_customer_payment,
+        'change_amount': change_amount,
+    })
+    return bill
+
+
+def make_change(bill, snapshot):
+    """
+    Work out the drawer after this bill and the change breakdown to hand back
+    """
+    drawer = dict(snapshot.drawer)
+
+    for value, count in bill['payment_counts'].items():
+        drawer[value] = drawer.get(value, 0) + count
+
+    change_breakdown = []
+    total_change_given = Decimal('0.00')
+    if bill['change_amount'] > 0:
+        change_breakdown, total_change_given = calculate_change(
+            bill['change_amount'],
+            [DrawerDenomination(value, count) for value, count in drawer.items()]
+        )
+        if total_change_given < bill['change_amount']:
+            raise BillValidationError(f'Cannot provide exact change of ₹{bill["change_amount"]}. Available denominations are insufficient. Please provide payment in smaller denominations or contact the cashier.')
+
+        for breakdown_item in change_breakdown:
+            drawer[breakdown_item['value']] -= breakdown_item['count']
+
+    bill.update({
+        'drawer_after': drawer,
+        'change_breakdown': change_breakdown,
+        'total_change_given': total_change_given,
+    })
+    return bill
+
+
+def apply_to_snapshot(bill, snapshot):
+    """Record an accepted bill's stock and drawer effects in the snapshot"""
+    for product_id, quantity in bill['quantities'].items():
+        snapshot.products[product_id].available_stock -= quantity
+    snapshot.drawer = bill['drawer_after']
+
+
+def write_bills(bills, snapshot):
+    """
+    Persist a chunk of accepted bills with a fixed number of bulk queries
+    Must run inside a transaction; raises InsufficientStockError or DrawerChangedError if
+    stock or the drawer changed underneath us
+    """
+    purchases = Purchase.objects.bulk_create([
+        Purchase(
+            customer_email=bill['customer_email'],
+            customer_email_normalized=normalize_email(bill['customer_email']),
+            # Quantized like the stored columns so invoices rendered now match a later reload
+            total_amount=_to_decimal(bill['total_amount']),
+            tax_amount=_to_decimal(bill['tax_amount']),
+            grand_total=_to_decimal(bill['grand_total']),
+            amount_paid=_to_decimal(bill['amount_paid']),
+            change_amount=_to_decimal(bill['change_amount']),
+            register_id=snapshot.register_id
+        )
+        for bill in bills
+    ])
+    for bill, purchase in zip(bills, purchases):
+        bill['purchase'] = purchase
+
+    PurchaseItem.objects.bulk_create([
+        PurchaseItem(
+            purchase=bill['purchase'],
+            product=item['product'],
+            quantity=item['quantity'],
+            unit_price=item['product'].price_per_unit,
+            tax_percentage=item['product'].tax_percentage,
+            subtotal=item['item_subtotal']
+        )
+        for bill in bills
+        for item in bill['items']
+    ])
+
+    # Reduce stock for the whole chunk with one conditional UPDATE
+    chunk_quantities = {}
+    for bill in bills:
+        for product_id, quantity in bill['quantities'].items():
+            chunk_quantities[product_id] = chunk_quantities.get(product_id, 0) + quantity
+    decrement_product_stock(chunk_quantities)
+    # Stale-while-uncommitted reads are re-invalidated once the chunk commits
+    bump_stock_version()
+    transaction.on_commit(bump_stock_version)
+
+    # Apply the chunk's net drawer change in one statement and pick up the new counts
+    drawer_deltas = {
+        value: count - snapshot.initial_drawer.get(value, 0)
+        for value, count in snapshot.drawer.items()
+    }
+    try:
+        snapshot.drawer.update(apply_drawer_deltas(drawer_deltas, snapshot.register))
+    except IntegrityError as e:
+        # A count would go below zero: another till handed out the same notes since the snapshot
+        raise DrawerChangedError('The cash drawer changed while this bill was being processed.') from e
+    bills[-1]['drawer_after'] = dict(snapshot.drawer)
+    # Open tills hear about the chunk only if it commits
+    transaction.on_commit(partial(
+        publish_checkout_events,
+        snapshot.register,
+        drawer_deltas,
+        {product_id: -quantity for product_id, quantity in chunk_quantities.items()}
+    ))
+
+    ChangeBreakdown.objects.bulk_create([
+        ChangeBreakdown(
+            purchase=bill['purchase'],
+            denomination_value=breakdown_item['value'],
+            count=breakdown_item['count']
+        )
+        for bill in bills
+        for breakdown_item in bill['change_breakdown']
+        if breakdown_item['count'] > 0
+    ])
+
+    # Store responses for idempotent retries; a duplicate key raises IntegrityError
+    keyed_bills = [bill for bill in bills if bill.get('idempotency_key')]
+    if keyed_bills:
+        IdempotencyKey.objects.bulk_create([
+            build_idempotency_key(bill['idempotency_key'], bill['purchase'], bill_response(bill, snapshot))
+            for bill in keyed_bills
+        ])
+
+
+def store_invoices(bills):
+    """Render each bill's invoice once and store it with the purchase; the email render goes to the outbox"""
+    invoices = []
+    for bill in bills:
+        detail_html, bill['invoice_email_html'] = render_checkout_invoice(
+            bill['purchase'], bill['items'], bill['change_breakdown']
+        )
+        invoices.append(build_purchase_invoice(bill['purchase'], detail_html))
+    PurchaseInvoice.objects.bulk_create(invoices)
+
+
+def queue_invoice_emails(bills):
+    """Queue the invoice emails for a chunk; the outbox worker sends them after commit"""
+    EmailOutbox.objects.bulk_create([
+        build_invoice_email(
+            bill['purchase'],
+            [item['product_data'] for item in bill['items']],
+            bill['change_breakdown'],
+            html_message=bill.get('invoice_email_html')
+        )
+        for bill in bills
+    ])
+
+
+def bill_response(bill, snapshot):
+    """Build the JSON response for an accepted bill"""
+    if 'response' in bill:
+        return bill['response']
+
+    purchase = bill['purchase']
+    change_breakdown = bill['change_breakdown']
+    drawer = bill['drawer_after']
+
+    bill['response'] = {
+        'success': True,
+        'purchase_id': str(purchase.purchase_id),
+        'register': snapshot.register,
+        'customer_email': bill['customer_email'],
+        'total_amount': float(bill['total_amount']),
+        'tax_amount': float(bill['tax_amount']),
+        'grand_total': float(bill['grand_total']),
+        'amount_paid': float(bill['amount_paid']),
+        'change_amount': float(bill['change_amount']),
+        'items': [item['product_data'] for item in bill['items']],
+        'change_breakdown': change_breakdown,
+        'available_denominations': {str(value): count for value, count in sorted(drawer.items(), reverse=True)},
+        'customer_payment_denominations': bill['customer_payment_denominations'],
+        'total_customer_payment': float(bill['total_customer_payment']),
+        'total_change_given': float(bill['total_change_given']),
+        'shop_drawer_status': snapshot.drawer_status(drawer),
+        'transaction_summary': {
+            'customer_paid': float(bill['total_customer_payment']),
+            'bill_amount': float(bill['grand_total']),
+            'change_given': float(bill['change_amount']),
+            'denominations_used_for_change': len(change_breakdown)
+        }
+    }
+    return bill['response']
+
+
+def _stock_error(error):
+    return {'success': False, 'error': f'{error} Please reduce quantity or select another product.'}
+
+
+def _process_chunk(parsed_bills):
+    """
+    Validate and write one chunk of parsed bills inside a single transaction
+    parsed_bills is a list of (index, bill) pairs, all for the same register;
+    returns a dict of index -> result
+    """
+    product_ids = set()
+    for _, bill in parsed_bills:
+        product_ids.update(bill['quantities'])
+
+    results = {}
+    with transaction.atomic():
+        try:
+            with timed_stage('snapshot'):
+                snapshot = CheckoutSnapshot(product_ids, parsed_bills[0][1]['register'])
+        except BillValidationError as e:
+            return {index: {'success': False, 'error': str(e)} for index, _ in parsed_bills}
+        accepted = []
+
+        for index, bill in parsed_bills:
+            bill.pop('response', None)
+            try:
+                with timed_stage('pricing'):
+                    price_bill(bill, snapshot)
+                with timed_stage('change'):
+                    make_change(bill, snapshot)
+            except BillValidationError as e:
+                logger.debug('Bill %d rejected: %s', index, e)
+                results[index] = {'success': False, 'error': str(e)}
+                continue
+            apply_to_snapshot(bill, snapshot)
+            accepted.append((index, bill))
+
+        if accepted:
+            accepted_bills = [bill for _, bill in accepted]
+            with timed_stage('db_write'):
+                write_bills(accepted_bills, snapshot)
+            with timed_stage('rollups'):
+                record_bill_sales(accepted_bills)
+            with timed_stage('invoice'):
+                store_invoices(accepted_bills)
+            with timed_stage('email_enqueue'):
+                queue_invoice_emails(accepted_bills)
+            for index, bill in accepted:
+                results[index] = bill_response(bill, snapshot)
+
+    logger.debug('Checkout chunk committed: %d of %d bills accepted', len(accepted), len(parsed_bills))
+    return results
+
+
+def _retry_reason(error):
+    if isinstance(error, InsufficientStockError):
+        return 'stock'
+    if isinstance(error, DrawerChangedError):
+        return 'drawer'
+    return 'integrity'
+
+
+def _retry_individually(chunk):
+    """
+    Process each bill of a failed chunk in its own transaction
+    A bill whose stock or drawer moves between its snapshot and its write is rolled back
+    as a whole and retried against a fresh snapshot, so re-pricing reports the stock
+    actually left; after MAX_CHECKOUT_ATTEMPTS it is rejected.
+    """
+    results = {}
+    for index, bill in chunk:
+        for attempt in range(1, MAX_CHECKOUT_ATTEMPTS + 1):
+            try:
+                results.update(_process_chunk([(index, bill)]))
+            except (InsufficientStockError, DrawerChangedError) as e:
+                if attempt < MAX_CHECKOUT_ATTEMPTS:
+                    CHECKOUT_RETRIES.inc(_retry_reason(e))
+                    logger.debug('Bill %d rolled back (%s); retry %d', index, e, attempt)
+                    continue
+                logger.warning('Bill %d rejected after %d attempts: %s', index, attempt, e)
+                if isinstance(e, InsufficientStockError):
+                    results[index] = _stock_error(e)
+                else:
+                    results[index] = {'success': False, 'error': f'{e} Please try again.'}
+            except IntegrityError:
+                # Another request committed the same idempotency key first
+                stored = get_stored_responses([bill['idempotency_key']]) if bill.get('idempotency_key') else {}
+                if not stored:
+                    logger.exception('Bill %d failed', index)
+                    results[index] = {'success': False, 'error': UNEXPECTED_ERROR}
+                else:
+                    results[index] = stored[bill['idempotency_key']]
+            except Exception:
+                # Bills before this one are already committed; only this one fails
+                logger.exception('Bill %d failed', index)
+                results[index] = {'success': False, 'error': UNEXPECTED_ERROR}
+            break
+    return results
+
+
+def process_bills(bills_data, chunk_size=DEFAULT_CHUNK_SIZE, idempotency_keys=None):
+    """
+    Process a list of bill payloads in chunked transactions
+    idempotency_keys, if given, lines up with bills_data; bills whose key already has a
+    stored response are answered from it without being validated or written again.
+    Returns one result dict per bill, in the same order as bills_data
+    """
+    with timed_stage('total'):
+        return _process_bills(bills_data, chunk_size, idempotency_keys)
+
+
+def _process_bills(bills_data, chunk_size, idempotency_keys):
+    results = [None] * len(bills_data)
+    idempotency_keys = idempotency_keys or [None] * len(bills_data)
+    stored_responses = get_stored_responses([key for key in idempotency_keys if key])
+    first_index_for_key = {}
+    duplicate_of = {}
+    parsed_bills = []
+
+    for index, data in enumerate(bills_data):
+        key = idempotency_keys[index]
+        if key in stored_responses:
+            results[index] = stored_responses[key]
+            continue
+        if key and key in first_index_for_key:
+            duplicate_of[index] = first_index_for_key[key]
+            continue
+
+        try:
+            with timed_stage('validation'):
+                bill = parse_bill(data)
+        except BillValidationError as e:
+            logger.debug('Bill %d rejected: %s', index, e)
+            results[index] = {'success': False, 'error': str(e)}
+            continue
+
+        if key:
+            first_index_for_key[key] = index
+        bill['idempotency_key'] = key
+        parsed_bills.append((index, bill))
+
+    # Chunks never mix registers: each is written against one register's drawer
+    by_register = {}
+    for index, bill in parsed_bills:
+        by_register.setdefault(bill['register'], []).append((index, bill))
+    chunks = [
+        bills[start:start + chunk_size]
+        for bills in by_register.values()
+        for start in range(0, len(bills), chunk_size)
+    ]
+
+    for chunk in chunks:
+        try:
+            chunk_results = _process_chunk(chunk)
+        except (InsufficientStockError, DrawerChangedError, IntegrityError) as e:
+            # Stock, the drawer or an idempotency key moved underneath the snapshot
+            CHECKOUT_RETRIES.inc(_retry_reason(e))
+            logger.warning('Checkout chunk of %d bills rolled back (%s); retrying bills individually', len(chunk), e)
+            chunk_results = _retry_individually(chunk)
+        except Exception:
+            # The chunk's transaction rolled back; chunks already committed keep their results
+            logger.exception('Checkout chunk of %d bills failed', len(chunk))
+            chunk_results = {index: {'success': False, 'error': UNEXPECTED_ERROR} for index, _ in chunk}
+
+        for index, result in chunk_results.items():
+            results[index] = result
+
+    for index, original_index in duplicate_of.items():
+        results[index] = results[original_index]
+
+    succeeded = sum(1 for result in results if result['success'])
+    BILLS.inc('success', succeeded)
+    BILLS.inc('failure', len(results) - succeeded)
+    return results
+
+
+def process_bill(data, idempotency_key=None):
+    """Process a single bill payload; returns the response dict"""
+    return process_bills([data], chunk_size=1, idempotency_keys=[idempotency_key])[0]
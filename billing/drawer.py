@@ -0,0 +1,74 @@
+"""
+Versioned snapshots of the registers' cash drawers
+
+Every register (till) has its own drawer and its own version, kept in the
+Register row next to the Denomination rows it describes. Every change to a
+register's Denomination rows bumps it in the same transaction: checkouts and
+customer payments through apply_drawer_deltas, and edits or deletes through the
+model signals. Clients keep the last snapshot they were sent and ask whether it
+is still current; while it is, the answer is one indexed single-row lookup.
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import F
+from .models import Register
+
+
+def get_drawer_version(register=None):
+    """Current version of a register's drawer (by code; default register if None), or None if there is no such register"""
+    return Register.objects.filter(code=register or settings.DEFAULT_REGISTER).values_list('drawer_version', flat=True).first()
+
+
+def bump_drawer_version(register=None):
+    """Mark every client's snapshot of this register's drawer stale; part of the caller's transaction"""
+    Register.objects.filter(code=register or settings.DEFAULT_REGISTER).update(drawer_version=F('drawer_version') + 1)
+
+
+def get_drawer_snapshot(register=None):
+    """
+    (version, {denomination value: count}) of a register's drawer, values as strings, largest first
+    The version and the counts are read in one query, so they always belong together.
+    Raises Register.DoesNotExist for an unknown register.
+    """
+    rows = list(
+        Register.objects.filter(code=register or settings.DEFAULT_REGISTER)
+        .order_by('-denominations__value')
+        .values_list('drawer_version', 'denominations__value', 'denominations__count')
+    )
+    if not rows:
+        raise Register.DoesNotExist(f'Register "{register or settings.DEFAULT_REGISTER}" not found')
+    drawer = {str(value): count for _, value, count in rows if value is not None}
+    return rows[0][0], drawer
+
+
+def get_drawers():
+    """
+    Every register's drawer and the totals across them, from one query
+    Returns {'registers': [{'code', 'name', 'drawer': {value: count}, 'total_value'}],
+             'totals': {value: count}, 'total_value'}, values as strings, largest first
+    """
+    rows = Register.objects.order_by('code', '-denominations__value').values_list(
+        'code', 'name', 'denominations__value', 'denominations__count'
+    )
+    registers = {}
+    totals = {}
+    for code, name, value, count in rows:
+        register = registers.setdefault(code, {'code': code, 'name': name, 'drawer': {}, 'total_value': Decimal('0.00')})
+        if value is None:
+            continue
+        register['drawer'][str(value)] = count
+        register['total_value'] += value * count
+        totals[value] = totals.get(value, 0) + count
+    return {
+        'registers': list(registers.values()),
+        'totals': {str(value): totals[value] for value in sorted(totals, reverse=True)},
+        'total_value': sum((value * count for value, count in totals.items()), Decimal('0.00')),
+    }
+
+
+def parse_drawer_version(value):
+    """A client's `since` version as an int, or None if it is missing or malformed"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,181 @@
+"""
+Push of drawer and stock changes to open billing pages
+
+Checkout publishes compact events once its transaction commits: a "drawer"
+event with the per-denomination count deltas and a "stock" event with the
+per-product stock deltas, each with the version stamp they bring the client to.
+Deltas commute, so tills may see events from concurrent checkouts in any order.
+`GET /api/events/` streams them to every open page as Server-Sent Events.
+
+The broker behind it is pluggable (settings.BILLING_EVENT_BROKER). The default
+InProcessBroker fans events out to the subscribers of the worker process that
+ran the checkout, so it only reaches every till when one ASGI worker serves
+them; a backend for several workers implements publish() and subscribe() on a
+shared channel.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .catalog import aget_stock_version, get_stock_version
+from .drawer import get_drawer_version
+
+logger = logging.getLogger(__name__)
+
+# Sent in place of the events a subscriber could not keep up with; clients refetch their snapshots
+RESYNC_EVENT = 'resync'
+# How long EventSource waits before reconnecting after the stream drops
+RECONNECT_DELAY_MS = 3000
+
+
+class Subscription:
+    """One subscriber's bounded queue of (id, event, data) messages on its event loop"""
+
+    def __init__(self, loop, max_pending):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def put(self, message):
+        """Queue a message; runs on the subscriber's loop"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Dropping events would leave the client's counts wrong; tell it to start over instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((message[0], RESYNC_EVENT, {}))
+
+    async def get(self, timeout=None):
+        """Next (id, event, data) message, or None if nothing arrived within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    """Interface of an event broker backend"""
+
+    def publish(self, event, data):
+        """Send an event to every current subscriber; safe to call from any thread"""
+        raise NotImplementedError
+
+    def subscribe(self):
+        """Register a Subscription on the running event loop"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(EventBroker):
+    """Fans events out to the subscribers in this worker process"""
+
+    def __init__(self, max_pending=None):
+        self.max_pending = max_pending or getattr(settings, 'BILLING_EVENTS_MAX_PENDING', 100)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def publish(self, event, data):
+        message = (next(self._ids), event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # The subscriber's loop has closed without unsubscribing
+                self.unsubscribe(subscription)
+        return message[0]
+
+    def subscribe(self):
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """The configured broker, created on first use (one per backend path)"""
+    path = getattr(settings, 'BILLING_EVENT_BROKER', 'billing.events.InProcessBroker')
+    with _brokers_lock:
+        if path not in _brokers:
+            _brokers[path] = import_string(path)()
+        return _brokers[path]
+
+
+def publish(event, data):
+    """Publish through the configured broker; a broken backend never fails the caller"""
+    try:
+        get_broker().publish(event, data)
+    except Exception:
+        logger.exception('Could not publish %s event', event)
+
+
+def publish_checkout_events(register, drawer_deltas, stock_deltas):
+    """
+    Publish the drawer and stock changes of a committed checkout chunk
+    drawer_deltas maps denomination value -> count delta in the register's drawer,
+    stock_deltas product_id -> stock delta.
+    Run from transaction.on_commit, so the drawer version read here includes the chunk's bump.
+    """
+    drawer_deltas = {str(Decimal(str(value)).quantize(Decimal('0.01'))): delta for value, delta in drawer_deltas.items() if delta}
+    if drawer_deltas:
+        publish('drawer', {'register': register, 'version': get_drawer_version(register), 'deltas': drawer_deltas})
+    stock_deltas = {product_id: delta for product_id, delta in stock_deltas.items() if delta}
+    if stock_deltas:
+        publish('stock', {'version': get_stock_version(), 'deltas': stock_deltas})
+
+
+def format_event(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    event_id = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{event_id}event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+async def event_stream(broker, keepalive, register=None):
+    """
+    Server-Sent Events for one client at a register, until it disconnects
+    Starts with a "hello" event carrying the register's drawer version and the stock
+    version, so a client can tell whether the snapshots it holds are still current,
+    and sends a comment line whenever keepalive seconds pass without an event.
+    Drawer events of other registers are left out.
+    """
+    register = register or settings.DEFAULT_REGISTER
+    subscription = broker.subscribe()
+    try:
+        yield f'retry: {RECONNECT_DELAY_MS}\n' + format_event('hello', {
+            'register': register,
+            'drawer_version': await sync_to_async(get_drawer_version)(register),
+            'stock_version': await aget_stock_version(),
+        })
+        while True:
+            message = await subscription.get(keepalive)
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+            event_id, event, data = message
+            if event == 'drawer' and data.get('register') != register:
+                continue
+            yield format_event(event, data, event_id)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,136 @@
+"""
+Streaming purchase export (CSV or JSON Lines), optionally gzip-compressed
+
+Line items are read joined to their purchase and product in one ordered query;
+change breakdowns are read by a second query in the same (created_at, id) order
+and merged in, since joining both to the purchase would multiply the rows.
+Both queries use QuerySet.iterator(chunk_size=...), so memory stays constant
+however many purchases are exported.
+"""
+import csv
+import zlib
+from datetime import datetime, time, timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .history import filter_by_email
+from .models import ChangeBreakdown, PurchaseItem
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+ITERATOR_CHUNK_SIZE = 2000
+# Text is handed to the writer in pieces of roughly this size
+WRITE_BUFFER_SIZE = 64 * 1024
+
+PURCHASE_COLUMNS = (
+    'purchase_id', 'created_at', 'customer_email', 'total_amount', 'tax_amount',
+    'grand_total', 'amount_paid', 'change_amount'
+)
+ITEM_COLUMNS = ('product_id', 'product_name', 'quantity', 'unit_price', 'tax_percentage', 'subtotal')
+CSV_HEADER = PURCHASE_COLUMNS + ITEM_COLUMNS + ('change_breakdown',)
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def filter_purchases(queryset, start=None, end=None, email='', prefix=''):
+    """
+    Restrict a queryset to purchases on local days start <= day <= end matching an email lookup
+    prefix is the lookup path to the purchase, e.g. 'purchase__' for line items
+    """
+    if start:
+        queryset = queryset.filter(**{f'{prefix}created_at__gte': timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        queryset = queryset.filter(**{f'{prefix}created_at__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))})
+    if email:
+        queryset = filter_by_email(queryset, email, prefix)
+    return queryset
+
+
+def iter_purchases(start=None, end=None, email=''):
+    """
+    Yield one dict per purchase, oldest first, with its items and change breakdown
+    Purchases without items (none are created by checkout) are skipped.
+    """
+    # Filtering through the join lets the database walk purchases in (created_at, id) index order
+    order = ('purchase__created_at', 'purchase_id', 'id')
+    items = filter_purchases(PurchaseItem.objects.all(), start, end, email, 'purchase__').order_by(*order).values_list(
+        'purchase_id', *(f'purchase__{column}' for column in PURCHASE_COLUMNS),
+        'product__product_id', 'product__name', 'quantity', 'unit_price', 'tax_percentage', 'subtotal'
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    breakdowns = filter_purchases(ChangeBreakdown.objects.all(), start, end, email, 'purchase__').order_by(*order).values_list(
+        'purchase__created_at', 'purchase_id', 'denomination_value', 'count'
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+    pending_breakdown = next(breakdowns, None)
+    current = None
+    for row in items:
+        pk = row[0]
+        if current is None or current['pk'] != pk:
+            if current is not None:
+                yield current
+            current = dict(zip(PURCHASE_COLUMNS, row[1:1 + len(PURCHASE_COLUMNS)]), pk=pk, items=[], change_breakdown=[])
+            # Both streams share one order; skip notes of purchases that had no items
+            key = (current['created_at'], pk)
+            while pending_breakdown is not None and pending_breakdown[:2] < key:
+                pending_breakdown = next(breakdowns, None)
+            while pending_breakdown is not None and pending_breakdown[1] == pk:
+                current['change_breakdown'].append({'value': pending_breakdown[2], 'count': pending_breakdown[3]})
+                pending_breakdown = next(breakdowns, None)
+        current['items'].append(dict(zip(ITEM_COLUMNS, row[1 + len(PURCHASE_COLUMNS):])))
+    if current is not None:
+        yield current
+
+
+def _csv_lines(purchases):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for purchase in purchases:
+        change = ';'.join(f"{note['value']}x{note['count']}" for note in purchase['change_breakdown'])
+        head = [purchase[column] for column in PURCHASE_COLUMNS]
+        head[1] = purchase['created_at'].isoformat()
+        for item in purchase['items']:
+            yield writer.writerow(head + [item[column] for column in ITEM_COLUMNS] + [change])
+
+
+def _jsonl_lines(purchases):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for purchase in purchases:
+        purchase.pop('pk')
+        yield encoder.encode(purchase) + '\n'
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= WRITE_BUFFER_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def gzip_stream(chunks):
+    """Compress a stream of byte chunks into a single gzip member on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_purchases(export_format='csv', start=None, end=None, email='', compress=False):
+    """Byte chunks of a purchase export; nothing is queried until the first chunk is requested"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(EXPORT_FORMATS)}')
+    purchases = iter_purchases(start, end, email)
+    lines = _csv_lines(purchases) if export_format == 'csv' else _jsonl_lines(purchases)
+    chunks = _buffered(lines)
+    return gzip_stream(chunks) if compress else chunks
@@ -26,8 +26,9 @@ class ProductForm(forms.ModelForm):
 class DenominationForm(forms.ModelForm):
     class Meta:
         model = Denomination
-        fields = ['value', 'count']
+        fields = ['register', 'value', 'count']
         widgets = {
+            'register': forms.Select(attrs={'class': 'form-select'}),
             'value': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0.01'}),
             'count': forms.NumberInput(attrs={'class': 'form-control', 'min': '0'}),
         }
\ No newline at end of file
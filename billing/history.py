@@ -0,0 +1,85 @@
+import base64
+import re
+from datetime import datetime
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .checkout import EMAIL_PATTERN
+from .models import Purchase, PurchaseItem, normalize_email
+from .search import PREFIX_SENTINEL
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Columns shown by the history table and the JSON API
+HISTORY_FIELDS = ('purchase_id', 'customer_email', 'created_at', 'grand_total')
+
+def encode_cursor(created_at, pk):
+    """Opaque cursor for the row a page ended on"""
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Return (created_at, pk) from a cursor made by encode_cursor
+    Raises ValueError for anything else
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def filter_by_email(purchases, email, prefix=''):
+    """
+    Purchases for one customer (a complete address) or for every address starting with `email`
+    Both are ranges on the (customer_email_normalized, created_at, id) index; exact
+    lookups are also read in page order, prefix lookups sort only the matching rows.
+    prefix is the lookup path to the purchase when filtering a related model, e.g. 'purchase__'
+    """
+    email = normalize_email(email)
+    field = f'{prefix}customer_email_normalized'
+    if re.match(EMAIL_PATTERN, email):
+        return purchases.filter(**{field: email})
+    return purchases.filter(**{f'{field}__gte': email, f'{field}__lt': email + PREFIX_SENTINEL})
+
+def _history_rows(email, cursor, page_size):
+    """Queryset of up to page_size + 1 history rows, newest first"""
+    purchases = Purchase.objects.all()
+    if email:
+        purchases = filter_by_email(purchases, email)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # The redundant lte bound lets the database range-scan the (created_at, id) index
+        purchases = purchases.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk)
+        )
+
+    # A correlated count only runs for the rows on the page, unlike a JOIN + GROUP BY
+    item_count = PurchaseItem.objects.filter(purchase=OuterRef('pk')).order_by().values('purchase').annotate(
+        count=Count('*')
+    ).values('count')
+    return (
+        purchases.order_by('-created_at', '-id')
+        .annotate(item_count=Coalesce(Subquery(item_count, output_field=IntegerField()), 0))
+        .values('id', 'item_count', *HISTORY_FIELDS)[:page_size + 1]
+    )
+
+def _page(rows, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+def get_history_page(email='', cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    One page of purchases, newest first, and the cursor for the next page (None on the last page)
+    Keyset pagination on (created_at, id): every page is an index range scan of
+    page_size + 1 rows, however deep into the history it is.
+    """
+    return _page(list(_history_rows(email, cursor, page_size)), page_size)
+
+async def aget_history_page(email='', cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """get_history_page for async views"""
+    return _page([row async for row in _history_rows(email, cursor, page_size)], page_size)
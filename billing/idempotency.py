@@ -0,0 +1,44 @@
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+def serialize_response(result):
+    """Serialize a response dict exactly as JsonResponse would"""
+    return json.dumps(result, cls=DjangoJSONEncoder)
+
+def get_stored_response(key):
+    """
+    Return the serialized response stored for an idempotency key, or None
+    Single lookup on the unique key index
+    """
+    return IdempotencyKey.objects.filter(key=key).values_list('response', flat=True).first()
+
+def get_stored_responses(keys):
+    """
+    Return {key: response dict} for every key that already has a stored response
+    """
+    if not keys:
+        return {}
+    stored = IdempotencyKey.objects.filter(key__in=set(keys)).values_list('key', 'response')
+    return {key: json.loads(response) for key, response in stored}
+
+def build_idempotency_key(key, purchase, result):
+    """Unsaved key row holding the serialized response for a committed purchase"""
+    return IdempotencyKey(key=key, purchase=purchase, response=serialize_response(result))
+
+def purge_expired_keys(ttl=None):
+    """
+    Delete idempotency keys older than ttl (defaults to settings.IDEMPOTENCY_KEY_TTL)
+    Returns the number of keys removed
+    """
+    if ttl is None:
+        ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+    cutoff = timezone.now() - ttl
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
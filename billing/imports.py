@@ -0,0 +1,173 @@
+"""
+Bulk product catalog import from CSV or JSON Lines
+
+Rows are parsed as a stream, validated in Python with the model fields' own
+checks (no per-row queries), and upserted a chunk at a time with
+bulk_create(update_conflicts=True) keyed on product_id. A bad row is reported
+with its row number and skipped; it never aborts the import. bulk_create sends
+no signals, so the catalog cache is invalidated once at the end; the product
+search index is kept in sync by its database triggers.
+"""
+import csv
+import json
+import logging
+import time
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from .catalog import invalidate_catalog
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_FIELDS = ('product_id', 'name', 'available_stock', 'price_per_unit', 'tax_percentage')
+UPDATE_FIELDS = ['name', 'available_stock', 'price_per_unit', 'tax_percentage', 'updated_at']
+DEFAULT_IMPORT_CHUNK_SIZE = 1000
+# Errors kept for the report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.error_count,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': [{'row': row_number, 'error': message} for row_number, message in self.errors],
+        }
+
+
+def detect_format(filename):
+    """Import format from a file name, or None if it is not recognised"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def iter_rows(stream, import_format):
+    """
+    Yield (row number, dict or error message) from a text stream, one row at a time
+    Row numbers count data rows from 1, so they match a spreadsheet view minus the header
+    """
+    if import_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+    elif import_format == 'jsonl':
+        row_number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f'Invalid JSON: {e.msg}'
+                continue
+            yield row_number, row if isinstance(row, dict) else 'Expected a JSON object'
+    else:
+        raise ValueError(f'format must be one of {", ".join(IMPORT_FORMATS)}')
+
+
+def clean_row(row):
+    """
+    Validate one parsed row with the Product model fields' own rules
+    Returns an unsaved Product; raises ValidationError naming the offending fields
+    """
+    values = {}
+    errors = {}
+    for name in IMPORT_FIELDS:
+        field = Product._meta.get_field(name)
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        try:
+            values[name] = field.clean(raw, None)
+        except ValidationError as e:
+            errors[name] = e.messages
+    if errors:
+        raise ValidationError(errors)
+    return Product(**values)
+
+
+def _message(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def _write_chunk(products, result):
+    """Upsert one validated chunk in its own transaction"""
+    # The last row for a product_id wins, as it would across chunks
+    latest = {}
+    for row_number, product in products:
+        latest[product.product_id] = (row_number, product)
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                [product for _, product in latest.values()],
+                update_conflicts=True,
+                unique_fields=['product_id'],
+                update_fields=UPDATE_FIELDS
+            )
+    except DatabaseError as e:
+        logger.warning('Product import chunk failed: %s', e)
+        for row_number, _ in products:
+            result.add_error(row_number, f'Database error: {e}')
+        return
+    result.imported += len(products)
+
+
+def import_products(stream, import_format, chunk_size=DEFAULT_IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Import products from a text stream; returns an ImportResult
+    progress, if given, is called with the running ImportResult after each chunk
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    chunk = []
+    try:
+        for row_number, row in iter_rows(stream, import_format):
+            result.rows += 1
+            if isinstance(row, str):
+                result.add_error(row_number, row)
+                continue
+            try:
+                chunk.append((row_number, clean_row(row)))
+            except ValidationError as e:
+                result.add_error(row_number, _message(e))
+                continue
+            if len(chunk) >= chunk_size:
+                _write_chunk(chunk, result)
+                chunk = []
+                result.elapsed = time.perf_counter() - started
+                if progress:
+                    progress(result)
+        if chunk:
+            _write_chunk(chunk, result)
+    finally:
+        if result.imported:
+            invalidate_catalog()
+            transaction.on_commit(invalidate_catalog)
+        result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,113 @@
+"""
+Render-once invoice storage
+
+Purchases never change after commit, so the purchase detail fragment is rendered
+inside the checkout transaction and stored zlib compressed in PurchaseInvoice.
+The invoice email is rendered in the same pass and kept only on its outbox row.
+Purchases committed before invoices were stored are rendered (with
+select_related, so without N+1 queries) on first view and stored then.
+"""
+import zlib
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.template.loader import render_to_string
+from .models import ChangeBreakdown, Purchase, PurchaseInvoice, PurchaseItem
+
+CENTS = Decimal('0.01')
+COMPRESSION_LEVEL = 6
+
+def compress_html(html):
+    return zlib.compress(html.encode('utf-8'), COMPRESSION_LEVEL)
+
+def decompress_html(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+def render_detail(purchase, items, change_breakdown):
+    """
+    Purchase detail fragment HTML
+    items: dicts with name, product_id, quantity, unit_price, tax_percentage and subtotal
+    change_breakdown: dicts with denomination_value and count, as stored in ChangeBreakdown
+    """
+    return render_to_string('billing/purchase_invoice.html', {
+        'purchase': purchase,
+        'items': items,
+        'change_breakdown': change_breakdown
+    })
+
+def render_email(purchase, email_items, change_breakdown):
+    """Invoice email HTML; email_items and its change breakdown keep the shape the email template has always used"""
+    return render_to_string('billing/email_invoice.html', {
+        'purchase': purchase,
+        'items': email_items,
+        'change_breakdown': [
+            {'value': row['denomination_value'], 'count': row['count'], 'total': row['denomination_value'] * row['count']}
+            for row in change_breakdown
+        ]
+    })
+
+def build_purchase_invoice(purchase, detail_html):
+    """Unsaved invoice row holding the detail render compressed"""
+    return PurchaseInvoice(purchase=purchase, detail_html=compress_html(detail_html))
+
+def render_checkout_invoice(purchase, bill_items, change_breakdown):
+    """(detail_html, email_html) of a bill being committed, from the checkout's in-memory data (no queries)"""
+    items = [
+        {
+            'name': item['product'].name,
+            'product_id': item['product'].product_id,
+            'quantity': item['quantity'],
+            'unit_price': item['product'].price_per_unit,
+            'tax_percentage': item['product'].tax_percentage,
+            'subtotal': item['item_subtotal']
+        }
+        for item in bill_items
+    ]
+    stored_breakdown = [
+        {'denomination_value': row['value'].quantize(CENTS), 'count': row['count']}
+        for row in change_breakdown
+        if row['count'] > 0
+    ]
+    return (
+        render_detail(purchase, items, stored_breakdown),
+        render_email(purchase, [item['product_data'] for item in bill_items], stored_breakdown),
+    )
+
+def render_stored_purchase(purchase):
+    """Render the detail fragment of a committed purchase from its database rows (two queries)"""
+    purchase_items = PurchaseItem.objects.filter(purchase=purchase).select_related('product').order_by('id')
+    items = [
+        {
+            'name': item.product.name,
+            'product_id': item.product.product_id,
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+            'tax_percentage': item.tax_percentage,
+            'subtotal': item.subtotal
+        }
+        for item in purchase_items
+    ]
+    change_breakdown = list(
+        ChangeBreakdown.objects.filter(purchase=purchase).order_by('id').values('denomination_value', 'count')
+    )
+    return render_detail(purchase, items, change_breakdown)
+
+def get_invoice_html(purchase_id):
+    """
+    Stored invoice detail HTML for a purchase_id, or None if the purchase does not exist
+    A stored invoice costs one query; a missing one is rendered and stored.
+    """
+    stored = PurchaseInvoice.objects.filter(purchase__purchase_id=purchase_id).values_list('detail_html', flat=True).first()
+    if stored is not None:
+        return decompress_html(stored)
+
+    purchase = Purchase.objects.filter(purchase_id=purchase_id).first()
+    if purchase is None:
+        return None
+    detail_html = render_stored_purchase(purchase)
+    try:
+        with transaction.atomic():
+            build_purchase_invoice(purchase, detail_html).save(force_insert=True)
+    except IntegrityError:
+        # Another request stored it first; both renders are identical
+        pass
+    return detail_html
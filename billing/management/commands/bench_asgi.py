@@ -0,0 +1,105 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from billing.benchmarks import percentiles, scratch_database
+from billing.models import Product
+
+WORDS = ['basmati', 'rice', 'wheat', 'flour', 'sugar', 'salt', 'tea', 'coffee', 'milk', 'ghee', 'masala', 'toor', 'soap']
+
+
+def _build_requests(rng, options):
+    """(path, query params) pairs in the autocomplete-heavy mix tills send while a bill is typed"""
+    requests = []
+    for _ in range(options['requests']):
+        kind = rng.random()
+        if kind < 0.5:
+            requests.append((reverse('search_products'), {'q': rng.choice(WORDS)[:rng.randint(2, 5)]}))
+        elif kind < 0.9:
+            product_id = f"A{rng.randrange(options['products']):05d}"
+            requests.append((reverse('get_product_info', args=[product_id]), {}))
+        else:
+            requests.append((reverse('purchase_history_api'), {'limit': 20}))
+    return requests
+
+
+def _wsgi_run(requests, concurrency):
+    """A pool of worker threads, each handling one request at a time, like a threaded WSGI server"""
+    local = threading.local()
+
+    def get(request):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        path, params = request
+        started = time.perf_counter()
+        local.client.get(path, params)
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(get, requests))
+
+
+async def _asgi_run(requests, concurrency):
+    """`concurrency` requests in flight at once on one event loop, through the ASGI handler"""
+    client = AsyncClient()
+    pending = iter(requests)
+    latencies = []
+
+    async def worker():
+        for path, params in pending:
+            started = time.perf_counter()
+            await client.get(path, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read throughput of the async product, search and history views under ASGI and WSGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8,32', help='Comma separated numbers of requests in flight')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run')
+        parser.add_argument('--products', type=int, default=5000, help='Synthetic catalog size')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _seed(self, rng, options):
+        Product.objects.bulk_create([
+            Product(
+                product_id=f'A{index:05d}',
+                name=' '.join(rng.sample(WORDS, 3)),
+                available_stock=rng.randint(1, 500),
+                price_per_unit=Decimal(rng.randint(100, 99999)) / 100,
+                tax_percentage=Decimal(rng.choice([0, 5, 12, 18])),
+            )
+            for index in range(options['products'])
+        ], batch_size=1000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        requests = _build_requests(rng, options)
+
+        self.stdout.write(f"{'server':<8}{'in flight':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        # The test clients send Host: testserver
+        with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+            self._seed(rng, options)
+            for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+                for server in ('wsgi', 'asgi'):
+                    started = time.perf_counter()
+                    if server == 'wsgi':
+                        latencies = _wsgi_run(requests, concurrency)
+                    else:
+                        latencies = asyncio.run(_asgi_run(requests, concurrency))
+                    elapsed = time.perf_counter() - started
+                    row = percentiles(latencies)
+                    self.stdout.write(
+                        f"{server:<8}{concurrency:>10}{len(latencies) / elapsed:>10.1f}"
+                        f"{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}"
+                    )
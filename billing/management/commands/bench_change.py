@@ -0,0 +1,61 @@
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from billing.utils import _calculate_change_cached, _whole_rupee_drawer, calculate_change, greedy_change
+
+
+class BenchDenomination:
+    def __init__(self, value, count):
+        self.value = Decimal(value)
+        self.count = count
+
+
+# Indian notes and coins, plus a drawer whose larger notes have run short
+DRAWERS = {
+    'canonical': [(2000, 40), (500, 150), (200, 100), (100, 100), (50, 50), (20, 50), (10, 50), (5, 50), (2, 50), (1, 50)],
+    'short-change': [(2000, 40), (500, 150), (200, 100), (50, 1), (20, 300)],
+    'non-canonical': [(500, 150), (200, 100), (60, 200), (50, 200), (20, 200)],
+}
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark the change engine against plain greedy change-making'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=2000, help='Random change amounts per drawer')
+        parser.add_argument('--max-amount', type=int, default=100000, help='Largest change amount in rupees')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _time(self, func, amounts):
+        successes = 0
+        started = time.perf_counter()
+        for amount in amounts:
+            if func(amount):
+                successes += 1
+        elapsed = time.perf_counter() - started
+        return successes, elapsed / len(amounts) * 1e6
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Multiples of 10 so every drawer can pay in principle
+        amounts = [rng.randint(1, options['max_amount'] // 10) * 10 for _ in range(options['samples'])]
+        
+        self.stdout.write(f"{'drawer':<15}{'engine':<16}{'paid':>8}{'us/call':>12}")
+        for name, rows in DRAWERS.items():
+            denominations = [BenchDenomination(value, count) for value, count in rows]
+            drawer = _whole_rupee_drawer(denominations)
+            
+            def legacy(amount):
+                return greedy_change(amount, drawer) is not None
+            
+            def engine(amount):
+                return calculate_change(Decimal(amount), denominations)[1] > 0
+            
+            results = [('greedy', self._time(legacy, amounts))]
+            _calculate_change_cached.cache_clear()
+            results.append(('engine (cold)', self._time(engine, amounts)))
+            results.append(('engine (memo)', self._time(engine, amounts)))
+            
+            for label, (successes, micros) in results:
+                self.stdout.write(f'{name:<15}{label:<16}{successes:>8}{micros:>12.1f}')
@@ -0,0 +1,287 @@
+import json
+import multiprocessing
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from billing.benchmarks import percentiles, scratch_database
+from billing.metrics import CHECKOUT_RETRIES
+from billing.models import Denomination, Product, Register, default_register
+
+NOTES = (2000, 500, 200, 100, 50, 20, 10, 5, 2, 1)
+PAYMENT_STYLES = ('exact', 'notes', 'amount')
+BENCH_PREFIX = 'BENCH'
+RETRIES_PATTERN = re.compile(r'^billing_checkout_retries_total\{reason="([^"]+)"\} (\d+)$', re.MULTILINE)
+
+
+def _parse_weights(value):
+    """'exact=2,notes=5' -> {'exact': 2.0, 'notes': 5.0}"""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in PAYMENT_STYLES:
+            raise CommandError(f'Unknown payment style "{name}"; use {", ".join(PAYMENT_STYLES)}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def _greedy_notes(amount):
+    notes = {}
+    for note in NOTES:
+        count, amount = divmod(amount, note)
+        if count:
+            notes[str(note)] = count
+    return notes
+
+
+def build_bill(rng, catalog, basket_sizes, payments, worker, register=None):
+    """A random bill payload, paid in one of the weighted payment styles, rung up on register"""
+    lines = rng.sample(catalog, rng.choice(basket_sizes))
+    total = Decimal('0.00')
+    tax = Decimal('0.00')
+    products = []
+    for product_id, price, tax_percentage in lines:
+        quantity = rng.randint(1, 3)
+        subtotal = price * quantity
+        total += subtotal
+        tax += subtotal * tax_percentage / 100
+        products.append({'product_id': product_id, 'quantity': quantity})
+    grand_total = int((total + tax).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+    bill = {'customer_email': f'till{worker}@bench.example.com', 'products': products}
+    if register:
+        bill['register'] = register
+    style = rng.choices(list(payments), weights=list(payments.values()))[0]
+    # Round up to a handful of notes, so the drawer has to make change
+    rounded = -(-grand_total // 50) * 50
+    if style == 'exact':
+        bill['customer_payment_denominations'] = _greedy_notes(grand_total)
+    elif style == 'notes':
+        bill['customer_payment_denominations'] = _greedy_notes(rounded)
+    else:
+        bill['amount_paid'] = rounded
+    return bill
+
+
+class ClientTill:
+    """Posts bills through Django's test client in this thread, counting its queries"""
+
+    def __init__(self):
+        self.client = Client(SERVER_NAME='localhost')
+        self.path = reverse('generate_bill')
+        self.queries = 0
+        self.locked = 0
+        # Installed for the till's lifetime on this thread's connection
+        connection.execute_wrappers.append(self._count)
+
+    def _count(self, execute, sql, params, many, context):
+        self.queries += 1
+        try:
+            return execute(sql, params, many, context)
+        except Exception as e:
+            self.locked += 'locked' in str(e)
+            raise
+
+    def post(self, bill):
+        self.queries = 0
+        response = self.client.post(self.path, bill, content_type='application/json')
+        return response.json(), self.queries
+
+
+class LiveTill:
+    """Posts bills to a running server over HTTP; queries and lock errors are not visible from here"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/') + reverse('generate_bill')
+        self.locked = None
+
+    def post(self, bill):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(bill).encode(), headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read()), None
+
+
+def _till(worker, bills, options, results):
+    till = LiveTill(options['url']) if options['url'] else ClientTill()
+    # A forked till counts retries in its own copy of CHECKOUT_RETRIES, so it reports its
+    # own delta; threads share the parent's counter, which handle() snapshots once per run.
+    forked = options['mode'] == 'processes'
+    retries_before = CHECKOUT_RETRIES.values() if forked else None
+    latencies = []
+    queries = []
+    succeeded = 0
+    for bill in bills:
+        started = time.perf_counter()
+        result, query_count = till.post(bill)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if result.get('success'):
+            succeeded += 1
+            if query_count is not None:
+                queries.append(query_count)
+    retries = {
+        reason: count - retries_before.get(reason, 0)
+        for reason, count in CHECKOUT_RETRIES.values().items()
+    } if forked else {}
+    connection.close()
+    results.put({
+        'latencies': latencies,
+        'queries': queries,
+        'succeeded': succeeded,
+        'locked': till.locked,
+        'retries': retries,
+    })
+
+
+def _scrape_retries(url):
+    with urllib.request.urlopen(url.rstrip('/') + reverse('metrics')) as response:
+        body = response.read().decode()
+    return {reason: int(count) for reason, count in RETRIES_PATTERN.findall(body)}
+
+
+class Command(BaseCommand):
+    help = 'Load-test generate_bill from concurrent tills and print throughput, latency, queries and retries as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('threads', 'processes'), default='threads', help='How tills run concurrently')
+        parser.add_argument('--tills', type=int, default=4, help='Concurrent tills (threads or processes)')
+        parser.add_argument('--bills', type=int, default=100, help='Bills per till')
+        parser.add_argument('--basket-sizes', default='1,3,5,10', help='Comma separated basket sizes, picked uniformly per bill')
+        parser.add_argument('--payments', default='exact=1,notes=2,amount=1', help=f'Weighted payment styles: {", ".join(PAYMENT_STYLES)}')
+        parser.add_argument('--products', type=int, default=1000, help='Synthetic catalog size')
+        parser.add_argument('--hot-products', type=int, default=0, help='Draw every line from only the first N products (0: whole catalog)')
+        parser.add_argument('--registers', type=int, default=0, help='Spread tills round-robin over N registers with their own drawers (0: all on the default register)')
+        parser.add_argument('--url', help='Base URL of a running server; its database is seeded with BENCH products instead of a scratch file')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', '-o', help='Also write the JSON report to this file')
+
+    def _seed(self, options):
+        """Create (or top up) the synthetic catalog and drawer; returns [(product_id, price, tax)]"""
+        rng = random.Random(options['seed'])
+        lines_per_product = options['tills'] * options['bills'] * max(options['basket_sizes']) * 3
+        products = [
+            Product(
+                product_id=f'{BENCH_PREFIX}{index:05d}',
+                name=f'Bench Product {index}',
+                available_stock=lines_per_product,
+                price_per_unit=Decimal(rng.randint(1000, 50000)) / 100,
+                tax_percentage=Decimal(rng.choice([0, 5, 12, 18])),
+            )
+            for index in range(options['products'])
+        ]
+        Product.objects.bulk_create(
+            products, batch_size=1000, update_conflicts=True, unique_fields=['product_id'],
+            update_fields=['name', 'available_stock', 'price_per_unit', 'tax_percentage']
+        )
+        registers = [
+            Register.objects.update_or_create(code=code, defaults={'name': code.replace('-', ' ').title()})[0]
+            for code in self._register_codes(options)
+        ] or [Register.objects.get(pk=default_register())]
+        for register in registers:
+            for note in NOTES:
+                Denomination.objects.update_or_create(register=register, value=Decimal(note), defaults={'count': 1_000_000})
+        catalog = [(product.product_id, product.price_per_unit, product.tax_percentage) for product in products]
+        if options['hot_products']:
+            catalog = catalog[:options['hot_products']]
+        return catalog
+
+    def _register_codes(self, options):
+        return [f'{BENCH_PREFIX.lower()}-{index}' for index in range(options['registers'])]
+
+    def _run(self, catalog, options):
+        registers = self._register_codes(options)
+        plans = []
+        for worker in range(options['tills']):
+            rng = random.Random(options['seed'] * 1000 + worker)
+            register = registers[worker % len(registers)] if registers else None
+            plans.append([
+                build_bill(rng, catalog, options['basket_sizes'], options['payments'], worker, register)
+                for _ in range(options['bills'])
+            ])
+
+        if options['mode'] == 'processes':
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            connection.close()
+            tills = [context.Process(target=_till, args=(worker, plans[worker], options, results)) for worker in range(options['tills'])]
+        else:
+            results = queue.Queue()
+            tills = [threading.Thread(target=_till, args=(worker, plans[worker], options, results)) for worker in range(options['tills'])]
+
+        started = time.perf_counter()
+        for till in tills:
+            till.start()
+        outcomes = [results.get() for _ in tills]
+        elapsed = time.perf_counter() - started
+        for till in tills:
+            till.join()
+        return outcomes, elapsed
+
+    def handle(self, *args, **options):
+        options['basket_sizes'] = [int(size) for size in options['basket_sizes'].split(',')]
+        options['payments'] = _parse_weights(options['payments'])
+        if max(options['basket_sizes']) > min(options['hot_products'] or options['products'], options['products']):
+            raise CommandError('Basket sizes cannot exceed the number of products lines are drawn from')
+
+        if options['url']:
+            catalog = self._seed(options)
+            retries_before = _scrape_retries(options['url'])
+            outcomes, elapsed = self._run(catalog, options)
+            retries_after = _scrape_retries(options['url'])
+            retries = {reason: count - retries_before.get(reason, 0) for reason, count in retries_after.items()}
+        else:
+            with scratch_database():
+                catalog = self._seed(options)
+                retries_before = CHECKOUT_RETRIES.values()
+                outcomes, elapsed = self._run(catalog, options)
+                retries_after = CHECKOUT_RETRIES.values()
+            retries = {reason: count - retries_before.get(reason, 0) for reason, count in retries_after.items()}
+            for outcome in outcomes:
+                for reason, count in outcome['retries'].items():
+                    retries[reason] = retries.get(reason, 0) + count
+
+        latencies = [latency for outcome in outcomes for latency in outcome['latencies']]
+        queries = [count for outcome in outcomes for count in outcome['queries']]
+        succeeded = sum(outcome['succeeded'] for outcome in outcomes)
+        report = {
+            'config': {
+                'mode': options['mode'],
+                'tills': options['tills'],
+                'bills_per_till': options['bills'],
+                'basket_sizes': options['basket_sizes'],
+                'payments': options['payments'],
+                'products': options['products'],
+                'hot_products': options['hot_products'],
+                'registers': options['registers'],
+                'target': options['url'] or 'test-client',
+                'database_profile': settings.DATABASE_PROFILE,
+                'seed': options['seed'],
+            },
+            'bills': len(latencies),
+            'succeeded': succeeded,
+            'failed': len(latencies) - succeeded,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_bills_per_second': round(succeeded / elapsed, 1),
+            'latency_ms': {name: round(value, 2) for name, value in percentiles(latencies).items()},
+            'queries_per_checkout': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            } if queries else None,
+            'lock_retries': retries,
+            'database_locked_errors': None if options['url'] else sum(outcome['locked'] for outcome in outcomes),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
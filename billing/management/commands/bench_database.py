@@ -0,0 +1,108 @@
+import multiprocessing
+import random
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connections
+from billing.benchmarks import percentiles, scratch_database
+from billing.checkout import process_bill
+from billing.models import Denomination, Product, default_register
+
+
+def _till(worker, options, results):
+    """One till in its own process: ring up bills back to back, like sequential requests"""
+    rng = random.Random(options['seed'] + worker)
+    product_ids = [f'H{index:03d}' for index in range(options['products'])]
+    latencies = []
+    failed = 0
+    locked = 0
+    for _ in range(options['bills']):
+        started = time.perf_counter()
+        try:
+            result = process_bill({
+                'customer_email': f'till{worker}@example.com',
+                'products': [{'product_id': product_id, 'quantity': 1} for product_id in rng.sample(product_ids, options['basket'])],
+                'customer_payment_denominations': {'100': 1},
+            })
+            failed += not result['success']
+        except OperationalError as e:
+            failed += 1
+            locked += 'locked' in str(e)
+        latencies.append((time.perf_counter() - started) * 1000)
+        # What request_finished does: drop the connection unless CONN_MAX_AGE keeps it
+        close_old_connections()
+    connections.close_all()
+    results.put((latencies, failed, locked))
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent tills against a scratch SQLite file under each database profile and compare throughput and lock errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='default,production', help='Comma separated profiles from settings.DATABASE_PROFILES')
+        parser.add_argument('--tills', type=int, default=8, help='Concurrent till processes')
+        parser.add_argument('--bills', type=int, default=100, help='Bills per till')
+        parser.add_argument('--basket', type=int, default=3, help='Products per bill')
+        parser.add_argument('--products', type=int, default=5, help='Hot products every till sells from')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _seed(self, connection, options):
+        Product.objects.bulk_create([
+            Product(
+                product_id=f'H{index:03d}',
+                name=f'Hot Product {index}',
+                available_stock=options['tills'] * options['bills'] * options['basket'],
+                price_per_unit=Decimal('10.00'),
+                tax_percentage=Decimal('5.00'),
+            )
+            for index in range(options['products'])
+        ])
+        register_id = default_register()
+        Denomination.objects.bulk_create([
+            Denomination(register_id=register_id, value=Decimal(value), count=1_000_000)
+            for value in (500, 100, 50, 20, 10, 5, 2, 1)
+        ])
+        connection.close()
+
+    def _run(self, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        tills = [context.Process(target=_till, args=(worker, options, results)) for worker in range(options['tills'])]
+        started = time.perf_counter()
+        for till in tills:
+            till.start()
+        outcomes = [results.get() for _ in tills]
+        elapsed = time.perf_counter() - started
+        for till in tills:
+            till.join()
+
+        latencies = [latency for till_latencies, _, _ in outcomes for latency in till_latencies]
+        return {
+            # Rejected bills return fast; only committed ones count as throughput
+            'committed_per_second': (len(latencies) - sum(failed for _, failed, _ in outcomes)) / elapsed,
+            **percentiles(latencies),
+            'failed': sum(failed for _, failed, _ in outcomes),
+            'locked': sum(locked for _, _, locked in outcomes),
+        }
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'].split(',')
+        unknown = [profile for profile in profiles if profile not in settings.DATABASE_PROFILES]
+        if unknown:
+            raise CommandError(f'Unknown profile(s): {", ".join(unknown)}')
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('bench_database compares SQLite profiles')
+
+        self.stdout.write(
+            f"{options['tills']} tills x {options['bills']} bills, {options['basket']} of {options['products']} hot products per bill"
+        )
+        self.stdout.write(f"{'profile':<12}{'ok/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}{'locked':>8}")
+        for profile in profiles:
+            with scratch_database(profile) as connection:
+                self._seed(connection, options)
+                row = self._run(options)
+            self.stdout.write(
+                f"{profile:<12}{row['committed_per_second']:>10.1f}{row['p50']:>10.2f}{row['p95']:>10.2f}"
+                f"{row['p99']:>10.2f}{row['failed']:>8}{row['locked']:>8}"
+            )
@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from billing.benchmarks import scratch_database
+from billing.models import Product
+from billing.search import search_products_ranked
+
+WORDS = [
+    'basmati', 'rice', 'wheat', 'flour', 'sugar', 'salt', 'tea', 'coffee', 'milk', 'ghee',
+    'butter', 'paneer', 'curd', 'masala', 'turmeric', 'chilli', 'cumin', 'mustard', 'oil', 'soap',
+    'shampoo', 'biscuit', 'noodles', 'lentil', 'chana', 'toor', 'moong', 'jaggery', 'honey', 'pickle',
+]
+QUERIES = ['P00012', 'p0042', 'bas', 'masala tea', 'rice', 'gh', 'soap 5', 'P9', 'toor dal', 'xyz']
+
+
+def legacy_search(query):
+    """The icontains scan the search endpoint used before the FTS index"""
+    return list(Product.objects.filter(
+        Q(product_id__icontains=query) | Q(name__icontains=query)
+    ).filter(available_stock__gt=0).order_by('name').values_list('product_id', 'available_stock')[:10])
+
+
+class Command(BaseCommand):
+    help = 'Compare indexed product search with the old icontains scan on synthetic catalogs in scratch databases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000', help='Comma separated catalog sizes, e.g. 10000,100000,1000000')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _seed(self, count, rng):
+        products = (
+            Product(
+                product_id=f'P{index:07d}',
+                name=' '.join(rng.sample(WORDS, 3)) + f' {rng.randint(1, 999)}g',
+                available_stock=rng.randint(0, 500),
+                price_per_unit=Decimal(rng.randint(100, 99999)) / 100,
+                tax_percentage=Decimal(rng.choice([0, 5, 12, 18])),
+            )
+            for index in range(count)
+        )
+        batch = []
+        for product in products:
+            batch.append(product)
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+
+    def _percentiles(self, func, repeat):
+        samples = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                started = time.perf_counter()
+                func(query)
+                samples.append((time.perf_counter() - started) * 1000)
+        quantiles = statistics.quantiles(samples, n=100)
+        return quantiles[49], quantiles[94]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        
+        self.stdout.write(f"{'products':>10}  {'search':<10}{'p50 ms':>10}{'p95 ms':>10}")
+        for size in sizes:
+            with scratch_database():
+                self._seed(size, rng)
+                for label, func in (('indexed', search_products_ranked), ('icontains', legacy_search)):
+                    p50, p95 = self._percentiles(func, options['repeat'])
+                    self.stdout.write(f'{size:>10}  {label:<10}{p50:>10.2f}{p95:>10.2f}')
@@ -0,0 +1,28 @@
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from billing.export import EXPORT_FORMATS, export_purchases
+
+
+class Command(BaseCommand):
+    help = 'Stream purchases with their line items and change breakdown to a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to export (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to export, inclusive')
+        parser.add_argument('--email', default='', help='Complete address or address prefix')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        chunks = export_purchases(options['format'], options['start'], options['end'], options['email'], options['gzip'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
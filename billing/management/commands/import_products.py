@@ -0,0 +1,46 @@
+import io
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from billing.imports import DEFAULT_IMPORT_CHUNK_SIZE, IMPORT_FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = 'Create or update products from a CSV or JSON Lines file (columns: product_id, name, available_stock, price_per_unit, tax_percentage)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_IMPORT_CHUNK_SIZE, help='Rows upserted per transaction')
+        parser.add_argument('--max-errors-shown', type=int, default=20)
+
+    def _progress(self, result):
+        self.stdout.write(f'{result.rows} rows, {result.imported} imported, {result.error_count} failed ({result.rows_per_second:,.0f} rows/s)')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or detect_format(options['path'])
+        if import_format is None:
+            raise CommandError('Cannot tell the file format from its name; pass --format csv or --format jsonl')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        
+        if options['path'] == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        else:
+            try:
+                stream = open(options['path'], encoding='utf-8-sig', newline='')
+            except OSError as e:
+                raise CommandError(f'Cannot open {options["path"]}: {e}')
+        
+        with stream:
+            result = import_products(stream, import_format, options['chunk_size'], progress=self._progress)
+        
+        for row_number, message in result.errors[:options['max_errors_shown']]:
+            self.stderr.write(f'row {row_number}: {message}')
+        if result.error_count > options['max_errors_shown']:
+            self.stderr.write(f'... and {result.error_count - options["max_errors_shown"]} more errors')
+        
+        style = self.style.SUCCESS if not result.error_count else self.style.WARNING
+        self.stdout.write(style(
+            f'Imported {result.imported} of {result.rows} rows in {result.elapsed:.2f}s '
+            f'({result.rows_per_second:,.0f} rows/s), {result.error_count} failed'
+        ))
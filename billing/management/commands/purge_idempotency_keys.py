@@ -0,0 +1,23 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from billing.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys (and their stored responses) older than the TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help='Key lifetime in seconds; defaults to IDEMPOTENCY_KEY_TTL')
+        parser.add_argument('--interval', type=float, help='Keep running and sweep every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        ttl = timedelta(seconds=options['ttl']) if options['ttl'] is not None else None
+        
+        while True:
+            deleted = purge_expired_keys(ttl)
+            self.stdout.write(f'Purged {deleted} expired idempotency key(s)')
+            
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
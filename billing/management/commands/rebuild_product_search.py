@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from billing.models import Product
+from billing.search import FTS_TABLE, fts_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product name index from the product table'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('The product search table does not exist; run migrate on a SQLite build with FTS5.')
+        
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, name) SELECT id, name FROM {Product._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Product.objects.count()} product names'))
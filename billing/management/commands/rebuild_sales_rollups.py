@@ -0,0 +1,41 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from billing.models import Purchase
+from billing.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from purchase history in date-range chunks; safe while tills are checking out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day to rebuild (YYYY-MM-DD); defaults to the first purchase')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day to rebuild, inclusive; defaults to the last purchase')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days aggregated per chunk')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks rebuilt in parallel (SQLite rebuilds one at a time)')
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-days and --workers must be at least 1')
+        
+        start, end = options['start'], options['end']
+        if start is None or end is None:
+            bounds = Purchase.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+            if bounds['first'] is None:
+                self.stdout.write('No purchases to roll up')
+                return
+            start = start or timezone.localdate(bounds['first'])
+            end = end or timezone.localdate(bounds['last'])
+        if end < start:
+            raise CommandError('--end must not be before --start')
+        
+        started = time.perf_counter()
+        product_rows, tax_rows = rebuild_rollups(
+            start, end + timedelta(days=1), chunk_days=options['chunk_days'], workers=options['workers']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {start}..{end}: {product_rows} product rows, {tax_rows} tax rate rows '
+            f'in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand
+from billing.outbox import LOCAL_EMAIL_BACKENDS, drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued invoice emails from the outbox in batches over a reused connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails fetched and sent per batch')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before an email is marked as failed')
+        parser.add_argument('--retry-delay', type=int, default=30, help='Base retry delay in seconds (doubles per attempt)')
+        parser.add_argument('--max-retry-delay', type=int, default=3600, help='Upper bound for the retry delay in seconds')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument(
+            '--backend',
+            help=f'Email backend path or local stand-in ({", ".join(LOCAL_EMAIL_BACKENDS)}); defaults to EMAIL_BACKEND'
+        )
+
+    def handle(self, *args, **options):
+        idle_delay = options['interval']
+        
+        while True:
+            started = time.monotonic()
+            try:
+                sent, failed = drain_outbox(
+                    backend=options['backend'],
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts'],
+                    base_delay=options['retry_delay'],
+                    max_delay=options['max_retry_delay']
+                )
+            except Exception as e:
+                # Typically the mail server is unreachable; back off before trying again
+                self.stderr.write(f'Outbox drain failed: {e}')
+                if options['once']:
+                    raise
+                idle_delay = min(idle_delay * 2, options['max_retry_delay'])
+                time.sleep(idle_delay)
+                continue
+            
+            idle_delay = options['interval']
+            elapsed = time.monotonic() - started
+            if sent or failed:
+                rate = sent / elapsed if elapsed > 0 else 0
+                self.stdout.write(f'Sent {sent}, failed {failed} in {elapsed:.2f}s ({rate:.1f} emails/s)')
+            
+            if options['once']:
+                break
+            time.sleep(idle_delay)
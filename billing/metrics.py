@@ -0,0 +1,143 @@
+"""
+In-process checkout metrics exposed in Prometheus text format
+
+Each worker process keeps its own histograms; scrape every worker (or sum them
+in Prometheus) to get the full picture.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from django.db import connection
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a single label value"""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, amount):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += amount
+            series['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_value in sorted(self._series):
+                series = self._series[label_value]
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a single label value"""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def values(self):
+        """Current value of every label, as a dict"""
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_value in sorted(self._values):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {self._values[label_value]}')
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'billing_checkout_stage_seconds',
+    'Time spent in each checkout stage',
+    'stage', SECONDS_BUCKETS
+)
+STAGE_QUERIES = Histogram(
+    'billing_checkout_stage_queries',
+    'Database queries issued by each checkout stage',
+    'stage', QUERY_BUCKETS
+)
+BILLS = Counter(
+    'billing_checkout_bills_total',
+    'Bills processed by the checkout pipeline',
+    'result'
+)
+
+CHECKOUT_RETRIES = Counter(
+    'billing_checkout_retries_total',
+    'Checkout transactions rolled back and retried because stock, the drawer or an idempotency key changed underneath them',
+    'reason'
+)
+
+REGISTRY = [STAGE_SECONDS, STAGE_QUERIES, BILLS, CHECKOUT_RETRIES]
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Record wall time and database query count for a checkout stage
+    Stages may nest; queries are counted in every enclosing stage.
+    """
+    queries = [0]
+
+    def count_query(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(count_query):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.observe(stage, time.perf_counter() - started)
+            STAGE_QUERIES.observe(stage, queries[0])
+
+
+def render_metrics():
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for metric in REGISTRY:
+        metric.reset()
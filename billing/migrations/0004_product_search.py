@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:27
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+FTS_TABLE = 'billing_product_search'
+
+CREATE_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON billing_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = new.id;
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name ON billing_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON billing_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"INSERT INTO {FTS_TABLE}(rowid, name) SELECT id, name FROM billing_product",
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Full-text name search is SQLite FTS5 only; other databases fall back to icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        enabled = cursor.fetchone()[0]
+        if not enabled:
+            try:
+                cursor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE}_probe USING fts5(name)")
+                cursor.execute(f"DROP TABLE {FTS_TABLE}_probe")
+            except Exception:
+                return
+        for statement in CREATE_SQL:
+            cursor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Upper('product_id'), name='product_id_upper_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
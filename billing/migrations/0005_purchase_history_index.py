@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['created_at', 'id'], name='purchase_created_id_idx'),
+        ),
+    ]
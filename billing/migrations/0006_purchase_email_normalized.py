@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:37
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_normalized_email(apps, schema_editor):
+    """
+    Fill customer_email_normalized in primary-key chunks, one short transaction per
+    chunk, so checkouts can keep writing while a large history is migrated
+    """
+    Purchase = apps.get_model('billing', 'Purchase')
+    db_alias = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            chunk = list(
+                Purchase.objects.using(db_alias).filter(pk__gt=last_pk).order_by('pk')
+                .only('pk', 'customer_email')[:BACKFILL_CHUNK_SIZE]
+            )
+            if not chunk:
+                return
+            for purchase in chunk:
+                purchase.customer_email_normalized = (purchase.customer_email or '').strip().lower()
+            Purchase.objects.using(db_alias).bulk_update(chunk, ['customer_email_normalized'])
+        last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Each backfill chunk commits on its own
+    atomic = False
+
+    dependencies = [
+        ('billing', '0005_purchase_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='customer_email_normalized',
+            field=models.CharField(default='', editable=False, max_length=254),
+        ),
+        migrations.RunPython(backfill_normalized_email, migrations.RunPython.noop),
+        # Built after the backfill so it is not maintained row by row during it
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['customer_email_normalized', 'created_at', 'id'], name='purchase_email_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_purchase_email_normalized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseInvoice',
+            fields=[
+                ('purchase', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='invoice', serialize=False, to='billing.purchase')),
+                ('detail_html', models.BinaryField()),
+                ('email_html', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
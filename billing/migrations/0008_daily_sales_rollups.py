@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:40
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_purchaseinvoice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTaxSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('tax_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('tax_amount', models.DecimalField(decimal_places=4, default=Decimal('0.0000'), max_digits=16)),
+            ],
+            options={
+                'ordering': ['-day', 'tax_percentage'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'tax_percentage'), name='daily_tax_sales_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('tax_amount', models.DecimalField(decimal_places=4, default=Decimal('0.0000'), max_digits=16)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='billing.product')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='daily_product_sales_unique')],
+            },
+        ),
+    ]
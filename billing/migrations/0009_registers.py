@@ -0,0 +1,74 @@
+# Generated by Django 5.2.5 on 2026-10-17 08:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def move_drawer_to_default_register(apps, schema_editor):
+    """
+    The single global drawer becomes the default register's drawer, and every past
+    purchase was rung up on it. Duplicate rows for one value are merged into the
+    first, so the per-register uniqueness constraint can be added.
+    """
+    Register = apps.get_model('billing', 'Register')
+    Denomination = apps.get_model('billing', 'Denomination')
+    Purchase = apps.get_model('billing', 'Purchase')
+    db_alias = schema_editor.connection.alias
+
+    code = settings.DEFAULT_REGISTER
+    register, _ = Register.objects.using(db_alias).get_or_create(
+        code=code, defaults={'name': code.replace('-', ' ').title()}
+    )
+    denominations = Denomination.objects.using(db_alias)
+    duplicates = denominations.values('value').annotate(rows=models.Count('id'), total=Sum('count')).filter(rows__gt=1)
+    for duplicate in duplicates:
+        rows = denominations.filter(value=duplicate['value']).order_by('pk')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        denominations.filter(pk=keep.pk).update(count=duplicate['total'])
+    denominations.update(register=register)
+    Purchase.objects.using(db_alias).filter(register__isnull=True).update(register=register)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Register',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.SlugField(unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+        migrations.AddField(
+            model_name='denomination',
+            name='register',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='denominations', to='billing.register'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='register',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchases', to='billing.register'),
+        ),
+        migrations.RunPython(move_drawer_to_default_register, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='denomination',
+            name='register',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='denominations', to='billing.register'),
+        ),
+        migrations.AddConstraint(
+            model_name='denomination',
+            constraint=models.UniqueConstraint(fields=('register', 'value'), name='denomination_register_value_unique'),
+        ),
+    ]
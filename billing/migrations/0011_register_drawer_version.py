@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_catalog_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='register',
+            name='drawer_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
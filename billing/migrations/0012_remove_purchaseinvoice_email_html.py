@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0011_register_drawer_version'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='purchaseinvoice',
+            name='email_html',
+        ),
+    ]
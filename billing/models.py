@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Upper
+from django.utils import timezone
 from decimal import Decimal
 import uuid
 
@@ -17,8 +20,47 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Case-insensitive product_id prefix search (see billing.search)
+            models.Index(Upper('product_id'), name='product_id_upper_idx'),
+            # Catalog snapshot version and changes feed (see billing.catalog_snapshot)
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+        ]
+
+class DeletedProduct(models.Model):
+    """Tombstone of a deleted product, so catalog changes feeds can tell clients to drop it"""
+    product_id = models.CharField(max_length=50)
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.product_id} deleted {self.deleted_at}"
+
+class Register(models.Model):
+    """A till with its own cash drawer; checkouts only touch their register's Denomination rows"""
+    code = models.SlugField(max_length=50, unique=True)
+    name = models.CharField(max_length=100)
+    # Bumped with every change to this register's Denomination rows (see billing.drawer)
+    drawer_version = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['code']
+
+def default_register():
+    """
+    Primary key of settings.DEFAULT_REGISTER, created on first use
+    Not a field default: callers that create drawer rows resolve their register explicitly
+    """
+    register, _ = Register.objects.get_or_create(
+        code=settings.DEFAULT_REGISTER, defaults={'name': settings.DEFAULT_REGISTER.replace('-', ' ').title()}
+    )
+    return register.pk
 
 class Denomination(models.Model):
+    register = models.ForeignKey(Register, on_delete=models.CASCADE, related_name='denominations')
     value = models.DecimalField(max_digits=10, decimal_places=2)
     count = models.PositiveIntegerField(default=0)
     
@@ -27,22 +69,43 @@ class Denomination(models.Model):
     
     class Meta:
         ordering = ['-value']
+        constraints = [
+            models.UniqueConstraint(fields=['register', 'value'], name='denomination_register_value_unique'),
+        ]
+
+def normalize_email(email):
+    """Lookup form of a customer email: trimmed and lower-cased"""
+    return (email or '').strip().lower()
 
 class Purchase(models.Model):
     purchase_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     customer_email = models.EmailField()
+    # Kept in step with customer_email by save(); bulk_create callers must set it themselves
+    customer_email_normalized = models.CharField(max_length=254, default='', editable=False)
     total_amount = models.DecimalField(max_digits=12, decimal_places=2)
     tax_amount = models.DecimalField(max_digits=12, decimal_places=2)
     grand_total = models.DecimalField(max_digits=12, decimal_places=2)
     amount_paid = models.DecimalField(max_digits=12, decimal_places=2)
     change_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # The till whose drawer took the payment and gave the change
+    register = models.ForeignKey(Register, on_delete=models.SET_NULL, null=True, blank=True, related_name='purchases')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Purchase {self.purchase_id} - {self.customer_email}"
 
+    def save(self, *args, **kwargs):
+        self.customer_email_normalized = normalize_email(self.customer_email)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination for purchase history (see billing.history)
+            models.Index(fields=['created_at', 'id'], name='purchase_created_id_idx'),
+            # Exact and prefix customer lookups, newest first
+            models.Index(fields=['customer_email_normalized', 'created_at', 'id'], name='purchase_email_created_idx'),
+        ]
 
 class PurchaseItem(models.Model):
     purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='items')
@@ -61,4 +124,88 @@ class ChangeBreakdown(models.Model):
     count = models.PositiveIntegerField()
 
     def __str__(self):
-        return f"₹{self.denomination_value} x {self.count}"
\ No newline at end of file
+        return f"₹{self.denomination_value} x {self.count}"
+
+
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='emails')
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email} ({self.status})"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+class PurchaseInvoice(models.Model):
+    purchase = models.OneToOneField(Purchase, on_delete=models.CASCADE, primary_key=True, related_name='invoice')
+    # zlib-compressed HTML, rendered once when the purchase commits (see billing.invoices)
+    detail_html = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Invoice {self.purchase_id}"
+
+class DailyProductSales(models.Model):
+    """Units, net revenue and tax per local day and product, kept up to date by checkout"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    tax_amount = models.DecimalField(max_digits=16, decimal_places=4, default=Decimal('0.0000'))
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.units} units"
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_unique'),
+        ]
+
+class DailyTaxSales(models.Model):
+    """Units, net revenue and tax per local day and tax rate, kept up to date by checkout"""
+    day = models.DateField()
+    tax_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    tax_amount = models.DecimalField(max_digits=16, decimal_places=4, default=Decimal('0.0000'))
+
+    def __str__(self):
+        return f"{self.day} {self.tax_percentage}%: ₹{self.tax_amount}"
+
+    class Meta:
+        ordering = ['-day', 'tax_percentage']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'tax_percentage'], name='daily_tax_sales_unique'),
+        ]
+
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255, unique=True)
+    purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='idempotency_keys')
+    response = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.key
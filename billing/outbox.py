@@ -0,0 +1,121 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# Django backends that can stand in for SMTP when testing the outbox offline
+LOCAL_EMAIL_BACKENDS = {
+    'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+    'file': 'django.core.mail.backends.filebased.EmailBackend',
+    'console': 'django.core.mail.backends.console.EmailBackend',
+}
+
+def build_invoice_email(purchase, items, change_breakdown, html_message=None):
+    """
+    Render the invoice email into an unsaved outbox row
+    Pass html_message to reuse an invoice already rendered for the purchase (see billing.invoices)
+    """
+    if html_message is None:
+        html_message = render_to_string('billing/email_invoice.html', {
+            'purchase': purchase,
+            'items': items,
+            'change_breakdown': change_breakdown
+        })
+    
+    return EmailOutbox(
+        purchase=purchase,
+        to_email=purchase.customer_email,
+        subject=f'Invoice - Purchase {purchase.purchase_id}',
+        body=strip_tags(html_message),
+        html_body=html_message
+    )
+
+def get_outbox_connection(backend=None):
+    """
+    Get an email connection for the outbox worker
+    backend may be a full backend path or one of LOCAL_EMAIL_BACKENDS; defaults to settings.EMAIL_BACKEND
+    """
+    backend = LOCAL_EMAIL_BACKENDS.get(backend, backend)
+    return get_connection(backend=backend, fail_silently=False)
+
+def get_retry_delay(attempts, base_delay, max_delay):
+    """
+    Exponential backoff in seconds for the given number of failed attempts
+    """
+    return min(base_delay * (2 ** max(attempts - 1, 0)), max_delay)
+
+def send_outbox_batch(connection, batch_size=50, max_attempts=5, base_delay=30, max_delay=3600):
+    """
+    Send one batch of due outbox emails over an already open connection
+    Failed emails are rescheduled with exponential backoff until max_attempts is reached.
+    Returns a tuple of (sent_count, failed_count)
+    """
+    now = timezone.now()
+    batch = list(
+        EmailOutbox.objects.filter(
+            status=EmailOutbox.STATUS_PENDING,
+            next_attempt_at__lte=now
+        ).order_by('next_attempt_at', 'id')[:batch_size]
+    )
+    
+    sent_ids = []
+    failed_emails = []
+    
+    for email in batch:
+        message = EmailMultiAlternatives(
+            email.subject,
+            email.body,
+            settings.DEFAULT_FROM_EMAIL,
+            [email.to_email],
+            connection=connection
+        )
+        if email.html_body:
+            message.attach_alternative(email.html_body, 'text/html')
+        
+        try:
+            connection.send_messages([message])
+            sent_ids.append(email.id)
+        except Exception as e:
+            logger.warning('Sending outbox email %s to %s failed: %s', email.id, email.to_email, e)
+            email.attempts += 1
+            email.last_error = str(e)
+            if email.attempts >= max_attempts:
+                email.status = EmailOutbox.STATUS_FAILED
+            else:
+                email.next_attempt_at = now + timedelta(seconds=get_retry_delay(email.attempts, base_delay, max_delay))
+            failed_emails.append(email)
+    
+    if sent_ids:
+        EmailOutbox.objects.filter(id__in=sent_ids).update(
+            status=EmailOutbox.STATUS_SENT,
+            sent_at=timezone.now(),
+            last_error=''
+        )
+    if failed_emails:
+        EmailOutbox.objects.bulk_update(failed_emails, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+    
+    return len(sent_ids), len(failed_emails)
+
+def drain_outbox(backend=None, batch_size=50, max_attempts=5, base_delay=30, max_delay=3600):
+    """
+    Send every due outbox email in batches, reusing a single connection
+    Returns a tuple of (sent_count, failed_count)
+    """
+    total_sent = 0
+    total_failed = 0
+    
+    with get_outbox_connection(backend) as connection:
+        while True:
+            sent, failed = send_outbox_batch(connection, batch_size, max_attempts, base_delay, max_delay)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                break
+    
+    return total_sent, total_failed
@@ -0,0 +1,186 @@
+"""
+Daily sales rollups, maintained incrementally by checkout
+
+Every checkout chunk adds its line items to DailyProductSales (per day and
+product) and DailyTaxSales (per day and tax rate) with one upsert-increment
+statement per table, inside the checkout transaction. Reports read only these
+tables. rebuild_rollups() recomputes them from Purchase/PurchaseItem history.
+Days are local dates in settings.TIME_ZONE.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from django.db import connection, connections, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import DailyProductSales, DailyTaxSales, PurchaseItem
+
+ROLLUP_COLUMNS = ('units', 'revenue', 'tax_amount')
+# Rows per upsert statement, well inside SQLite's bound parameter limit
+UPSERT_BATCH_SIZE = 500
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def _upsert_increment(model, key_fields, rows):
+    """
+    Add rows of {key fields..., units, revenue, tax_amount} to a rollup table in one statement
+    Existing rows are incremented (INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col)
+    """
+    if not rows:
+        return
+    if len(rows) > UPSERT_BATCH_SIZE:
+        for offset in range(0, len(rows), UPSERT_BATCH_SIZE):
+            _upsert_increment(model, key_fields, rows[offset:offset + UPSERT_BATCH_SIZE])
+        return
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in (*key_fields, *ROLLUP_COLUMNS)]
+    columns = [field.column for field in fields]
+    key_columns = columns[:len(key_fields)]
+
+    params = []
+    for row in rows:
+        params.extend(field.get_db_prep_save(row[field.attname], connection) for field in fields)
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))
+    table = quote(model._meta.db_table)
+    column_list = ', '.join(quote(column) for column in columns)
+
+    if connection.vendor == 'mysql':
+        updates = ', '.join(f'{quote(column)} = {quote(column)} + VALUES({quote(column)})' for column in columns[len(key_fields):])
+        conflict = f'ON DUPLICATE KEY UPDATE {updates}'
+    else:
+        updates = ', '.join(f'{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}' for column in columns[len(key_fields):])
+        conflict = f'ON CONFLICT ({", ".join(quote(column) for column in key_columns)}) DO UPDATE SET {updates}'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} ({column_list}) VALUES {placeholders} {conflict}', params)
+
+def _add(totals, key, units, revenue, tax_amount):
+    row = totals.get(key)
+    if row is None:
+        totals[key] = [units, revenue, tax_amount]
+    else:
+        row[0] += units
+        row[1] += revenue
+        row[2] += tax_amount
+
+def record_bill_sales(bills):
+    """
+    Add a chunk of committed bills to the daily rollups (two queries)
+    Must run inside the checkout transaction so the rollups commit with the purchases
+    """
+    by_product = {}
+    by_tax_rate = {}
+    for bill in bills:
+        day = timezone.localdate(bill['purchase'].created_at)
+        for item in bill['items']:
+            product = item['product']
+            tax_amount = item['item_subtotal'] * product.tax_percentage / 100
+            _add(by_product, (day, product.pk), item['quantity'], item['item_subtotal'], tax_amount)
+            _add(by_tax_rate, (day, product.tax_percentage), item['quantity'], item['item_subtotal'], tax_amount)
+
+    _upsert_increment(DailyProductSales, ('day', 'product_id'), [
+        {'day': day, 'product_id': product_pk, 'units': units, 'revenue': revenue, 'tax_amount': tax_amount}
+        for (day, product_pk), (units, revenue, tax_amount) in by_product.items()
+    ])
+    _upsert_increment(DailyTaxSales, ('day', 'tax_percentage'), [
+        {'day': day, 'tax_percentage': rate, 'units': units, 'revenue': revenue, 'tax_amount': tax_amount}
+        for (day, rate), (units, revenue, tax_amount) in by_tax_rate.items()
+    ])
+
+def aggregate_range(start, end):
+    """
+    Rollup rows for local days start <= day < end, computed from PurchaseItem history
+    Returns (product rows, tax rate rows) as lists of DailyProductSales / DailyTaxSales
+    """
+    items = PurchaseItem.objects.filter(
+        purchase__created_at__gte=_day_start(start),
+        purchase__created_at__lt=_day_start(end)
+    ).annotate(
+        day=TruncDate('purchase__created_at', tzinfo=timezone.get_current_timezone())
+    )
+    # Divide by a float literal: SQLite stores whole decimals as integers and would truncate
+    tax = ExpressionWrapper(F('subtotal') * F('tax_percentage') / Value(100.0), output_field=DecimalField(max_digits=16, decimal_places=4))
+    totals = {'units': Sum('quantity'), 'revenue': Sum('subtotal'), 'tax_amount': Sum(tax)}
+
+    product_rows = [
+        DailyProductSales(day=row['day'], product_id=row['product_id'], **{name: row[name] for name in ROLLUP_COLUMNS})
+        for row in items.values('day', 'product_id').annotate(**totals).order_by()
+    ]
+    tax_rows = [
+        DailyTaxSales(day=row['day'], tax_percentage=row['tax_percentage'], **{name: row[name] for name in ROLLUP_COLUMNS})
+        for row in items.values('day', 'tax_percentage').annotate(**totals).order_by()
+    ]
+    return product_rows, tax_rows
+
+def _lock_rollups(start, end):
+    """
+    Delete the rollups for start <= day < end, first taking the lock checkout's increments need
+    SQLite's DELETE takes the database write lock; PostgreSQL locks the tables against row writes.
+    Until the transaction commits, a checkout either committed before (and is in the history the
+    caller aggregates next) or waits and then increments the rebuilt rows.
+    """
+    if connection.vendor == 'postgresql':
+        quote = connection.ops.quote_name
+        tables = ', '.join(quote(model._meta.db_table) for model in (DailyProductSales, DailyTaxSales))
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE')
+    DailyProductSales.objects.filter(day__gte=start, day__lt=end).delete()
+    DailyTaxSales.objects.filter(day__gte=start, day__lt=end).delete()
+
+def rebuild_chunk(start, end):
+    """Recompute and replace the rollups for start <= day < end in one locked transaction"""
+    with transaction.atomic():
+        _lock_rollups(start, end)
+        product_rows, tax_rows = aggregate_range(start, end)
+        DailyProductSales.objects.bulk_create(product_rows, batch_size=1000)
+        DailyTaxSales.objects.bulk_create(tax_rows, batch_size=1000)
+    return len(product_rows), len(tax_rows)
+
+def _rebuild_in_thread(start, end):
+    try:
+        return rebuild_chunk(start, end)
+    finally:
+        connections.close_all()
+
+def date_chunks(start, end, chunk_days):
+    """Split [start, end) into consecutive ranges of at most chunk_days days"""
+    chunks = []
+    while start < end:
+        chunk_end = min(start + timedelta(days=chunk_days), end)
+        chunks.append((start, chunk_end))
+        start = chunk_end
+    return chunks
+
+def rebuild_rollups(start, end, chunk_days=31, workers=1):
+    """
+    Replace the rollups for local days start <= day < end with totals recomputed from history
+    Each date-range chunk is aggregated and written in its own transaction, under the lock
+    checkout's increments wait for, so checkouts can keep running during a rebuild. Chunks
+    run on `workers` threads, each on its own connection, except on SQLite, where they would
+    only queue for its single write lock. Returns (product rows, tax rate rows) written.
+    """
+    chunks = date_chunks(start, end, chunk_days)
+    if workers > 1 and connection.vendor != 'sqlite':
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda chunk: _rebuild_in_thread(*chunk), chunks))
+    else:
+        results = [rebuild_chunk(*chunk) for chunk in chunks]
+    return sum(rows for rows, _ in results), sum(rows for _, rows in results)
+
+def sales_report(start, end):
+    """
+    Totals for local days start <= day < end, read from the rollup tables only
+    Returns {'days': [...], 'products': [...], 'tax_rates': [...], 'totals': {...}}
+    """
+    totals = {name: Sum(name) for name in ROLLUP_COLUMNS}
+    tax_sales = DailyTaxSales.objects.filter(day__gte=start, day__lt=end)
+    return {
+        'days': list(tax_sales.values('day').annotate(**totals).order_by('-day')),
+        'products': list(
+            DailyProductSales.objects.filter(day__gte=start, day__lt=end)
+            .values('product__product_id', 'product__name').annotate(**totals).order_by('-revenue')
+        ),
+        'tax_rates': list(tax_sales.values('tax_percentage').annotate(**totals).order_by('tax_percentage')),
+        'totals': tax_sales.aggregate(**totals),
+    }
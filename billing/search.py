@@ -0,0 +1,188 @@
+"""
+Indexed product search for the billing page autocomplete
+
+Matches are ranked in three tiers: an exact (case-insensitive) product_id, then
+product_id prefixes, then product names. The product_id tiers are one range scan
+over the UPPER(product_id) expression index. Names are matched by token prefix
+through the SQLite FTS5 table created in migration 0004 and kept in sync by
+triggers; other databases fall back to a name icontains scan.
+
+Results are kept in a small per-worker LRU that is valid for one catalog and
+stock version, so many tills typing the same prefixes share one query. Results
+carry stock, so they are only cached when the version stamps are shared.
+"""
+import re
+import threading
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models.functions import Upper
+from .catalog import aget_catalog_version, aget_stock_version, get_catalog_version, get_stock_version, version_stamps_shared
+from .models import Product
+
+FTS_TABLE = 'billing_product_search'
+# Upper bound for a prefix range scan: sorts after every character that can follow the prefix
+PREFIX_SENTINEL = '\U0010ffff'
+TOKEN_PATTERN = re.compile(r'\w+')
+
+_fts_available = {}
+
+
+def fts_available(using='default'):
+    """Whether the FTS5 product search table exists on this connection"""
+    if not _fts_available.get(using):
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            available = cursor.fetchone() is not None
+        if not available:
+            # Not cached, so the table is picked up as soon as it is migrated in
+            return False
+        _fts_available[using] = True
+    return True
+
+
+def build_match_expression(query):
+    """
+    FTS5 MATCH expression requiring every token of the query as a prefix
+    Tokens are quoted so FTS5 operators typed by the user are matched literally
+    """
+    tokens = TOKEN_PATTERN.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _id_matches(query, limit):
+    """In-stock products whose product_id equals or starts with the query, exact match first"""
+    prefix = query.upper()
+    return (
+        Product.objects.annotate(product_id_upper=Upper('product_id'))
+        .filter(product_id_upper__gte=prefix, product_id_upper__lt=prefix + PREFIX_SENTINEL, available_stock__gt=0)
+        .order_by('product_id_upper')
+        .values_list('product_id', 'available_stock')[:limit]
+    )
+
+
+def _name_matches(query, limit, using='default'):
+    """In-stock products whose name matches the query, best match first"""
+    if fts_available(using):
+        expression = build_match_expression(query)
+        if not expression:
+            return []
+        product_table = Product._meta.db_table
+        with connections[using].cursor() as cursor:
+            # Every in-stock match is ranked before the limit, so the best ones are never cut off
+            cursor.execute(
+                f'SELECT p.product_id, p.available_stock FROM {FTS_TABLE} s '
+                f'JOIN {product_table} p ON p.id = s.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND p.available_stock > 0 ORDER BY s.rank LIMIT %s',
+                [expression, limit]
+            )
+            return cursor.fetchall()
+    return list(
+        Product.objects.filter(name__icontains=query, available_stock__gt=0)
+        .order_by('name')
+        .values_list('product_id', 'available_stock')[:limit]
+    )
+
+
+def _merge(results, name_matches, limit):
+    """Append name matches not already found by product_id, up to limit"""
+    seen = {product_id for product_id, _ in results}
+    for product_id, stock in name_matches:
+        if product_id not in seen:
+            seen.add(product_id)
+            results.append((product_id, stock))
+            if len(results) == limit:
+                break
+    return results
+
+
+def search_products_ranked(query, limit=10):
+    """
+    Up to `limit` (product_id, available_stock) pairs for in-stock products matching the query
+    Costs at most two queries regardless of catalog size.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    results = list(_id_matches(query, limit))
+    if len(results) < limit:
+        # Over-fetch by the rows already found so duplicates do not leave the list short
+        _merge(results, _name_matches(query, limit + len(results)), limit)
+    return results
+
+
+async def asearch_products_ranked(query, limit=10):
+    """search_products_ranked for async views"""
+    query = query.strip()
+    if not query:
+        return []
+
+    results = [row async for row in _id_matches(query, limit)]
+    if len(results) < limit:
+        # The FTS query is raw SQL, which has no async cursor; it runs in the sync thread
+        _merge(results, await sync_to_async(_name_matches)(query, limit + len(results)), limit)
+    return results
+
+
+class SearchResultCache:
+    """Bounded LRU of ranked search results, valid for a single catalog and stock version"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _lookup(self, query, limit, version):
+        """(cached results or None, key, version) given the current (catalog, stock) versions"""
+        key = (' '.join(query.split()).casefold(), limit)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            results = self._entries.get(key)
+            if results is not None:
+                self._entries.move_to_end(key)
+                return list(results), key, version
+        return None, key, version
+
+    def _store(self, key, version, results):
+        with self._lock:
+            if self._version == version:
+                self._entries[key] = tuple(results)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def search(self, query, limit=10):
+        """search_products_ranked, answered from the cache when nothing has changed since"""
+        if not version_stamps_shared():
+            return search_products_ranked(query, limit)
+        results, key, version = self._lookup(query, limit, (get_catalog_version(), get_stock_version()))
+        if results is None:
+            results = search_products_ranked(query, limit)
+            self._store(key, version, results)
+        return results
+
+    async def asearch(self, query, limit=10):
+        """search() for async views"""
+        if not version_stamps_shared():
+            return await asearch_products_ranked(query, limit)
+        version = (await aget_catalog_version(), await aget_stock_version())
+        results, key, version = self._lookup(query, limit, version)
+        if results is None:
+            results = await asearch_products_ranked(query, limit)
+            self._store(key, version, results)
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+search_cache = SearchResultCache(getattr(settings, 'SEARCH_CACHE_MAX_ENTRIES', 512))
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .catalog import invalidate_catalog
+from .drawer import bump_drawer_version
+from .models import DeletedProduct, Denomination, Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_on_product_change(sender, **kwargs):
+    # Bump now and again after commit so a worker that re-reads the row
+    # before the transaction commits cannot keep the old values cached
+    invalidate_catalog()
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_delete, sender=Product)
+def record_deleted_product(sender, instance, **kwargs):
+    # Catalog changes feeds tell clients to drop it (see billing.catalog_snapshot)
+    DeletedProduct.objects.create(product_id=instance.product_id)
+
+
+@receiver(post_save, sender=Denomination)
+@receiver(post_delete, sender=Denomination)
+def bump_drawer_version_on_denomination_change(sender, instance, **kwargs):
+    bump_drawer_version(instance.register.code)
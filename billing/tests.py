@@ -1,10 +1,40 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
 from django.test import TestCase, Client
+from django.core import mail
+from datetime import timedelta
 from decimal import Decimal
-from billing.models import Product, Denomination, Purchase, PurchaseItem, ChangeBreakdown
+from unittest import mock
+from billing.models import Product, Denomination, Purchase, Register, PurchaseItem, ChangeBreakdown, EmailOutbox, IdempotencyKey, PurchaseInvoice, DailyProductSales, DailyTaxSales, default_register
+from billing.outbox import drain_outbox
+from billing.idempotency import purge_expired_keys
+from billing.metrics import reset_metrics
+from billing.catalog import CatalogCache, catalog
+from billing.catalog_snapshot import snapshot_cache
+from billing.events import EventBroker, InProcessBroker, event_stream, get_broker
+from billing.imports import import_products
+from billing.invoices import decompress_html, get_invoice_html
+from billing.rollups import rebuild_rollups
+from billing.search import build_match_expression, fts_available, search_cache, search_products_ranked
+from billing.utils import apply_drawer_deltas, calculate_change, is_canonical_denomination_set
+from django.core.cache import cache
+from django.test.utils import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 # Create your tests here.
 
+# A cache every worker process sees, standing in for Redis in the tests that rely on shared version stamps
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'billing-tests-cache'),
+    }
+}
+
 class BillingFullFlowTest(TestCase):
     def setUp(self):
         # Create products
@@ -23,13 +53,13 @@ class BillingFullFlowTest(TestCase):
             tax_percentage=Decimal('5.00')
         )
         # Create denominations (including small ones for exact change)
-        Denomination.objects.create(value=Decimal('500'), count=5)
-        Denomination.objects.create(value=Decimal('50'), count=20)
-        Denomination.objects.create(value=Decimal('20'), count=50)
-        Denomination.objects.create(value=Decimal('10'), count=50)
-        Denomination.objects.create(value=Decimal('5'), count=50)
-        Denomination.objects.create(value=Decimal('2'), count=50)
-        Denomination.objects.create(value=Decimal('1'), count=50)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('500'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=20)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('20'), count=50)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=50)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('5'), count=50)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('2'), count=50)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('1'), count=50)
         self.client = Client()
 
     def test_full_billing_flow(self):
@@ -62,6 +92,7 @@ class BillingFullFlowTest(TestCase):
         # Check purchase created
         purchase = Purchase.objects.get(purchase_id=resp_json['purchase_id'])
         self.assertEqual(purchase.customer_email, "customer@example.com")
+        self.assertEqual(purchase.customer_email_normalized, "customer@example.com")
         # Check purchase items
         items = PurchaseItem.objects.filter(purchase=purchase)
         self.assertEqual(items.count(), 2)
@@ -72,4 +103,1355 @@ class BillingFullFlowTest(TestCase):
         # Check denominations updated
         for denom_value, expected_count in resp_json['available_denominations'].items():
             denom = Denomination.objects.get(value=Decimal(denom_value))
-            self.assertEqual(denom.count, expected_count)
\ No newline at end of file
+            self.assertEqual(denom.count, expected_count)
+
+class BatchedCheckoutTest(TestCase):
+    def setUp(self):
+        for index in range(10):
+            Product.objects.create(
+                product_id=f"B{index:03d}",
+                name=f"Batch Product {index}",
+                available_stock=20,
+                price_per_unit=Decimal('10.00'),
+                tax_percentage=Decimal('0.00')
+            )
+        for value in (500, 100, 50, 20, 10, 5, 2, 1):
+            Denomination.objects.create(register_id=default_register(), value=Decimal(value), count=20)
+        self.client = Client()
+
+    def _post_bill(self, products, payment=None):
+        data = {
+            "customer_email": "batch@example.com",
+            "amount_paid": 500.0,
+            "products": products,
+            "customer_payment_denominations": payment or {"500": 1}
+        }
+        return self.client.post(reverse('generate_bill'), data, content_type='application/json')
+
+    def _count_queries(self, products, payment):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as context:
+            response = self._post_bill(products, payment)
+        self.assertTrue(response.json().get('success'), response.json())
+        return len(context.captured_queries)
+
+    def test_query_count_independent_of_basket_size(self):
+        small_basket = [{"product_id": "B000", "quantity": 1}]
+        large_basket = [{"product_id": f"B{index:03d}", "quantity": 1} for index in range(10)]
+        self.assertEqual(
+            self._count_queries(small_basket, {"50": 1}),
+            self._count_queries(large_basket, {"500": 1})
+        )
+
+    def test_repeated_product_lines_share_stock(self):
+        response = self._post_bill([
+            {"product_id": "B001", "quantity": 15},
+            {"product_id": "B001", "quantity": 10}
+        ])
+        self.assertFalse(response.json().get('success'))
+        self.assertEqual(Product.objects.get(product_id="B001").available_stock, 20)
+
+        response = self._post_bill([
+            {"product_id": "B001", "quantity": 5},
+            {"product_id": "B001", "quantity": 3}
+        ], {"100": 1})
+        self.assertTrue(response.json().get('success'))
+        self.assertEqual(Product.objects.get(product_id="B001").available_stock, 12)
+        self.assertEqual(PurchaseItem.objects.filter(product__product_id="B001").count(), 2)
+
+
+
+class ConcurrentCheckoutTest(TestCase):
+    """Another till commits between a checkout's snapshot and its write"""
+
+    def setUp(self):
+        reset_metrics()
+        Product.objects.create(
+            product_id="H001",
+            name="Hot Product",
+            available_stock=10,
+            price_per_unit=Decimal('10.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+
+    def _checkout_with_stale_snapshot(self, rewind, quantity, payment):
+        """
+        Check out against a first snapshot read before another till's commit
+        The other till's change is already in the database; rewind(snapshot) undoes it
+        in the first snapshot only, so every later snapshot sees the committed state.
+        """
+        from billing import checkout
+        original = checkout.CheckoutSnapshot
+        snapshots = []
+
+        def stale_then_fresh(product_ids, register):
+            snapshot = original(product_ids, register)
+            if not snapshots:
+                rewind(snapshot)
+            snapshots.append(snapshot)
+            return snapshot
+
+        with mock.patch('billing.checkout.CheckoutSnapshot', side_effect=stale_then_fresh):
+            result = checkout.process_bill({
+                "customer_email": "race@example.com",
+                "products": [{"product_id": "H001", "quantity": quantity}],
+                "customer_payment_denominations": payment
+            })
+        return result, len(snapshots)
+
+    def _rewind_stock(self, snapshot):
+        snapshot.products["H001"].available_stock += 7
+
+    def test_oversell_is_retried_then_rejected_as_a_whole(self):
+        # Another till sold 7 of the 10 after our snapshot
+        Product.objects.filter(product_id="H001").update(available_stock=3)
+
+        # The conditional UPDATE still covers a smaller basket: no retry needed
+        result, attempts = self._checkout_with_stale_snapshot(self._rewind_stock, 2, {"50": 1})
+        self.assertTrue(result['success'], result)
+        self.assertEqual(attempts, 1)
+        self.assertEqual(Product.objects.get(product_id="H001").available_stock, 1)
+
+        # A basket the remaining stock cannot cover is rolled back, re-priced and rejected
+        result, attempts = self._checkout_with_stale_snapshot(self._rewind_stock, 3, {"50": 1})
+        self.assertFalse(result['success'])
+        self.assertEqual(attempts, 2)
+        self.assertIn('Available: 1, Requested: 3', result['error'])
+        self.assertEqual(Product.objects.get(product_id="H001").available_stock, 1)
+        self.assertEqual(Purchase.objects.count(), 1)
+
+    def test_drawer_race_is_retried_with_fresh_counts(self):
+        from billing.metrics import render_metrics
+        # Another till handed out four ₹10 notes after our snapshot
+        Denomination.objects.filter(value=Decimal('10')).update(count=1)
+
+        def rewind_drawer(snapshot):
+            snapshot.drawer[Decimal('10.00')] += 4
+            snapshot.initial_drawer[Decimal('10.00')] += 4
+
+        result, attempts = self._checkout_with_stale_snapshot(rewind_drawer, 3, {"50": 1})
+        self.assertFalse(result['success'])
+        self.assertEqual(attempts, 2)
+        self.assertIn('Cannot provide exact change', result['error'])
+        self.assertEqual(Denomination.objects.get(value=Decimal('10')).count, 1)
+        self.assertEqual(Purchase.objects.count(), 0)
+        self.assertIn('billing_checkout_retries_total{reason="drawer"} 1', render_metrics())
+
+
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="E001",
+            name="Outbox Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+        self.client = Client()
+
+    def _post_bill(self):
+        data = {
+            "customer_email": "outbox@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "E001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }
+        response = self.client.post(reverse('generate_bill'), data, content_type='application/json')
+        self.assertTrue(response.json().get('success'))
+
+    def test_checkout_queues_email_and_worker_sends_it(self):
+        self._post_bill()
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(queued.to_email, "outbox@example.com")
+
+        sent, failed = drain_outbox(backend='locmem')
+        self.assertEqual((sent, failed), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["outbox@example.com"])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, EmailOutbox.STATUS_SENT)
+        self.assertIsNotNone(queued.sent_at)
+
+    def test_failed_send_is_rescheduled_with_backoff(self):
+        self._post_bill()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP down')):
+            with self.assertLogs('billing.outbox', level='WARNING'):
+                sent, failed = drain_outbox(backend='locmem', max_attempts=2)
+        self.assertEqual((sent, failed), (0, 1))
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertGreater(queued.next_attempt_at, queued.created_at)
+        self.assertIn('SMTP down', queued.last_error)
+
+        # Not due yet, so a second drain leaves it alone
+        self.assertEqual(drain_outbox(backend='locmem'), (0, 0))
+
+
+class BulkBillSubmissionTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="S001",
+            name="Sync Product",
+            available_stock=30,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=0)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=100)
+        self.client = Client()
+
+    def _bill(self, quantity=1):
+        return {
+            "customer_email": "till@example.com",
+            "amount_paid": 50.0 * quantity,
+            "products": [{"product_id": "S001", "quantity": quantity}],
+            "customer_payment_denominations": {"50": quantity}
+        }
+
+    def _post_bills(self, bills, chunk_size=25):
+        response = self.client.post(
+            reverse('generate_bills'),
+            {"bills": bills, "chunk_size": chunk_size},
+            content_type='application/json'
+        )
+        return response.json()
+
+    def test_results_returned_per_bill_in_order(self):
+        bills = [self._bill(), {"customer_email": "bad"}, self._bill(20), self._bill(20)]
+        data = self._post_bills(bills)
+        self.assertEqual(data['processed'], 4)
+        self.assertEqual([result['success'] for result in data['results']], [True, False, True, False])
+        # The last bill sees the stock consumed by the earlier bills in the same chunk
+        self.assertIn('Insufficient stock', data['results'][3]['error'])
+        self.assertEqual(Product.objects.get(product_id="S001").available_stock, 9)
+        self.assertEqual(Purchase.objects.count(), 2)
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+        # 21 x 50 received, change of 10 and 200 given back
+        self.assertEqual(Denomination.objects.get(value=Decimal('50')).count, 21 - 4)
+        self.assertEqual(Denomination.objects.get(value=Decimal('10')).count, 100 - 1)
+
+    def test_malformed_bills_fail_on_their_own(self):
+        malformed = [
+            dict(self._bill(), customer_email=123),
+            dict(self._bill(), customer_payment_denominations=[1, 2]),
+            dict(self._bill(), products={"S001": 1}),
+            dict(self._bill(), products=[{"product_id": 5, "quantity": 1}]),
+        ]
+        data = self._post_bills([self._bill()] + malformed + [self._bill()])
+        self.assertTrue(data['success'])
+        self.assertEqual([result['success'] for result in data['results']], [True, False, False, False, False, True])
+        for result in data['results'][1:5]:
+            self.assertNotIn('unexpected', result['error'].lower())
+        self.assertEqual(Purchase.objects.count(), 2)
+
+    def test_non_finite_amounts_fail_on_their_own(self):
+        bills = [
+            self._bill(),
+            dict(self._bill(), amount_paid="NaN"),
+            dict(self._bill(), customer_payment_denominations={"NaN": 1}),
+            self._bill(),
+        ]
+        data = self._post_bills(bills)
+        self.assertEqual([result['success'] for result in data['results']], [True, False, False, True])
+        self.assertIn('Invalid amount paid', data['results'][1]['error'])
+        self.assertIn('Invalid denomination value', data['results'][2]['error'])
+
+    def test_unexpected_chunk_error_keeps_committed_results(self):
+        from billing import checkout
+        process_chunk = checkout._process_chunk
+        calls = []
+
+        def fail_second_chunk(chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise RuntimeError("boom")
+            return process_chunk(chunk)
+
+        with mock.patch('billing.checkout._process_chunk', side_effect=fail_second_chunk):
+            data = self._post_bills([self._bill(), self._bill(), self._bill()], chunk_size=1)
+        self.assertTrue(data['success'])
+        self.assertEqual([result['success'] for result in data['results']], [True, False, True])
+        self.assertIn('unexpected error', data['results'][1]['error'])
+        self.assertEqual(Purchase.objects.count(), 2)
+        self.assertEqual(Product.objects.get(product_id="S001").available_stock, 28)
+
+    def test_query_count_grows_with_chunks_not_bills(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._post_bills([self._bill()])  # warm the catalog cache
+        with CaptureQueriesContext(connection) as few:
+            self._post_bills([self._bill() for _ in range(2)])
+        with CaptureQueriesContext(connection) as many:
+            self._post_bills([self._bill() for _ in range(12)])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.assertEqual(Purchase.objects.count(), 15)
+
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="I001",
+            name="Idempotent Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+        self.client = Client()
+        self.bill = {
+            "customer_email": "retry@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "I001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }
+
+    def _post_bill(self, key):
+        return self.client.post(
+            reverse('generate_bill'), self.bill,
+            content_type='application/json',
+            headers={'Idempotency-Key': key}
+        )
+
+    def test_retry_replays_stored_response(self):
+        first = self._post_bill('till-1-0001')
+        self.assertTrue(first.json()['success'])
+
+        with self.assertNumQueries(1):
+            retry = self._post_bill('till-1-0001')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(Product.objects.get(product_id="I001").available_stock, 9)
+
+        self._post_bill('till-1-0002')
+        self.assertEqual(Purchase.objects.count(), 2)
+
+    def test_bulk_replay_skips_committed_bills(self):
+        bills = [dict(self.bill, idempotency_key=f'offline-{index}') for index in range(3)]
+        first = self.client.post(reverse('generate_bills'), bills, content_type='application/json').json()
+        self.assertEqual(first['succeeded'], 3)
+
+        replay = self.client.post(reverse('generate_bills'), bills, content_type='application/json').json()
+        self.assertEqual(replay['results'], first['results'])
+        self.assertEqual(Purchase.objects.count(), 3)
+
+    def test_bulk_rejects_non_string_keys(self):
+        response = self.client.post(reverse('generate_bills'), [dict(self.bill, idempotency_key=7)], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'idempotency_key must be a string.')
+        self.assertEqual(Purchase.objects.count(), 0)
+
+    def test_purge_removes_expired_keys(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        self._post_bill('old-key')
+        self._post_bill('new-key')
+        IdempotencyKey.objects.filter(key='old-key').update(created_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_expired_keys(timedelta(days=1)), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new-key'])
+
+
+
+class ChangeEngineTest(TestCase):
+    def _drawer(self, rows):
+        return [Denomination(value=Decimal(value), count=count) for value, count in rows]
+
+    def test_pays_change_greedy_cannot(self):
+        breakdown, total = calculate_change(Decimal('60'), self._drawer([(50, 1), (20, 3)]))
+        self.assertEqual(total, Decimal('60'))
+        self.assertEqual([(item['value'], item['count']) for item in breakdown], [(Decimal('20'), 3)])
+
+    def test_non_canonical_set_uses_fewest_notes(self):
+        self.assertFalse(is_canonical_denomination_set((4, 3, 1)))
+        breakdown, total = calculate_change(Decimal('6'), self._drawer([(4, 5), (3, 5), (1, 5)]))
+        self.assertEqual(total, Decimal('6'))
+        self.assertEqual([(item['value'], item['count']) for item in breakdown], [(Decimal('3'), 2)])
+
+    def test_canonical_set_and_impossible_change(self):
+        self.assertTrue(is_canonical_denomination_set((500, 50, 20, 10, 5, 2, 1)))
+        breakdown, total = calculate_change(Decimal('54'), self._drawer([(500, 1), (50, 1), (2, 2)]))
+        self.assertEqual(total, Decimal('54'))
+        self.assertEqual(calculate_change(Decimal('30'), self._drawer([(50, 3), (20, 1)])), ([], Decimal('0.00')))
+
+    def test_checkout_uses_engine_when_large_notes_run_out(self):
+        Product.objects.create(
+            product_id="C001",
+            name="Change Product",
+            available_stock=5,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('100'), count=0)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=0)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('20'), count=3)
+        response = self.client.post(reverse('generate_bill'), {
+            "customer_email": "change@example.com",
+            "amount_paid": 100.0,
+            "products": [{"product_id": "C001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1, "20": 1, "10": 3}
+        }, content_type='application/json').json()
+        self.assertTrue(response['success'], response)
+        self.assertEqual(response['total_change_given'], 60.0)
+
+
+
+class DrawerDeltaTest(TestCase):
+    def setUp(self):
+        for value in (500, 50, 20, 10):
+            Denomination.objects.create(register_id=default_register(), value=Decimal(value), count=10)
+
+    def test_applies_delta_map_in_one_statement(self):
+        # One UPDATE for every count, one for the register's drawer version
+        with self.assertNumQueries(2):
+            new_counts = apply_drawer_deltas({"500": 2, "50.00": -3, Decimal('20'): 0})
+        self.assertEqual(new_counts, {Decimal('500.00'): 12, Decimal('50.00'): 7})
+        self.assertEqual(Denomination.objects.get(value=Decimal('500')).count, 12)
+        self.assertEqual(Denomination.objects.get(value=Decimal('50')).count, 7)
+        self.assertEqual(Denomination.objects.get(value=Decimal('20')).count, 10)
+
+    def test_creates_missing_denominations(self):
+        new_counts = apply_drawer_deltas({"100": 4, "10": 1})
+        self.assertEqual(new_counts, {Decimal('100.00'): 4, Decimal('10.00'): 11})
+        self.assertEqual(Denomination.objects.get(value=Decimal('100')).count, 4)
+
+    def test_rejects_negative_counts(self):
+        from django.db import IntegrityError, transaction
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                apply_drawer_deltas({"500": -11})
+        self.assertEqual(Denomination.objects.get(value=Decimal('500')).count, 10)
+
+
+class DrawerSnapshotTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="D001",
+            name="Drawer Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        self.ten = Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+        self.url = reverse('update_drawer_realtime')
+
+    def snapshot(self, since=None):
+        return self.client.post(self.url, {"since": since}, content_type='application/json').json()
+
+    def test_unchanged_drawer_answers_from_the_version_alone(self):
+        data = self.snapshot(since=-1)
+        self.assertFalse(data['unchanged'])
+        self.assertEqual(data['drawer'], {"50.00": 5, "10.00": 5})
+
+        with self.assertNumQueries(1):
+            data = self.snapshot(since=data['version'])
+        self.assertEqual(data, {'success': True, 'version': data['version'], 'unchanged': True})
+
+    def test_version_is_shared_through_the_database(self):
+        version = self.snapshot(since=-1)['version']
+        # Another worker's checkout, which this process's cache never hears of
+        Register.objects.filter(code="main").update(drawer_version=version + 1)
+        Denomination.objects.filter(value=Decimal('10')).update(count=9)
+        data = self.snapshot(since=version)
+        self.assertFalse(data['unchanged'])
+        self.assertEqual(data['drawer']["10.00"], 9)
+
+    def test_unknown_register_is_not_found(self):
+        for body in ({"register": "nope", "since": 1}, {"register": "nope"}):
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 404)
+            self.assertIn('Register "nope" not found', response.json()['error'])
+
+    def test_checkout_and_edits_bump_the_version(self):
+        version = self.snapshot(since=-1)['version']
+        self.client.post(reverse('generate_bill'), {
+            "customer_email": "drawer@example.com",
+            "products": [{"product_id": "D001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }, content_type='application/json')
+        data = self.snapshot(since=version)
+        self.assertFalse(data['unchanged'])
+        self.assertGreater(data['version'], version)
+        self.assertEqual(data['drawer'], {"50.00": 6, "10.00": 4})
+
+        version = data['version']
+        self.ten.count = 20
+        self.ten.save()
+        data = self.snapshot(since=version)
+        self.assertGreater(data['version'], version)
+        self.assertEqual(data['drawer']["10.00"], 20)
+
+    def test_legacy_request_still_gets_projection(self):
+        data = self.client.post(self.url, {"customer_denominations": {"50.00": 2}}, content_type='application/json').json()
+        self.assertEqual(data['current_drawer_status']["50.00"]['count'], 5)
+        self.assertEqual(data['projected_drawer_status']["50.00"]['count'], 7)
+        self.assertEqual(data['drawer'], {"50.00": 5, "10.00": 5})
+
+
+class RegisterDrawerTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="R001",
+            name="Register Product",
+            available_stock=20,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+        self.till = Register.objects.create(code="till-2", name="Till 2")
+        Denomination.objects.create(register=self.till, value=Decimal('50'), count=1)
+        Denomination.objects.create(register=self.till, value=Decimal('10'), count=3)
+
+    def bill(self, **extra):
+        return {
+            "customer_email": "register@example.com",
+            "products": [{"product_id": "R001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1},
+            **extra
+        }
+
+    def counts(self, register):
+        return dict(Denomination.objects.filter(register__code=register).values_list('value', 'count'))
+
+    def test_checkout_only_touches_its_registers_drawer(self):
+        response = self.client.post(reverse('generate_bill'), self.bill(register="till-2"), content_type='application/json').json()
+        self.assertTrue(response['success'])
+        self.assertEqual(response['register'], "till-2")
+        self.assertEqual(self.counts("till-2"), {Decimal('50.00'): 2, Decimal('10.00'): 2})
+        self.assertEqual(self.counts("main"), {Decimal('50.00'): 5, Decimal('10.00'): 5})
+        self.assertEqual(Purchase.objects.get(purchase_id=response['purchase_id']).register, self.till)
+
+    def test_submitted_drawer_does_not_overwrite_counts(self):
+        response = self.client.post(
+            reverse('generate_bill'), self.bill(denominations={"50": 100, "10": 100}), content_type='application/json'
+        ).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(self.counts("main"), {Decimal('50.00'): 6, Decimal('10.00'): 4})
+
+    def test_unknown_register_is_rejected(self):
+        response = self.client.post(reverse('generate_bill'), self.bill(register="nope"), content_type='application/json').json()
+        self.assertFalse(response['success'])
+        self.assertIn('Register "nope" not found', response['error'])
+        self.assertEqual(Product.objects.get(product_id="R001").available_stock, 20)
+
+    def test_bulk_bills_are_written_to_their_own_registers(self):
+        results = self.client.post(reverse('generate_bills'), [
+            self.bill(register="till-2"), self.bill(), self.bill(register="till-2")
+        ], content_type='application/json').json()['results']
+        self.assertEqual([result['register'] for result in results], ["till-2", "main", "till-2"])
+        self.assertEqual(self.counts("till-2"), {Decimal('50.00'): 3, Decimal('10.00'): 1})
+        self.assertEqual(self.counts("main"), {Decimal('50.00'): 6, Decimal('10.00'): 4})
+
+    def test_building_denominations_writes_nothing(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with self.assertNumQueries(0):
+            Denomination(value=Decimal('20'), count=1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('denomination_create'))
+        self.assertContains(response, "Till 2")
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('INSERT')])
+
+    def test_drawers_are_aggregated_across_registers(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('drawers_api')).json()
+        self.assertEqual([drawer['code'] for drawer in data['registers']], ["main", "till-2"])
+        self.assertEqual(data['totals'], {"50.00": 6, "10.00": 8})
+        self.assertEqual(Decimal(data['total_value']), Decimal('380.00'))
+        self.assertContains(self.client.get(reverse('denomination_list')), "Till 2")
+
+
+class RecordingBroker(EventBroker):
+    def __init__(self):
+        self.events = []
+
+    def publish(self, event, data):
+        self.events.append((event, data))
+
+
+class TillEventsTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="E001",
+            name="Event Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+
+    @override_settings(BILLING_EVENT_BROKER='billing.tests.RecordingBroker')
+    def test_checkout_publishes_deltas_after_commit(self):
+        broker = get_broker()
+        broker.events.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('generate_bill'), {
+                "customer_email": "events@example.com",
+                "products": [{"product_id": "E001", "quantity": 2}],
+                "customer_payment_denominations": {"50": 2}
+            }, content_type='application/json')
+            self.assertEqual(broker.events, [])
+        self.assertEqual([event for event, _ in broker.events], ['drawer', 'stock'])
+        self.assertEqual(broker.events[0][1]['deltas'], {"50.00": 2, "10.00": -2})
+        self.assertEqual(broker.events[1][1]['deltas'], {"E001": -2})
+
+    async def test_stream_sends_published_events(self):
+        response = await self.async_client.get(reverse('till_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertIn(b'event: hello\n', await anext(stream))
+        get_broker().publish('stock', {'version': 1, 'deltas': {"E001": -1}})
+        self.assertTrue((await anext(stream)).endswith(b'\nevent: stock\ndata: {"version":1,"deltas":{"E001":-1}}\n\n'))
+
+    async def test_slow_subscriber_is_told_to_resync(self):
+        broker = InProcessBroker(max_pending=2)
+        stream = event_stream(broker, keepalive=0.01)
+        await anext(stream)
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+        for _ in range(3):
+            broker.publish('stock', {'deltas': {"E001": -1}})
+        await asyncio.sleep(0)
+        self.assertEqual(await anext(stream), 'id: 3\nevent: resync\ndata: {}\n\n')
+        await stream.aclose()
+        self.assertEqual(broker.subscriber_count, 0)
+
+    def test_wsgi_requests_are_told_not_to_reconnect(self):
+        self.assertEqual(self.client.get(reverse('till_events')).status_code, 204)
+
+
+class CheckoutMetricsTest(TestCase):
+    def setUp(self):
+        reset_metrics()
+        Product.objects.create(
+            product_id="M001",
+            name="Metrics Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('10'), count=5)
+
+    def test_metrics_endpoint_reports_stage_timings_and_queries(self):
+        self.client.post(reverse('generate_bill'), {
+            "customer_email": "metrics@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "M001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }, content_type='application/json')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE billing_checkout_stage_seconds histogram', body)
+        for stage in ('validation', 'pricing', 'change', 'db_write', 'email_enqueue', 'total'):
+            self.assertIn(f'billing_checkout_stage_seconds_count{{stage="{stage}"}} 1', body)
+        self.assertIn('billing_checkout_stage_queries_count{stage="db_write"} 1', body)
+        self.assertIn('billing_checkout_stage_queries_sum{stage="email_enqueue"} 1', body)
+        self.assertIn('billing_checkout_bills_total{result="success"} 1', body)
+
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            product_id="K001",
+            name="Cached Product",
+            available_stock=10,
+            price_per_unit=Decimal('40.00'),
+            tax_percentage=Decimal('5.00')
+        )
+
+    def test_warm_lookup_only_reads_stock(self):
+        self.client.get(reverse('get_product_info', args=["K001"]))
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('get_product_info', args=["K001"])).json()
+        self.assertEqual((data['name'], data['price'], data['stock']), ("Cached Product", 40.0, 10))
+
+        # Stock changes made with UPDATE are visible without invalidation
+        Product.objects.filter(pk=self.product.pk).update(available_stock=3)
+        self.assertEqual(self.client.get(reverse('get_product_info', args=["K001"])).json()['stock'], 3)
+
+    def test_product_edit_invalidates_cache(self):
+        self.assertEqual(catalog.get("K001").name, "Cached Product")
+        self.client.post(reverse('product_edit', args=[self.product.pk]), {
+            'product_id': "K001",
+            'name': "Renamed Product",
+            'available_stock': 10,
+            'price_per_unit': '45.00',
+            'tax_percentage': '5.00'
+        })
+        entry = catalog.get("K001")
+        self.assertEqual((entry.name, entry.price_per_unit), ("Renamed Product", Decimal('45.00')))
+
+        self.product.delete()
+        self.assertIsNone(catalog.get("K001"))
+
+    def test_lru_bound(self):
+        for index in range(2, 5):
+            Product.objects.create(
+                product_id=f"K00{index}",
+                name=f"Cached Product {index}",
+                available_stock=1,
+                price_per_unit=Decimal('1.00'),
+                tax_percentage=Decimal('0.00')
+            )
+        small_cache = CatalogCache(max_entries=2)
+        small_cache.get_many(["K001", "K002", "K003"])
+        small_cache.get("K002")
+        with self.assertNumQueries(0):
+            self.assertEqual(set(small_cache.get_many(["K002", "K003"])), {"K002", "K003"})
+        with self.assertNumQueries(1):
+            small_cache.get("K001")
+
+    def test_process_local_entries_expire(self):
+        local_cache = CatalogCache(max_entries=10, local_ttl=60)
+        with mock.patch('billing.catalog.time.monotonic', return_value=1000.0):
+            local_cache.get("K001")
+            with self.assertNumQueries(0):
+                local_cache.get("K001")
+        # Another worker's edit does not bump this process's stamp; the entry ages out instead
+        Product.objects.filter(pk=self.product.pk).update(name="Edited Elsewhere")
+        with mock.patch('billing.catalog.time.monotonic', return_value=1061.0):
+            self.assertEqual(local_cache.get("K001").name, "Edited Elsewhere")
+
+    def test_checkout_reads_prices_fresh_with_process_local_cache(self):
+        self.assertEqual(catalog.get("K001").price_per_unit, Decimal('40.00'))
+        # An edit made by another worker: this process's catalog cache never hears of it
+        Product.objects.filter(pk=self.product.pk).update(price_per_unit=Decimal('50.00'), tax_percentage=Decimal('0.00'))
+        response = self.client.post(reverse('generate_bill'), {
+            "customer_email": "fresh@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "K001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }, content_type='application/json')
+        self.assertTrue(response.json()['success'], response.json())
+        self.assertEqual(Purchase.objects.get().total_amount, Decimal('50.00'))
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        for product_id, name, stock in [
+            ("AB1", "Basmati Rice", 10),
+            ("AB10", "Brown Rice", 10),
+            ("XAB1", "Abrasive Sponge", 10),
+            ("AB2", "Rice Flour", 0),
+            ("ZZ9", "Crème Brûlée Mix", 5),
+        ]:
+            Product.objects.create(
+                product_id=product_id,
+                name=name,
+                available_stock=stock,
+                price_per_unit=Decimal('10.00'),
+                tax_percentage=Decimal('5.00')
+            )
+
+    def test_exact_id_then_prefix_then_name(self):
+        self.assertEqual([product_id for product_id, _ in search_products_ranked("ab1")], ["AB1", "AB10"])
+        # Out of stock products are never suggested
+        self.assertEqual({product_id for product_id, _ in search_products_ranked("rice")}, {"AB1", "AB10"})
+
+        # "Abrasive Sponge" matches by name, after the product_id prefix matches
+        response = self.client.get(reverse('search_products'), {'q': 'AB'})
+        self.assertEqual([product['id'] for product in response.json()['products']], ["AB1", "AB10", "XAB1"])
+
+    def test_name_matches_are_ranked_past_many_earlier_rows(self):
+        Product.objects.bulk_create([
+            Product(product_id=f"W{index:03d}", name=f"Widget {index}", available_stock=0,
+                    price_per_unit=Decimal('10.00'), tax_percentage=Decimal('5.00'))
+            for index in range(250)
+        ] + [
+            Product(product_id=f"R{index:03d}", name=f"Brown rice bag {index}", available_stock=10,
+                    price_per_unit=Decimal('10.00'), tax_percentage=Decimal('5.00'))
+            for index in range(250)
+        ])
+        Product.objects.create(product_id="WD1", name="Widget Deluxe", available_stock=3,
+                               price_per_unit=Decimal('10.00'), tax_percentage=Decimal('5.00'))
+        Product.objects.create(product_id="RC1", name="Rice", available_stock=3,
+                               price_per_unit=Decimal('10.00'), tax_percentage=Decimal('5.00'))
+
+        self.assertEqual(search_products_ranked("widget"), [("WD1", 3)])
+        self.assertIn("RC1", [product_id for product_id, _ in search_products_ranked("rice")])
+
+    def test_match_expression_quotes_tokens(self):
+        self.assertEqual(build_match_expression('ri" OR fl*'), '"ri"* "OR"* "fl"*')
+        self.assertEqual(search_products_ranked('"'), [])
+
+    def test_name_index_follows_product_changes(self):
+        if not fts_available():
+            self.skipTest("SQLite FTS5 is not available")
+        self.assertEqual(search_products_ranked("creme"), [("ZZ9", 5)])
+
+        product = Product.objects.get(product_id="ZZ9")
+        product.name = "Custard Powder"
+        product.save()
+        self.assertEqual(search_products_ranked("creme"), [])
+        self.assertEqual(search_products_ranked("cust pow"), [("ZZ9", 5)])
+
+        product.delete()
+        self.assertEqual(search_products_ranked("custard"), [])
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class ProductApiCachingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        search_cache.clear()
+        Product.objects.create(
+            product_id="H001",
+            name="Header Product",
+            available_stock=10,
+            price_per_unit=Decimal('50.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+
+    def test_conditional_requests_get_304_until_stock_changes(self):
+        url = reverse('get_product_info', args=["H001"])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post(reverse('generate_bill'), {
+            "customer_email": "etag@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "H001", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }, content_type='application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock'], 9)
+
+    def test_repeated_search_is_served_from_cache(self):
+        url = reverse('search_products')
+        self.assertEqual(self.client.get(url, {'q': 'h00'}).json()['products'][0]['stock'], 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {'q': 'H00 '}).json()['products'][0]['stock'], 10)
+
+        product = Product.objects.get(product_id="H001")
+        product.name = "Renamed Header Product"
+        product.save()
+        self.assertEqual(self.client.get(url, {'q': 'h00'}).json()['products'][0]['name'], "Renamed Header Product")
+
+    async def test_async_views_read_stamps_off_the_event_loop(self):
+        from django.core.cache import caches
+        backend = caches['default']
+        get = backend.get
+        on_loop = []
+
+        def recording_get(key, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(key)
+            except RuntimeError:
+                pass
+            return get(key, *args, **kwargs)
+
+        with mock.patch.object(backend, 'get', side_effect=recording_get) as patched:
+            response = await self.async_client.get(reverse('search_products'), {'q': 'h00'})
+            await self.async_client.get(reverse('get_product_info', args=["H001"]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertTrue(patched.called)
+        self.assertEqual(on_loop, [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_stamps_send_no_validators(self):
+        response = self.client.get(reverse('get_product_info', args=["H001"]))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        # Another worker's checkout: this process's stamps never move, so nothing may be served from them
+        Product.objects.filter(product_id="H001").update(available_stock=0)
+        self.assertEqual(self.client.get(reverse('search_products'), {'q': 'h00'}).json()['products'], [])
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        snapshot_cache.clear()
+        for index in range(3):
+            Product.objects.create(
+                product_id=f"S{index:03d}",
+                name=f"Snapshot Product {index}",
+                available_stock=10,
+                price_per_unit=Decimal('47.62'),
+                tax_percentage=Decimal('5.00')
+            )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('50'), count=5)
+
+    def test_snapshot_is_gzipped_and_revalidates(self):
+        url = reverse('catalog_snapshot')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        data = json.loads(gzip.decompress(response.content))
+        self.assertTrue(data['full'])
+        self.assertEqual(data['fields'], ['id', 'name', 'price', 'tax', 'stock'])
+        self.assertEqual(data['products'][0], ["S000", "Snapshot Product 0", 47.62, 5.0, 10])
+        self.assertEqual(str(data['version']), response['ETag'].strip('"'))
+
+        # Revalidating reads the version only
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertFalse(self.client.get(url).has_header('Content-Encoding'))
+
+    def test_changes_feed_has_edits_deletes_and_checkout_stock(self):
+        url = reverse('catalog_snapshot')
+        version = self.client.get(url).json()['version']
+
+        Product.objects.filter(product_id="S002").delete()
+        product = Product.objects.get(product_id="S001")
+        product.name = "Renamed Snapshot Product"
+        product.save()
+        self.client.post(reverse('generate_bill'), {
+            "customer_email": "snapshot@example.com",
+            "amount_paid": 50.0,
+            "products": [{"product_id": "S000", "quantity": 1}],
+            "customer_payment_denominations": {"50": 1}
+        }, content_type='application/json')
+
+        data = self.client.get(url, {'since': version}).json()
+        self.assertFalse(data['full'])
+        self.assertGreater(data['version'], version)
+        self.assertEqual(data['deleted'], ["S002"])
+        rows = {row[0]: row for row in data['products']}
+        self.assertEqual(rows["S001"][1], "Renamed Snapshot Product")
+        self.assertEqual(rows["S000"][4], 9)
+
+        # A client ahead of the server starts over from the full snapshot
+        self.assertTrue(self.client.get(url, {'since': data['version'] + 1}).json()['full'])
+
+    def test_unusable_since_falls_back_to_full_snapshot(self):
+        url = reverse('catalog_snapshot')
+        for since in ('-99999999999999999999', '-1', '99999999999999999999', '1e6', ''):
+            response = self.client.get(url, {'since': since})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['full'])
+
+
+class AsyncReadViewTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="AS01",
+            name="Async Basmati",
+            available_stock=4,
+            price_per_unit=Decimal('80.00'),
+            tax_percentage=Decimal('5.00')
+        )
+        Purchase.objects.create(
+            customer_email="async@example.com",
+            total_amount=Decimal('80.00'),
+            tax_amount=Decimal('4.00'),
+            grand_total=Decimal('84.00'),
+            amount_paid=Decimal('100.00'),
+            change_amount=Decimal('16.00')
+        )
+
+    async def test_views_run_on_the_async_orm(self):
+        catalog.clear()
+        response = await self.async_client.get(reverse('get_product_info', args=["AS01"]))
+        self.assertEqual(response.json()['stock'], 4)
+        self.assertEqual((await self.async_client.get(reverse('get_product_info', args=["NOPE"]))).json()['success'], False)
+
+        response = await self.async_client.get(reverse('search_products'), {'q': 'basm'})
+        self.assertEqual([product['id'] for product in response.json()['products']], ["AS01"])
+
+        response = await self.async_client.get(reverse('purchase_history_api'), {'email': 'async@'})
+        self.assertEqual(response.json()['purchases'][0]['customer_email'], "async@example.com")
+        response = await self.async_client.get(reverse('purchase_history'))
+        self.assertContains(response, "async@example.com")
+
+
+class PurchaseHistoryPaginationTest(TestCase):
+    def setUp(self):
+        product = Product.objects.create(
+            product_id="P001",
+            name="History Product",
+            available_stock=100,
+            price_per_unit=Decimal('10.00'),
+            tax_percentage=Decimal('0.00')
+        )
+        for index in range(7):
+            purchase = Purchase.objects.create(
+                customer_email=f"{'Alice' if index % 2 else 'bob'}@example.com",
+                total_amount=Decimal('10.00'),
+                tax_amount=Decimal('0.00'),
+                grand_total=Decimal('10.00'),
+                amount_paid=Decimal('10.00')
+            )
+            for _ in range(index % 3):
+                PurchaseItem.objects.create(
+                    purchase=purchase, product=product, quantity=1,
+                    unit_price=Decimal('10.00'), tax_percentage=Decimal('0.00'), subtotal=Decimal('10.00')
+                )
+        # Ties on created_at must still page without skipping or repeating rows
+        Purchase.objects.filter(pk__lte=4).update(created_at=Purchase.objects.get(pk=1).created_at)
+
+    def _pages(self, **params):
+        pages, cursor = [], None
+        while True:
+            query = dict(params, limit=3, **({'cursor': cursor} if cursor else {}))
+            with self.assertNumQueries(1):
+                data = self.client.get(reverse('purchase_history_api'), query).json()
+            pages.append(data['purchases'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_keyset_pages_cover_history_once_in_order(self):
+        pages = self._pages()
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        expected = list(Purchase.objects.order_by('-created_at', '-id'))
+        self.assertEqual(
+            [row['purchase_id'] for page in pages for row in page],
+            [str(purchase.purchase_id) for purchase in expected]
+        )
+        self.assertEqual(
+            [row['item_count'] for page in pages for row in page],
+            [purchase.items.count() for purchase in expected]
+        )
+
+        alice = [row['customer_email'] for page in self._pages(email='ALICE') for row in page]
+        self.assertEqual(alice, ['Alice@example.com'] * 3)
+        bob = [row['customer_email'] for page in self._pages(email=' Bob@Example.com ') for row in page]
+        self.assertEqual(bob, ['bob@example.com'] * 4)
+        # Lookups match from the start of the address only
+        self.assertEqual(self._pages(email='example.com'), [[]])
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('purchase_history_api'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        # The HTML page falls back to the newest purchases
+        response = self.client.get(reverse('purchase_history'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['purchases']), 7)
+
+
+class StoredInvoiceTest(TestCase):
+    def setUp(self):
+        for product_id, name in (("I001", "Invoice Tea"), ("I002", "Invoice Sugar")):
+            Product.objects.create(
+                product_id=product_id,
+                name=name,
+                available_stock=10,
+                price_per_unit=Decimal('45.00'),
+                tax_percentage=Decimal('12.00')
+            )
+        for value in (500, 100, 10, 5, 1):
+            Denomination.objects.create(register_id=default_register(), value=Decimal(value), count=10)
+        response = self.client.post(reverse('generate_bill'), {
+            "customer_email": "invoice@example.com",
+            "amount_paid": 500.0,
+            "products": [{"product_id": "I001", "quantity": 2}, {"product_id": "I002", "quantity": 1}],
+            "customer_payment_denominations": {"500": 1}
+        }, content_type='application/json')
+        self.purchase = Purchase.objects.get(purchase_id=response.json()['purchase_id'])
+
+    def test_detail_page_and_email_share_the_commit_render(self):
+        invoice = PurchaseInvoice.objects.get(purchase=self.purchase)
+        self.assertIn("Invoice Sugar", decompress_html(invoice.detail_html))
+        self.assertIn("Invoice Sugar", EmailOutbox.objects.get(purchase=self.purchase).html_body)
+
+        with self.assertNumQueries(1):
+            html = get_invoice_html(self.purchase.purchase_id)
+        self.assertIn("Invoice Sugar", html)
+        response = self.client.get(reverse('purchase_detail', args=[self.purchase.purchase_id]))
+        self.assertContains(response, "Invoice Tea")
+
+    def test_missing_invoice_is_rendered_from_rows_identically(self):
+        committed = get_invoice_html(self.purchase.purchase_id)
+        PurchaseInvoice.objects.all().delete()
+
+        self.assertEqual(get_invoice_html(self.purchase.purchase_id), committed)
+        self.assertTrue(PurchaseInvoice.objects.filter(purchase=self.purchase).exists())
+        self.assertEqual(self.client.get(reverse('purchase_detail', args=['00000000-0000-0000-0000-000000000000'])).status_code, 404)
+
+
+class DailySalesRollupTest(TestCase):
+    def setUp(self):
+        for product_id, tax in (("R001", '5.00'), ("R002", '18.00')):
+            Product.objects.create(
+                product_id=product_id,
+                name=f"Rollup {product_id}",
+                available_stock=50,
+                price_per_unit=Decimal('10.50'),
+                tax_percentage=Decimal(tax)
+            )
+        Denomination.objects.create(register_id=default_register(), value=Decimal('100'), count=10)
+        Denomination.objects.create(register_id=default_register(), value=Decimal('1'), count=300)
+
+    def _checkout(self, products):
+        response = self.client.post(reverse('generate_bill'), {
+            "customer_email": "rollup@example.com",
+            "amount_paid": 100.0,
+            "products": products,
+            "customer_payment_denominations": {"100": 1}
+        }, content_type='application/json')
+        self.assertTrue(response.json()['success'], response.json())
+
+    def _snapshot(self):
+        return (
+            sorted(DailyProductSales.objects.values_list('day', 'product__product_id', 'units', 'revenue', 'tax_amount')),
+            sorted(DailyTaxSales.objects.values_list('day', 'tax_percentage', 'units', 'revenue', 'tax_amount')),
+        )
+
+    def test_checkout_increments_rollups_and_rebuild_matches(self):
+        self._checkout([{"product_id": "R001", "quantity": 2}, {"product_id": "R002", "quantity": 1}])
+        self._checkout([{"product_id": "R001", "quantity": 3}])
+
+        today = timezone.localdate()
+        product_row = DailyProductSales.objects.get(product__product_id="R001")
+        self.assertEqual((product_row.day, product_row.units, product_row.revenue), (today, 5, Decimal('52.50')))
+        self.assertEqual(product_row.tax_amount, Decimal('2.6250'))
+        self.assertEqual(DailyTaxSales.objects.get(tax_percentage=Decimal('18.00')).tax_amount, Decimal('1.8900'))
+
+        incremental = self._snapshot()
+        DailyProductSales.objects.update(units=0)
+        self.assertEqual(rebuild_rollups(today - timedelta(days=3), today + timedelta(days=1), chunk_days=2), (2, 2))
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_rebuild_takes_the_write_lock_before_reading_history(self):
+        self._checkout([{"product_id": "R001", "quantity": 1}])
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        today = timezone.localdate()
+        with CaptureQueriesContext(connection) as context:
+            rebuild_rollups(today, today + timedelta(days=1))
+        statements = [query['sql'] for query in context.captured_queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # Checkouts committing after the delete wait for the rebuild, so none of their increments is lost
+        self.assertTrue(statements[0].startswith('DELETE'), statements[0])
+        self.assertTrue(any('billing_purchaseitem' in sql for sql in statements[2:]))
+        self.assertEqual(DailyProductSales.objects.get(product__product_id="R001").units, 1)
+
+    def test_report_reads_only_rollups(self):
+        self._checkout([{"product_id": "R002", "quantity": 4}])
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as context:
+            data = self.client.get(reverse('sales_report_api')).json()
+        self.assertFalse(any('billing_purchase' in query['sql'] for query in context.captured_queries))
+        self.assertEqual(data['totals']['units'], 4)
+        self.assertEqual(data['products'][0]['product_id'], "R002")
+        self.assertContains(self.client.get(reverse('sales_report')), "Rollup R002")
+
+
+class PurchaseExportTest(TestCase):
+    def setUp(self):
+        for product_id in ("E001", "E002"):
+            Product.objects.create(
+                product_id=product_id,
+                name=f"Export {product_id}",
+                available_stock=20,
+                price_per_unit=Decimal('20.00'),
+                tax_percentage=Decimal('0.00')
+            )
+        for value in (100, 50, 20):
+            Denomination.objects.create(register_id=default_register(), value=Decimal(value), count=10)
+        for email, products, payment in (
+            ("first@example.com", [{"product_id": "E001", "quantity": 1}, {"product_id": "E002", "quantity": 2}], {"100": 1}),
+            ("second@example.com", [{"product_id": "E002", "quantity": 1}], {"20": 1}),
+        ):
+            response = self.client.post(reverse('generate_bill'), {
+                "customer_email": email,
+                "amount_paid": 100.0,
+                "products": products,
+                "customer_payment_denominations": payment
+            }, content_type='application/json')
+            self.assertTrue(response.json()['success'], response.json())
+
+    def _export(self, **params):
+        response = self.client.get(reverse('export_purchases'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_has_one_row_per_line_item(self):
+        import csv
+        import io
+        rows = list(csv.DictReader(io.StringIO(self._export().decode())))
+        self.assertEqual([row['product_id'] for row in rows], ["E001", "E002", "E002"])
+        self.assertEqual(rows[0]['change_breakdown'], "20.00x2")
+        self.assertEqual(rows[2]['change_breakdown'], "")
+
+        rows = list(csv.DictReader(io.StringIO(self._export(email="second@").decode())))
+        self.assertEqual([row['customer_email'] for row in rows], ["second@example.com"])
+
+    def test_gzipped_jsonl_nests_items_and_change(self):
+        import gzip
+        import json
+        lines = gzip.decompress(self._export(format='jsonl', gzip='1')).decode().splitlines()
+        first = json.loads(lines[0])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual([item['quantity'] for item in first['items']], [1, 2])
+        self.assertEqual(first['change_breakdown'], [{'value': '20.00', 'count': 2}])
+
+        today = timezone.localdate()
+        self.assertEqual(self._export(format='jsonl', end=str(today - timedelta(days=1))), b'')
+        self.assertEqual(self.client.get(reverse('export_purchases'), {'format': 'xml'}).status_code, 400)
+
+
+class ProductImportTest(TestCase):
+    def setUp(self):
+        Product.objects.create(
+            product_id="M001",
+            name="Old Name",
+            available_stock=1,
+            price_per_unit=Decimal('1.00'),
+            tax_percentage=Decimal('0.00')
+        )
+
+    def test_csv_upserts_valid_rows_and_reports_bad_ones(self):
+        import io
+        self.assertEqual(catalog.get("M001").name, "Old Name")
+        data = (
+            "product_id,name,available_stock,price_per_unit,tax_percentage\n"
+            "M001,Masala Chai,40,120.00,5\n"
+            "M002,Filter Coffee,15,250.50,12\n"
+            "M003,,5,10,0\n"
+            "M004,Bad Price,5,0.001,0\n"
+            "M005,Negative Stock,-1,10,0\n"
+        )
+        result = import_products(io.StringIO(data), 'csv', chunk_size=2)
+        self.assertEqual((result.rows, result.imported, result.error_count), (5, 2, 3))
+        self.assertEqual([row_number for row_number, _ in result.errors], [3, 4, 5])
+        self.assertIn('name', result.errors[0][1])
+
+        product = Product.objects.get(product_id="M001")
+        self.assertEqual((product.name, product.available_stock, product.price_per_unit), ("Masala Chai", 40, Decimal('120.00')))
+        self.assertEqual(Product.objects.count(), 2)
+        # Catalog cache and name search index follow the import
+        self.assertEqual(catalog.get("M001").name, "Masala Chai")
+        if fts_available():
+            self.assertEqual([product_id for product_id, _ in search_products_ranked("chai")], ["M001"])
+
+    def test_jsonl_upload_endpoint(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        upload = SimpleUploadedFile("catalog.jsonl", (
+            b'{"product_id": "M010", "name": "Jaggery", "available_stock": 7, "price_per_unit": 55.5, "tax_percentage": 0}\n'
+            b'\n'
+            b'not json\n'
+            b'{"product_id": "M010", "name": "Jaggery Cubes", "available_stock": 8, "price_per_unit": "60", "tax_percentage": "5"}\n'
+        ))
+        response = self.client.post(reverse('product_import'), {'file': upload}, HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual((data['rows'], data['imported'], data['failed']), (3, 2, 1))
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertEqual(Product.objects.get(product_id="M010").name, "Jaggery Cubes")
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Query budgets for the hot endpoints, checked at several input sizes
+    Each budget is the same at every size, so an N+1 pattern fails as soon as it comes back.
+    Caches are cleared before each measurement, so these are cold-cache counts;
+    under the test case's transaction checkout's atomic blocks add SAVEPOINT/RELEASE pairs.
+    """
+    BASKET_SIZES = (1, 5, 25)
+    CATALOG_SIZES = (1, 10, 100)
+    HISTORY_SIZES = (1, 60, 150)
+
+    # The test cache is process-local, so checkout reads prices with the stock rather than through the catalog cache
+    GENERATE_BILL_QUERIES = 14
+    SEARCH_QUERIES = 3
+    HISTORY_QUERIES = 1
+    DETAIL_QUERIES = 1
+    DETAIL_UNSTORED_QUERIES = 7
+
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(
+                product_id=f"Q{index:03d}",
+                name=f"Budget Item {index}",
+                available_stock=1000,
+                price_per_unit=Decimal('10.00'),
+                tax_percentage=Decimal('5.00')
+            )
+            for index in range(max(self.BASKET_SIZES))
+        ])
+        for value in (500, 100, 50, 20, 10, 5, 2, 1):
+            Denomination.objects.create(register_id=default_register(), value=Decimal(value), count=1000)
+        # Checked once per process, not per request
+        fts_available()
+
+    def _clear_caches(self):
+        from billing.search import search_cache
+        catalog.clear()
+        search_cache.clear()
+
+    def _post_bill(self, basket_size, email="budget@example.com"):
+        # ₹10.50 a line, paid in ₹100 notes
+        notes = -(-basket_size * 1050 // 10000)
+        return self.client.post(reverse('generate_bill'), {
+            "customer_email": email,
+            "products": [{"product_id": f"Q{index:03d}", "quantity": 1} for index in range(basket_size)],
+            "customer_payment_denominations": {"100": notes}
+        }, content_type='application/json')
+
+    def test_generate_bill(self):
+        for basket_size in self.BASKET_SIZES:
+            with self.subTest(basket_size=basket_size):
+                self._clear_caches()
+                with self.assertNumQueries(self.GENERATE_BILL_QUERIES):
+                    response = self._post_bill(basket_size)
+                self.assertTrue(response.json()['success'], response.json())
+
+    def test_search_products(self):
+        created = 0
+        for catalog_size in self.CATALOG_SIZES:
+            Product.objects.bulk_create([
+                Product(
+                    product_id=f"G{index:04d}",
+                    name=f"Gadget {index}",
+                    available_stock=5,
+                    price_per_unit=Decimal('99.00'),
+                    tax_percentage=Decimal('18.00')
+                )
+                for index in range(created, catalog_size)
+            ])
+            created = catalog_size
+            for query in ("gadget", "G0000"):
+                with self.subTest(catalog_size=catalog_size, query=query):
+                    self._clear_caches()
+                    with self.assertNumQueries(self.SEARCH_QUERIES):
+                        response = self.client.get(reverse('search_products'), {'q': query})
+                    self.assertTrue(response.json()['products'])
+
+    def test_purchase_history(self):
+        recorded = 0
+        for history_size in self.HISTORY_SIZES:
+            for _ in range(history_size - recorded):
+                self._post_bill(3, email="history@example.com")
+            recorded = history_size
+            for params in ({}, {'email': 'history@example.com'}, {'email': 'hist'}, {'limit': 200}):
+                with self.subTest(history_size=history_size, **params):
+                    with self.assertNumQueries(self.HISTORY_QUERIES):
+                        response = self.client.get(reverse('purchase_history'), params)
+                    self.assertEqual(len(response.context['purchases']), min(history_size, params.get('limit', 50)))
+                    with self.assertNumQueries(self.HISTORY_QUERIES):
+                        self.client.get(reverse('purchase_history_api'), params)
+
+    def test_purchase_detail(self):
+        for basket_size in self.BASKET_SIZES:
+            with self.subTest(basket_size=basket_size):
+                purchase_id = self._post_bill(basket_size).json()['purchase_id']
+                url = reverse('purchase_detail', args=[purchase_id])
+                with self.assertNumQueries(self.DETAIL_QUERIES):
+                    self.assertContains(self.client.get(url), f"Q{basket_size - 1:03d}")
+
+                # Purchases from before invoices were stored are rendered once from their rows
+                PurchaseInvoice.objects.filter(purchase__purchase_id=purchase_id).delete()
+                with self.assertNumQueries(self.DETAIL_UNSTORED_QUERIES):
+                    self.assertContains(self.client.get(url), f"Q{basket_size - 1:03d}")
@@ -6,14 +6,24 @@ urlpatterns = [
     path('billing/', views.billing_page, name='billing'),
     path('api/product/<str:product_id>/', views.get_product_info, name='get_product_info'),
     path('api/search-products/', views.search_products, name='search_products'),
+    path('api/catalog-snapshot/', views.catalog_snapshot, name='catalog_snapshot'),
     path('api/generate-bill/', views.generate_bill, name='generate_bill'),
+    path('api/generate-bills/', views.generate_bills, name='generate_bills'),
     path('api/update-drawer-realtime/', views.update_drawer_realtime, name='update_drawer_realtime'),
+    path('api/events/', views.till_events, name='till_events'),
+    path('api/drawers/', views.drawers_api, name='drawers_api'),
+    path('metrics', views.metrics, name='metrics'),
     path('history/', views.purchase_history, name='purchase_history'),
+    path('api/purchase-history/', views.purchase_history_api, name='purchase_history_api'),
     path('purchase/<uuid:purchase_id>/', views.purchase_detail, name='purchase_detail'),
+    path('reports/sales/', views.sales_report, name='sales_report'),
+    path('api/reports/sales/', views.sales_report_api, name='sales_report_api'),
+    path('api/export/purchases/', views.export_purchases, name='export_purchases'),
     
     # Product Management
     path('products/', views.product_list, name='product_list'),
     path('products/add/', views.product_create, name='product_create'),
+    path('products/import/', views.product_import, name='product_import'),
     path('products/<int:pk>/edit/', views.product_edit, name='product_edit'),
     path('products/<int:pk>/delete/', views.product_delete, name='product_delete'),
     
@@ -1,138 +1,312 @@
 from decimal import Decimal, ROUND_HALF_UP
-from .models import Denomination
+from functools import lru_cache
+from math import gcd
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+from django.utils import timezone
+from .drawer import bump_drawer_version
+from .models import Denomination, Product, Register
 
-def update_shop_drawer_in_database(customer_denominations):
+
+class InsufficientStockError(Exception):
+    """Raised when a conditional stock decrement could not cover every product"""
+
+
+class DrawerChangedError(Exception):
+    """Raised when the drawer no longer holds the notes a checkout planned to hand out as change"""
+
+
+def apply_drawer_deltas(deltas, register=None):
+    """
+    Apply a whole map of denomination value -> count delta to a register's drawer
+    register is the register's code (settings.DEFAULT_REGISTER if None); only that
+    register's rows are touched, so tills on other registers never wait on them.
+    Existing rows are changed with a single UPDATE ... SET count = count + CASE ...
+    statement; values that are not in the drawer yet are inserted. The new counts
+    come back from the UPDATE itself (RETURNING) where the database supports it.
+    A delta that would take a count below zero violates the column's check
+    constraint and raises IntegrityError, so callers should run inside a transaction.
+    Bumps the register's drawer version, so clients holding its snapshot refetch it.
+    Returns {Decimal value: new count} for every value in deltas
+    """
+    deltas = {Decimal(str(value)).quantize(Decimal('0.01')): int(delta) for value, delta in deltas.items() if int(delta) != 0}
+    if not deltas:
+        return {}
+    register = register or settings.DEFAULT_REGISTER
+    
+    table = connection.ops.quote_name(Denomination._meta.db_table)
+    value_column = connection.ops.quote_name('value')
+    count_column = connection.ops.quote_name('count')
+    register_column = connection.ops.quote_name('register_id')
+    register_table = connection.ops.quote_name(Register._meta.db_table)
+    id_column = connection.ops.quote_name('id')
+    code_column = connection.ops.quote_name('code')
+    
+    cases = []
+    params = []
+    for value, delta in deltas.items():
+        cases.append('WHEN %s THEN %s')
+        params.extend([connection.ops.adapt_decimalfield_value(value, 10, 2), delta])
+    in_params = [connection.ops.adapt_decimalfield_value(value, 10, 2) for value in deltas]
+    
+    sql = (
+        f'UPDATE {table} SET {count_column} = {count_column} + CASE {value_column} {" ".join(cases)} ELSE 0 END '
+        f'WHERE {register_column} = (SELECT {id_column} FROM {register_table} WHERE {code_column} = %s) '
+        f'AND {value_column} IN ({", ".join(["%s"] * len(deltas))})'
+    )
+    params = params + [register] + in_params
+    
+    with connection.cursor() as cursor:
+        if _supports_update_returning():
+            cursor.execute(f'{sql} RETURNING {value_column}, {count_column}', params)
+            rows = cursor.fetchall()
+        else:
+            cursor.execute(sql, params)
+            rows = None
+    
+    if rows is None:
+        rows = Denomination.objects.filter(register__code=register, value__in=list(deltas)).values_list('value', 'count')
+    new_counts = {}
+    for value, count in rows:
+        new_counts[Decimal(str(value)).quantize(Decimal('0.01'))] = count
+    
+    missing = [(value, delta) for value, delta in deltas.items() if value not in new_counts]
+    if missing:
+        register_id = Register.objects.values_list('pk', flat=True).get(code=register)
+        missing = [Denomination(register_id=register_id, value=value, count=delta) for value, delta in missing]
+        Denomination.objects.bulk_create(missing)
+        for denomination in missing:
+            new_counts[denomination.value] = denomination.count
+    
+    bump_drawer_version(register)
+    return new_counts
+
+def _supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+def update_shop_drawer_in_database(customer_denominations, register=None):
     """
     Update shop drawer denominations in database in real-time
     This function is called as customer enters denominations
     """
-    updated_denominations = {}
+    return update_shop_drawer_from_customer_payment(customer_denominations, register)
+
+def _whole_rupee_drawer(available_denominations):
+    """
+    Reduce drawer rows to a hashable, descending tuple of (rupees, count)
+    Only whole-rupee denominations with notes in the drawer can be used for change
+    """
+    drawer = {}
+    for denomination in available_denominations:
+        if denomination.count > 0 and denomination.value == denomination.value.quantize(Decimal('1')):
+            rupees = int(denomination.value)
+            if rupees > 0:
+                drawer[rupees] = drawer.get(rupees, 0) + denomination.count
+    return tuple(sorted(drawer.items(), reverse=True))
+
+@lru_cache(maxsize=128)
+def is_canonical_denomination_set(values):
+    """
+    Check whether greedy change-making is optimal for a set of denominations
+    Uses the Kozen-Zaks bound: if greedy is ever beaten, it is beaten for some
+    amount below the sum of the two largest denominations.
+    """
+    values = sorted(values)
+    if len(values) < 3:
+        return True
     
-    for denomination_value, count in customer_denominations.items():
-        if count > 0:
-            try:
-                denomination = Denomination.objects.get(value=Decimal(denomination_value))
-                # Add customer denominations to existing drawer
-                denomination.count += count
-                denomination.save()
-                updated_denominations[denomination_value] = denomination.count
-            except Denomination.DoesNotExist:
-                # Create new denomination if it doesn't exist
-                denomination = Denomination.objects.create(
-                    value=Decimal(denomination_value),
-                    count=count
-                )
-                updated_denominations[denomination_value] = count
-    
-    return updated_denominations
-
-def calculate_exact_change_greedy(change_amount, available_denominations):
-    """
-    Calculate exact change using greedy algorithm with proper rounding
-    Returns the optimal denomination breakdown for the exact change amount
-    Only returns exact denominations, no partial amounts
+    limit = values[-1] + values[-2]
+    # Unbounded minimum-note DP up to the bound
+    min_notes = [0] + [None] * limit
+    for amount in range(1, limit + 1):
+        best = None
+        for value in values:
+            if value > amount:
+                break
+            previous = min_notes[amount - value]
+            if previous is not None and (best is None or previous + 1 < best):
+                best = previous + 1
+        min_notes[amount] = best
+    
+    descending = values[::-1]
+    for amount in range(values[2] + 2, limit):
+        greedy_notes = 0
+        remaining = amount
+        for value in descending:
+            greedy_notes += remaining // value
+            remaining %= value
+        if remaining == 0 and min_notes[amount] is not None and greedy_notes > min_notes[amount]:
+            return False
+    return True
+
+def greedy_change(amount, drawer):
     """
-    if change_amount <= 0:
-        return [], Decimal('0.00')
+    Greedy change for an integer amount from a descending (rupees, count) drawer
+    Returns a tuple of (rupees, count) pairs, or None if greedy cannot make exact change
+    """
+    breakdown = []
+    remaining = amount
+    for value, count in drawer:
+        if remaining <= 0:
+            break
+        count_to_give = min(remaining // value, count)
+        if count_to_give > 0:
+            breakdown.append((value, count_to_give))
+            remaining -= value * count_to_give
+    return tuple(breakdown) if remaining == 0 else None
+
+def _preallocate_large_notes(amount, drawer):
+    """
+    Hand out notes that every minimum-note solution is known to contain
+    Exchange argument: if lcm(a, b) / a notes of a smaller value a are used while
+    lcm(a, b) / b notes of a larger value b are still free, swapping them pays the
+    same amount with fewer notes. So an optimal solution either keeps each smaller
+    value under that limit - which bounds how much the smaller notes can pay - or
+    has nearly emptied the larger value. Both give a lower bound on the notes of each
+    value, which is taken up front so the DP only covers a small remainder.
+    Returns (remaining_amount, remaining_drawer, preallocated_counts)
+    """
+    remaining_amount = amount
+    remaining = dict(drawer)
+    preallocated = {}
+    values = sorted(remaining, reverse=True)
     
-    # Ensure change amount is rounded to nearest rupee to avoid decimal denominations
-    change_amount = change_amount.quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    for position, value in enumerate(values):
+        smaller = values[position + 1:]
+        if not smaller:
+            break
+        larger_value = sum(larger * remaining[larger] for larger in values[:position])
+        small_limit = 0
+        max_swap = 0
+        for small in smaller:
+            lcm = small * value // gcd(small, value)
+            small_limit += (lcm // small - 1) * small
+            max_swap = max(max_swap, lcm // value)
+        
+        bound_if_small_limited = -(-(remaining_amount - small_limit - larger_value) // value)
+        bound_if_exhausted = remaining[value] - max_swap + 1
+        lower_bound = min(bound_if_small_limited, bound_if_exhausted, remaining[value], remaining_amount // value)
+        if lower_bound > 0:
+            preallocated[value] = lower_bound
+            remaining[value] -= lower_bound
+            remaining_amount -= lower_bound * value
+    
+    return remaining_amount, remaining, preallocated
+
+def knapsack_change(amount, drawer):
+    """
+    Minimum-note exact change via bounded-knapsack DP over a (rupees, count) drawer
+    Count limits are split into power-of-two bundles (0/1 items) and the DP runs in
+    units of the denominations' gcd over whatever is left after preallocation.
+    Returns a descending tuple of (rupees, count) pairs, or None if the amount cannot be paid
+    """
+    remaining_amount, remaining, counts = _preallocate_large_notes(amount, drawer)
+    
+    unit = 0
+    for value, count in remaining.items():
+        if count > 0:
+            unit = gcd(unit, value)
+    if remaining_amount and (unit == 0 or remaining_amount % unit):
+        return None
     
-    # Debug: Print input values
-    print(f"DEBUG utils: Change amount after rounding: {change_amount}")
-    print(f"DEBUG utils: Available denominations: {[(d.value, d.count) for d in available_denominations]}")
+    size = remaining_amount // unit + 1 if unit else 1
+    bundles = []
+    for value, count in remaining.items():
+        count = min(count, remaining_amount // value)
+        bundle = 1
+        while count > 0:
+            take = min(bundle, count)
+            bundles.append((value, take))
+            count -= take
+            bundle *= 2
     
-    # Filter out denominations with decimal values - only use whole number denominations for change
-    whole_denominations = [d for d in available_denominations if d.value == d.value.quantize(Decimal('1'), rounding=ROUND_HALF_UP)]
+    infinity = amount + 1
+    min_notes = [0] + [infinity] * (size - 1)
+    taken = []
+    for value, take in bundles:
+        width = value * take // unit
+        candidates = [notes + take for notes in min_notes[:size - width]]
+        current = min_notes[width:]
+        taken.append(bytes(candidate < notes for notes, candidate in zip(current, candidates)))
+        min_notes[width:] = [candidate if candidate < notes else notes for notes, candidate in zip(current, candidates)]
     
-    print(f"DEBUG utils: Whole denominations after filtering: {[(d.value, d.count) for d in whole_denominations]}")
+    if min_notes[size - 1] >= infinity:
+        return None
     
-    # Sort denominations by value (highest first) for greedy approach
-    sorted_denominations = sorted(whole_denominations, key=lambda x: x.value, reverse=True)
+    position = size - 1
+    for (value, take), taken_at in zip(reversed(bundles), reversed(taken)):
+        width = value * take // unit
+        if position >= width and taken_at[position - width]:
+            counts[value] = counts.get(value, 0) + take
+            position -= width
+    
+    return tuple(sorted(counts.items(), reverse=True))
+
+@lru_cache(maxsize=1024)
+def _calculate_change_cached(amount, drawer):
+    if is_canonical_denomination_set(tuple(value for value, _ in drawer)):
+        breakdown = greedy_change(amount, drawer)
+        if breakdown is not None:
+            return breakdown
+    return knapsack_change(amount, drawer)
+
+def calculate_change(change_amount, available_denominations):
+    """
+    Calculate an exact change breakdown from the notes available in the drawer
+    Canonical denomination sets take the greedy fast path; when greedy cannot pay
+    (e.g. the larger notes have run out) a bounded-knapsack DP finds a combination.
+    Results are memoized per (amount, drawer state).
+    Returns (breakdown, total_change_given); the breakdown is empty if exact change is impossible
+    """
+    if change_amount <= 0:
+        return [], Decimal('0.00')
+    
+    # Change is always given in whole rupees
+    amount = int(change_amount.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    drawer = _whole_rupee_drawer(available_denominations)
+    counts = _calculate_change_cached(amount, drawer)
+    if counts is None:
+        return [], Decimal('0.00')
+    
+    # Report change in the drawer's own denomination values
+    values = {int(denomination.value): denomination.value for denomination in available_denominations}
     
     breakdown = []
-    remaining = change_amount
     total_change_given = Decimal('0.00')
-    
-    for denomination in sorted_denominations:
-        if remaining <= 0:
-            break
-            
-        if denomination.count > 0:
-            # Calculate how many of this denomination we can use
-            count_needed = int(remaining // denomination.value)
-            count_available = denomination.count
-            count_to_give = min(count_needed, count_available)
-            
-            print(f"DEBUG utils: Processing denomination {denomination.value}, remaining: {remaining}, count_needed: {count_needed}, count_to_give: {count_to_give}")
-            
-            if count_to_give > 0:
-                breakdown.append({
-                    'value': denomination.value,
-                    'count': count_to_give,
-                    'total': denomination.value * count_to_give
-                })
-                
-                remaining -= denomination.value * count_to_give
-                total_change_given += denomination.value * count_to_give
-                
-                print(f"DEBUG utils: Added {count_to_give} x {denomination.value} = {denomination.value * count_to_give}, new remaining: {remaining}")
-                
-                # Update denomination count in shop drawer
-                # denomination.count -= count_to_give
-                # denomination.save()
-    
-    # If we couldn't provide exact change, we don't add partial denominations
-    # The remaining amount will be handled by the business logic
-    # This ensures only exact denominations are returned
+    for rupees, count in counts:
+        value = values[rupees]
+        breakdown.append({
+            'value': value,
+            'count': count,
+            'total': value * count
+        })
+        total_change_given += value * count
     
     return breakdown, total_change_given
 
-def update_shop_drawer_from_customer_payment(customer_denominations):
+def update_shop_drawer_from_customer_payment(customer_denominations, register=None):
     """
     Update shop drawer denominations when customer pays with specific denominations
-    This adds customer's payment to the shop's available denominations
+    This adds customer's payment to the register's available denominations in one statement
+    Returns {denomination_value: new count} keyed like customer_denominations
     """
-    print(f"DEBUG utils: update_shop_drawer_from_customer_payment called with: {customer_denominations}")
-    updated_denominations = {}
-    
-    for denomination_value, count in customer_denominations.items():
-        print(f"DEBUG utils: Processing denomination {denomination_value} with count {count}")
-        if count > 0:
-            try:
-                denomination = Denomination.objects.get(value=Decimal(denomination_value))
-                print(f"DEBUG utils: Found denomination {denomination_value}, current count: {denomination.count}")
-                denomination.count += count
-                denomination.save()
-                print(f"DEBUG utils: Updated denomination {denomination_value} to count: {denomination.count}")
-                updated_denominations[denomination_value] = denomination.count
-            except Denomination.DoesNotExist:
-                # Create new denomination if it doesn't exist
-                print(f"DEBUG utils: Creating new denomination {denomination_value} with count {count}")
-                denomination = Denomination.objects.create(
-                    value=Decimal(denomination_value),
-                    count=count
-                )
-                updated_denominations[denomination_value] = count
-    
-    print(f"DEBUG utils: Final updated denominations: {updated_denominations}")
-    
-    # Verify the update by reading from database
-    print("DEBUG utils: Verifying database update...")
-    for denomination_value, expected_count in updated_denominations.items():
-        try:
-            denomination = Denomination.objects.get(value=Decimal(denomination_value))
-            print(f"DEBUG utils: Verification - {denomination_value}: expected {expected_count}, actual {denomination.count}")
-        except Denomination.DoesNotExist:
-            print(f"DEBUG utils: ERROR - Denomination {denomination_value} not found in database!")
-    
-    return updated_denominations
-
-def get_shop_drawer_status():
-    """
-    Get current status of shop drawer denominations
-    """
-    denominations = Denomination.objects.all().order_by('-value')
+    deltas = {value: int(count) for value, count in customer_denominations.items() if int(count) > 0}
+    new_counts = apply_drawer_deltas(deltas, register)
+    return {
+        value: new_counts[Decimal(str(value)).quantize(Decimal('0.01'))]
+        for value in deltas
+    }
+
+def get_shop_drawer_status(register=None):
+    """
+    Get current status of a register's drawer denominations (default register if None)
+    """
+    denominations = Denomination.objects.filter(register__code=register or settings.DEFAULT_REGISTER).order_by('-value')
     drawer_status = {}
     
     for denomination in denominations:
@@ -156,35 +330,28 @@ def validate_customer_payment(customer_denominations, required_amount):
     
     return total_customer_payment >= required_amount, total_customer_payment
 
-def calculate_optimal_change_denominations(change_amount, available_denominations):
+def decrement_product_stock(product_quantities):
     """
-    Calculate the most optimal denomination combination for change
-    Uses greedy algorithm to minimize the number of denominations given
+    Reduce stock for all products in a basket with a single conditional UPDATE
+    product_quantities maps product_id -> total quantity sold. A product is only
+    decremented if it still has enough stock; if any row is left untouched the
+    caller's transaction must be rolled back.
     """
-    if change_amount <= 0:
-        return []
+    if not product_quantities:
+        return 0
     
-    # Sort denominations by value (highest first)
-    sorted_denominations = sorted(available_denominations, key=lambda x: x.value, reverse=True)
+    condition = Q()
+    quantity_cases = []
+    for product_id, quantity in product_quantities.items():
+        condition |= Q(product_id=product_id, available_stock__gte=quantity)
+        quantity_cases.append(When(product_id=product_id, then=Value(quantity)))
     
-    breakdown = []
-    remaining = change_amount
+    updated_rows = Product.objects.filter(condition).update(
+        available_stock=F('available_stock') - Case(*quantity_cases, output_field=PositiveIntegerField()),
+        updated_at=timezone.now()
+    )
     
-    for denomination in sorted_denominations:
-        if remaining <= 0:
-            break
-            
-        if denomination.count > 0:
-            count_needed = int(remaining // denomination.value)
-            count_available = denomination.count
-            count_to_give = min(count_needed, count_available)
-            
-            if count_to_give > 0:
-                breakdown.append({
-                    'value': denomination.value,
-                    'count': count_to_give,
-                    'total': denomination.value * count_to_give
-                })
-                remaining -= denomination.value * count_to_give
-    
-    return breakdown, remaining
\ No newline at end of file
+    if updated_rows != len(product_quantities):
+        raise InsufficientStockError('Insufficient stock for one or more products in this bill.')
+    
+    return updated_rows
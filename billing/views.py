@@ -1,57 +1,85 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib import messages
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.conf import settings
-from django.http import JsonResponse
+from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
-from django.db.models import Q
-from decimal import Decimal, ROUND_HALF_UP
+from django.views.decorators.http import condition, require_safe
+import io
 import json
-from .models import Product, Denomination, Purchase, PurchaseItem, ChangeBreakdown
+import logging
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+from .models import Product, Denomination, Register
 from .forms import BillingForm, ProductForm, DenominationForm
-from .utils import (
-    calculate_exact_change_greedy, 
-    update_shop_drawer_from_customer_payment,
-    update_shop_drawer_in_database,
-    get_shop_drawer_status,
-    validate_customer_payment,
-    calculate_optimal_change_denominations
-)
+from .catalog import catalog, catalog_condition
+from .catalog_snapshot import catalog_snapshot_etag, get_catalog_changes, parse_snapshot_version, snapshot_cache
+from .checkout import process_bill, process_bills, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from .drawer import get_drawer_snapshot, get_drawer_version, get_drawers, parse_drawer_version
+from .events import event_stream, get_broker
+from .history import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, aget_history_page
+from .idempotency import IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, get_stored_response
+from .imports import DEFAULT_IMPORT_CHUNK_SIZE, IMPORT_FORMATS, detect_format, import_products
+from .invoices import get_invoice_html
+from . import export, rollups
+from .metrics import render_metrics
+from .search import search_cache
+
+logger = logging.getLogger(__name__)
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
 
 def home(request):
     return render(request, 'billing/home.html')
 
 def billing_page(request):
     form = BillingForm()
-    denominations = Denomination.objects.all().order_by('-value')
+    register = get_object_or_404(Register, code=request.GET.get('register') or settings.DEFAULT_REGISTER)
+    # Read before the rows: a write in between only costs the page one more snapshot
+    drawer_version = register.drawer_version
+    denominations = register.denominations.order_by('-value')
     
     context = {
         'form': form,
+        'register': register,
+        'registers': Register.objects.all(),
         'denominations': denominations,
+        'drawer_version': drawer_version,
     }
     return render(request, 'billing/billing.html', context)
 
-def get_product_info(request, product_id):
-    try:
-        product = Product.objects.get(product_id=product_id)
-        return JsonResponse({
-            'success': True,
-            'name': product.name,
-            'price': float(product.price_per_unit),
-            'tax': float(product.tax_percentage),
-            'stock': product.available_stock
-        })
-    except Product.DoesNotExist:
+@require_safe
+@cache_control(private=True, no_cache=True)
+@catalog_condition
+async def get_product_info(request, product_id):
+    # Stock is read fresh; name, price and tax come from the catalog cache
+    stock = await Product.objects.filter(product_id=product_id).values_list('available_stock', flat=True).afirst()
+    product = await catalog.aget(product_id) if stock is not None else None
+    if product is None:
         return JsonResponse({
             'success': False,
             'error': 'Product not found'
         })
+    
+    return JsonResponse({
+        'success': True,
+        'name': product.name,
+        'price': float(product.price_per_unit),
+        'tax': float(product.tax_percentage),
+        'stock': stock
+    })
 
-def search_products(request):
-    """API endpoint for product search/autocomplete"""
+@require_safe
+@cache_control(private=True, no_cache=True)
+@catalog_condition
+async def search_products(request):
+    """API endpoint for product search/autocomplete
+    Browsers revalidate with If-None-Match and get a 304 until a product or stock changes."""
     query = request.GET.get('q', '').strip()
     
     if not query:
@@ -60,21 +88,22 @@ def search_products(request):
             'products': []
         })
     
-    # Search in product_id and name fields
-    products = Product.objects.filter(
-        Q(product_id__icontains=query) | 
-        Q(name__icontains=query)
-    ).filter(available_stock__gt=0).order_by('name')[:10]  # Limit to 10 results
+    # Exact product_id first, then product_id prefixes, then name matches; only IDs and stock are read here
+    matches = await search_cache.asearch(query, limit=10)
+    entries = await catalog.aget_many([product_id for product_id, _ in matches])
     
     product_list = []
-    for product in products:
+    for product_id, stock in matches:
+        product = entries.get(product_id)
+        if product is None:
+            continue
         product_list.append({
             'id': product.product_id,
             'text': f"{product.product_id} - {product.name}",
             'name': product.name,
             'price': float(product.price_per_unit),
             'tax': float(product.tax_percentage),
-            'stock': product.available_stock
+            'stock': stock
         })
     
     return JsonResponse({
@@ -82,419 +111,127 @@ def search_products(request):
         'products': product_list
     })
 
+@require_safe
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=catalog_snapshot_etag)
+def catalog_snapshot(request):
+    """Every product as [id, name, price, tax, stock] rows for client-side autocomplete
+    With ?since=<version>, only the products changed and the product_ids deleted since then.
+    Gzip-compressed when the client accepts it; revalidates with If-None-Match until the catalog or stock changes."""
+    version = request.catalog_snapshot_version
+    # No (or an unreadable) version: the client starts over from the full snapshot
+    since = parse_snapshot_version(request.GET.get('since'))
+    if since is None:
+        body, compressed = snapshot_cache.get(version)
+    else:
+        body, compressed = get_catalog_changes(since, version)
+
+    response = HttpResponse(content_type='application/json')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')):
+        response['Content-Encoding'] = 'gzip'
+        body = compressed
+    response.content = body
+    return response
+
 @csrf_exempt
 def generate_bill(request):
     if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            customer_email = data.get('customer_email')
-            amount_paid = data.get('amount_paid', 0)
-            products_data = data.get('products', [])
-            denominations_data = data.get('denominations', {})
-            customer_payment_denominations = data.get('customer_payment_denominations', {})
-            
-            print(f"DEBUG: Raw customer_payment_denominations: {customer_payment_denominations}")
-            print(f"DEBUG: Type of customer_payment_denominations: {type(customer_payment_denominations)}")
-            
-            # ========== COMPREHENSIVE VALIDATION SECTION ==========
-            
-            # 1. Validate customer email
-            if not customer_email:
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key:
+            if len(idempotency_key) > MAX_KEY_LENGTH:
                 return JsonResponse({
-                    'success': False, 
-                    'error': 'Customer email is required. Please enter a valid email address.'
+                    'success': False,
+                    'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.'
                 })
+            # A retry of a committed bill gets the original response back unchanged
+            stored_response = get_stored_response(idempotency_key)
+            if stored_response is not None:
+                response = HttpResponse(stored_response, content_type='application/json')
+                response['Idempotent-Replayed'] = 'true'
+                return response
+        
+        try:
+            data = json.loads(request.body)
+            return JsonResponse(process_bill(data, idempotency_key=idempotency_key))
+        except json.JSONDecodeError:
+            return JsonResponse({
+                'success': False, 
+                'error': 'Invalid request data format. Please check your input and try again.'
+            })
+        except ValueError as e:
+            return JsonResponse({
+                'success': False, 
+                'error': f'Invalid data format: {str(e)}. Please check your input values.'
+            })
+        except Exception as e:
+            logger.exception('Unexpected error in generate_bill: %s', e)
+            return JsonResponse({
+                'success': False, 
+                'error': 'An unexpected error occurred while processing your request. Please try again or contact support if the problem persists.'
+            })
+    
+    return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+@csrf_exempt
+def generate_bills(request):
+    """Bulk bill submission for tills replaying bills queued while offline
+    Accepts a JSON array of bills (or {"bills": [...], "chunk_size": n}) and
+    returns one result per bill, in order. Each chunk is one transaction.
+    A bill may carry an "idempotency_key" so a replayed sync is not charged twice."""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            chunk_size = DEFAULT_CHUNK_SIZE
+            if isinstance(data, dict):
+                chunk_size = int(data.get('chunk_size', DEFAULT_CHUNK_SIZE))
+                data = data.get('bills')
             
-            # Validate email format
-            import re
-            email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-            if not re.match(email_pattern, customer_email):
+            if not isinstance(data, list) or not data:
                 return JsonResponse({
-                    'success': False, 
-                    'error': 'Please enter a valid email address format (e.g., customer@example.com)'
+                    'success': False,
+                    'error': 'Expected a non-empty list of bills.'
                 })
-            
-            # 2. Validate products data
-            if not products_data:
+            if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
                 return JsonResponse({
-                    'success': False, 
-                    'error': 'No products selected. Please add at least one product to generate a bill.'
+                    'success': False,
+                    'error': f'chunk_size must be between 1 and {MAX_CHUNK_SIZE}.'
                 })
             
-            # 3. Validate amount paid
-            try:
-                amount_paid = Decimal(str(amount_paid))
-                if amount_paid < 0:
-                    return JsonResponse({
-                        'success': False, 
-                        'error': 'Amount paid cannot be negative. Please enter a valid amount.'
-                    })
-            except (ValueError, TypeError):
+            idempotency_keys = [bill.get('idempotency_key') if isinstance(bill, dict) else None for bill in data]
+            if any(key is not None and not isinstance(key, str) for key in idempotency_keys):
+                # Stored responses are keyed by string; a number would never match on replay
                 return JsonResponse({
-                    'success': False, 
-                    'error': 'Invalid amount paid. Please enter a valid numeric amount.'
-                })
-            
-            # 4. Validate customer payment denominations
-            if customer_payment_denominations:
-                for denomination_value, count in customer_payment_denominations.items():
-                    try:
-                        count = int(count)
-                        if count < 0:
-                            return JsonResponse({
-                                'success': False, 
-                                'error': f'Invalid denomination count for ₹{denomination_value}. Count cannot be negative.'
-                            })
-                    except (ValueError, TypeError):
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Invalid denomination count for ₹{denomination_value}. Please enter a valid number.'
-                        })
-            
-            # 5. Validate shop drawer denominations
-            if denominations_data:
-                for denomination_value, count in denominations_data.items():
-                    try:
-                        count = int(count)
-                        if count < 0:
-                            return JsonResponse({
-                                'success': False, 
-                                'error': f'Invalid shop drawer denomination count for ₹{denomination_value}. Count cannot be negative.'
-                            })
-                    except (ValueError, TypeError):
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Invalid shop drawer denomination count for ₹{denomination_value}. Please enter a valid number.'
-                        })
-            
-            # PRE-CALCULATE TOTALS AND VALIDATE PAYMENT BEFORE STARTING TRANSACTION
-            total_amount = Decimal('0.00')
-            tax_amount = Decimal('0.00')
-            products_to_process = []
-            valid_products_count = 0
-            
-            # First pass: Validate stock and collect product data (WITHOUT database changes)
-            for item in products_data:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity', 0)
-                
-                # Validate product ID
-                if not product_id:
-                    return JsonResponse({
-                        'success': False, 
-                        'error': 'Product ID is required for all products. Please select a valid product.'
-                    })
-                
-                # Validate quantity
-                try:
-                    quantity = int(quantity)
-                    if quantity <= 0:
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Invalid quantity for product {product_id}. Quantity must be greater than 0.'
-                        })
-                    if quantity > 99:  # Reasonable upper limit
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Quantity too high for product {product_id}. Maximum allowed quantity is 9999.'
-                        })
-                except (ValueError, TypeError):
-                    return JsonResponse({
-                        'success': False, 
-                        'error': f'Invalid quantity for product {product_id}. Please enter a valid number.'
-                    })
-                
-                try:
-                    product = Product.objects.get(product_id=product_id)
-                    
-                    # Validate stock availability
-                    if product.available_stock < quantity:
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Insufficient stock for "{product.name}" (ID: {product_id}). Available: {product.available_stock}, Requested: {quantity}. Please reduce quantity or select another product.'
-                        })
-                    
-                    # Validate product is active/available
-                    if product.available_stock == 0:
-                        return JsonResponse({
-                            'success': False, 
-                            'error': f'Product "{product.name}" (ID: {product_id}) is out of stock. Please select another product.'
-                        })
-                    
-                    # Calculate item totals
-                    item_subtotal = product.price_per_unit * quantity
-                    item_tax = (item_subtotal * product.tax_percentage) / 100
-                    
-                    total_amount += item_subtotal
-                    tax_amount += item_tax
-                    valid_products_count += 1
-                    
-                    # Store product data for processing after validation
-                    products_to_process.append({
-                        'product': product,
-                        'quantity': quantity,
-                        'item_subtotal': item_subtotal,
-                        'item_tax': item_tax,
-                        'product_data': {
-                            'name': product.name,
-                            'product_id': product.product_id,
-                            'quantity': quantity,
-                            'unit_price': float(product.price_per_unit),
-                            'tax_percentage': float(product.tax_percentage),
-                            'subtotal': float(item_subtotal),
-                            'tax_amount': float(item_tax)
-                        }
-                    })
-                    
-                except Product.DoesNotExist:
-                    return JsonResponse({
-                        'success': False, 
-                        'error': f'Product with ID "{product_id}" not found in the system. Please select a valid product from the list.'
-                    })
-            
-            # Validate at least one valid product
-            if valid_products_count == 0:
+                    'success': False,
+                    'error': 'idempotency_key must be a string.'
+                }, status=400)
+            if any(key and len(key) > MAX_KEY_LENGTH for key in idempotency_keys):
                 return JsonResponse({
-                    'success': False, 
-                    'error': 'No valid products selected. Please add at least one product with valid quantity to generate a bill.'
+                    'success': False,
+                    'error': f'idempotency_key must be at most {MAX_KEY_LENGTH} characters.'
                 })
             
-            # Calculate grand total and ROUND IT to nearest rupee
-            grand_total = total_amount + tax_amount
-            # Round to nearest rupee (whole number) - this ensures no decimal change amounts
-            grand_total = grand_total.quantize(Decimal('1'), rounding=ROUND_HALF_UP)
-            
-            # Handle customer payment denominations and calculate total payment
-            total_customer_payment = Decimal('0.00')
-            if customer_payment_denominations:
-                # Calculate total from customer denominations
-                for denomination_value, count in customer_payment_denominations.items():
-                    if count > 0:
-                        try:
-                            denomination_decimal = Decimal(str(denomination_value))
-                            count_int = int(count)
-                            total_customer_payment += denomination_decimal * count_int
-                        except (ValueError, TypeError):
-                            return JsonResponse({
-                                'success': False, 
-                                'error': f'Invalid denomination value or count for ₹{denomination_value}. Please check your input.'
-                            })
-                
-                # Update amount paid to match customer denominations
-                amount_paid = total_customer_payment
-            else:
-                # If no customer denominations specified, use the amount_paid field
-                total_customer_payment = amount_paid
-            
-            # CRITICAL: Validate customer payment BEFORE starting database transaction
-            if total_customer_payment < grand_total:
-                shortfall = grand_total - total_customer_payment
-                return JsonResponse({
-                    'success': False, 
-                    'error': f'Insufficient payment amount. Total bill amount: ₹{grand_total}, Amount paid: ₹{total_customer_payment}, Shortfall: ₹{shortfall}. Please provide the complete payment amount.'
-                })
-            
-            # Validate payment is not excessively high (reasonable limit)
-            if total_customer_payment > grand_total * 10:  # 10x the bill amount
-                return JsonResponse({
-                    'success': False, 
-                    'error': f'Payment amount (₹{total_customer_payment}) is excessively high compared to bill amount (₹{grand_total}). Please verify the payment amount.'
-                })
-            
-            # Calculate change amount
-            change_amount = total_customer_payment - grand_total
-            # Ensure change amount is also rounded to avoid decimal issues
-            change_amount = change_amount.quantize(Decimal('1'), rounding=ROUND_HALF_UP)
-            
-            # Pre-validate change availability if change is needed
-            if change_amount > 0:
-                # Get current shop drawer status
-                current_denominations = list(Denomination.objects.all())
-                
-                # Simulate adding customer payment to drawer
-                temp_denominations = {}
-                for denom in current_denominations:
-                    temp_denominations[str(denom.value)] = denom.count
-                
-                # Add customer denominations to temp drawer
-                if customer_payment_denominations:
-                    for denomination_value, count in customer_payment_denominations.items():
-                        if count > 0:
-                            temp_count = temp_denominations.get(denomination_value, 0)
-                            temp_denominations[denomination_value] = temp_count + int(count)
-                
-                # Create temp denomination objects for change calculation
-                temp_denom_objects = []
-                for value_str, count in temp_denominations.items():
-                    temp_denom_objects.append(type('TempDenom', (), {
-                        'value': Decimal(value_str),
-                        'count': count
-                    })())
-                
-                # Test if change can be given
-                test_change_breakdown, test_total_change = calculate_exact_change_greedy(
-                    change_amount, 
-                    temp_denom_objects
-                )
-                
-                if test_total_change < change_amount:
-                    return JsonResponse({
-                        'success': False, 
-                        'error': f'Cannot provide exact change of ₹{change_amount}. Available denominations are insufficient. Please provide payment in smaller denominations or contact the cashier.'
-                    })
-            
-            # NOW START DATABASE TRANSACTION - All validations passed
-            with transaction.atomic():
-                print(f"DEBUG: Starting transaction for bill generation - all validations passed")
-                
-                # Create purchase record
-                purchase = Purchase.objects.create(
-                    customer_email=customer_email,
-                    total_amount=total_amount,
-                    tax_amount=tax_amount,
-                    grand_total=grand_total,  # Rounded amount
-                    amount_paid=amount_paid,
-                    change_amount=change_amount
-                )
-                
-                purchase_items = []
-                
-                # Process products and reduce stock
-                for product_info in products_to_process:
-                    # Create purchase item
-                    PurchaseItem.objects.create(
-                        purchase=purchase,
-                        product=product_info['product'],
-                        quantity=product_info['quantity'],
-                        unit_price=product_info['product'].price_per_unit,
-                        tax_percentage=product_info['product'].tax_percentage,
-                        subtotal=product_info['item_subtotal']
-                    )
-                    
-                    # Update product stock with select_for_update to prevent race conditions
-                    product = Product.objects.select_for_update().get(product_id=product_info['product'].product_id)
-                    product.available_stock -= product_info['quantity']
-                    product.save()
-                    
-                    purchase_items.append(product_info['product_data'])
-                
-                # Update shop drawer denominations
-                for denomination_value, count in denominations_data.items():
-                    if count > 0:
-                        try:
-                            denomination = Denomination.objects.get(value=Decimal(denomination_value))
-                            denomination.count = int(count)
-                            denomination.save()
-                        except Denomination.DoesNotExist:
-                            return JsonResponse({
-                                'success': False, 
-                                'error': f'Denomination ₹{denomination_value} not found in the system. Please check your shop drawer configuration.'
-                            })
-                        except (ValueError, TypeError):
-                            return JsonResponse({
-                                'success': False, 
-                                'error': f'Invalid denomination value or count for ₹{denomination_value}. Please enter valid numbers.'
-                            })
-                
-                # Update shop drawer with customer payment denominations
-                print(f"DEBUG: Customer payment denominations received: {customer_payment_denominations}")
-                if customer_payment_denominations:
-                    print(f"DEBUG: Updating shop drawer with customer denominations")
-                    updated_denominations = update_shop_drawer_from_customer_payment(customer_payment_denominations)
-                    print(f"DEBUG: Updated denominations result: {updated_denominations}")
-                else:
-                    print(f"DEBUG: No customer denominations to update")
-                
-                # Calculate and process change
-                change_breakdown = []
-                total_change_given = Decimal('0.00')
-                
-                if change_amount > 0:
-                    # Get updated shop drawer status after customer payment
-                    updated_available_denominations = list(Denomination.objects.all())
-                    
-                    # Calculate exact change using greedy algorithm
-                    change_breakdown, total_change_given = calculate_exact_change_greedy(
-                        change_amount, 
-                        updated_available_denominations
-                    )
-                    
-                    # Update the database by subtracting the change denominations
-                    print(f"DEBUG: Updating database to subtract change denominations")
-                    for breakdown_item in change_breakdown:
-                        if breakdown_item['count'] > 0:
-                            try:
-                                denomination = Denomination.objects.get(value=breakdown_item['value'])
-                                print(f"DEBUG: Subtracting {breakdown_item['count']} from denomination {breakdown_item['value']} (current: {denomination.count})")
-                                denomination.count -= breakdown_item['count']
-                                denomination.save()
-                                print(f"DEBUG: Updated denomination {breakdown_item['value']} to count: {denomination.count}")
-                            except Denomination.DoesNotExist:
-                                return JsonResponse({
-                                    'success': False, 
-                                    'error': f'Denomination ₹{breakdown_item["value"]} not found in the system. Please check your shop drawer configuration.'
-                                })
-                    
-                    # Save change breakdown to database
-                    for breakdown_item in change_breakdown:
-                        if breakdown_item['count'] > 0:
-                            ChangeBreakdown.objects.create(
-                                purchase=purchase,
-                                denomination_value=breakdown_item['value'],
-                                count=breakdown_item['count']
-                            )
-                
-                # Send email (asynchronously in production)
-                send_invoice_email(purchase, purchase_items, change_breakdown)
-                
-                # Get updated denomination counts
-                available_denominations_dict = {}
-                for denomination in Denomination.objects.all():
-                    available_denominations_dict[str(denomination.value)] = denomination.count
-                
-                print(f"DEBUG: Final available denominations: {available_denominations_dict}")
-                print(f"DEBUG: Customer payment denominations in response: {customer_payment_denominations}")
-                
-                # Get final shop drawer status after transaction
-                final_drawer_status = get_shop_drawer_status()
-                
-                print(f"DEBUG: Transaction completed successfully, returning response")
-                return JsonResponse({
-                    'success': True,
-                    'purchase_id': str(purchase.purchase_id),
-                    'customer_email': customer_email,
-                    'total_amount': float(total_amount),
-                    'tax_amount': float(tax_amount),
-                    'grand_total': float(grand_total),  # Rounded amount
-                    'amount_paid': float(amount_paid),
-                    'change_amount': float(change_amount),
-                    'items': purchase_items,
-                    'change_breakdown': change_breakdown,
-                    'available_denominations': available_denominations_dict,
-                    'customer_payment_denominations': customer_payment_denominations,
-                    'total_customer_payment': float(total_customer_payment),
-                    'total_change_given': float(total_change_given),
-                    'shop_drawer_status': final_drawer_status,
-                    'transaction_summary': {
-                        'customer_paid': float(total_customer_payment),
-                        'bill_amount': float(grand_total),  # Rounded amount
-                        'change_given': float(change_amount),
-                        'denominations_used_for_change': len(change_breakdown)
-                    }
-                })
-                
+            results = process_bills(data, chunk_size=chunk_size, idempotency_keys=idempotency_keys)
+            succeeded = sum(1 for result in results if result['success'])
+            return JsonResponse({
+                'success': True,
+                'processed': len(results),
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+                'results': results
+            })
         except json.JSONDecodeError:
             return JsonResponse({
                 'success': False, 
                 'error': 'Invalid request data format. Please check your input and try again.'
             })
-        except ValueError as e:
+        except (ValueError, TypeError) as e:
             return JsonResponse({
                 'success': False, 
                 'error': f'Invalid data format: {str(e)}. Please check your input values.'
             })
         except Exception as e:
-            print(f"ERROR in generate_bill: {str(e)}")
+            logger.exception('Unexpected error in generate_bills: %s', e)
             return JsonResponse({
                 'success': False, 
                 'error': 'An unexpected error occurred while processing your request. Please try again or contact support if the problem persists.'
@@ -504,33 +241,49 @@ def generate_bill(request):
 
 @csrf_exempt
 def update_drawer_realtime(request):
-    """Update shop drawer denominations in real-time as customer enters denominations
-    NOTE: This function now only updates the display, NOT the database.
-    Database updates happen only when the bill is successfully generated."""
-    if request.method == 'POST':
+    """Drawer snapshot for the billing page, which projects customer payments onto it locally
+    With `since`, answers {"unchanged": true} while the register's drawer version still matches
+    and the versioned {value: count} snapshot otherwise. Without it, also returns the legacy
+    current and projected drawer status for customer_denominations.
+    NOTE: This never updates the database; that happens only when the bill is generated."""
+    if request.method in ('GET', 'POST'):
         try:
-            data = json.loads(request.body)
+            data = json.loads(request.body or '{}') if request.method == 'POST' else request.GET
+            register = data.get('register') or settings.DEFAULT_REGISTER
+            since = parse_drawer_version(data.get('since'))
+            if since is not None:
+                # Answered from the register's version alone while it matches
+                version = get_drawer_version(register)
+                if version is None:
+                    return _unknown_register(register)
+                if since == version:
+                    return JsonResponse({'success': True, 'version': version, 'unchanged': True})
+                version, drawer = get_drawer_snapshot(register)
+                return JsonResponse({'success': True, 'version': version, 'unchanged': False, 'drawer': drawer})
+
             customer_denominations = data.get('customer_denominations', {})
-            
-            # IMPORTANT CHANGE: Do NOT update database in real-time
-            # Only calculate what the drawer would look like for display purposes
-            # The actual database update happens only when generate_bill is called
-            
-            # Get current shop drawer status (unchanged)
-            current_drawer_status = get_shop_drawer_status()
-            
-            # Calculate what the drawer would look like after customer payment (for display only)
+            version, drawer = get_drawer_snapshot(register)
+            current_drawer_status = {}
             projected_drawer_status = {}
-            for denomination_value, drawer_info in current_drawer_status.items():
+            for denomination_value, count in drawer.items():
+                value = Decimal(denomination_value)
                 customer_count = int(customer_denominations.get(denomination_value, 0))
+                current_drawer_status[denomination_value] = {
+                    'value': value,
+                    'count': count,
+                    'total_value': value * count
+                }
                 projected_drawer_status[denomination_value] = {
-                    'value': drawer_info['value'],
-                    'count': drawer_info['count'] + customer_count,  # Projected count
-                    'total_value': drawer_info['value'] * (drawer_info['count'] + customer_count)
+                    'value': value,
+                    'count': count + customer_count,  # Projected count
+                    'total_value': value * (count + customer_count)
                 }
             
             return JsonResponse({
                 'success': True,
+                'version': version,
+                'unchanged': False,
+                'drawer': drawer,
                 'message': 'Display updated (database will be updated when bill is generated)',
                 'customer_denominations': customer_denominations,
                 'current_drawer_status': current_drawer_status,  # Actual current status
@@ -538,51 +291,168 @@ def update_drawer_realtime(request):
                 'note': 'Database will be updated only when bill is successfully generated'
             })
             
+        except Register.DoesNotExist:
+            return _unknown_register(register)
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
     
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
+def _unknown_register(register):
+    return JsonResponse({'success': False, 'error': f'Register "{register}" not found. Please select a valid till.'}, status=404)
 
-def send_invoice_email(purchase, items, change_breakdown):
-    subject = f'Invoice - Purchase {purchase.purchase_id}'
-    html_message = render_to_string('billing/email_invoice.html', {
-        'purchase': purchase,
-        'items': items,
-        'change_breakdown': change_breakdown
-    })
-    plain_message = strip_tags(html_message)
-    
+
+@require_safe
+async def till_events(request):
+    """Server-Sent Events stream of the stock deltas of committed checkouts and the drawer deltas of one register's"""
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker thread for as long as the page is open;
+        # 204 tells EventSource not to reconnect, and the page keeps its Refresh button
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        event_stream(get_broker(), getattr(settings, 'BILLING_EVENTS_KEEPALIVE', 15), request.GET.get('register')),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics(request):
+    """Checkout stage timings and query counts in Prometheus text format"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _history_params(request):
+    """email, cursor and page size from the query string; raises ValueError on bad input"""
+    email = request.GET.get('email', '').strip()
+    cursor = request.GET.get('cursor') or None
+    page_size = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return email, cursor, page_size
+
+async def purchase_history(request):
     try:
-        send_mail(
-            subject,
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [purchase.customer_email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-
-def purchase_history(request):
-    email = request.GET.get('email', '')
-    purchases = []
-    
-    if email:
-        purchases = Purchase.objects.filter(customer_email__icontains=email).prefetch_related('items__product').order_by('-created_at')
-    else:
-        purchases = Purchase.objects.all().prefetch_related('items__product').order_by('-created_at')
+        email, cursor, page_size = _history_params(request)
+        purchases, next_cursor = await aget_history_page(email, cursor, page_size)
+    except ValueError:
+        # A stale or hand-edited cursor just restarts from the newest purchase
+        email, cursor = request.GET.get('email', '').strip(), None
+        purchases, next_cursor = await aget_history_page(email)
     
     context = {
         'email': email,
         'purchases': purchases,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
     }
-    return render(request, 'billing/purchase_history.html', context)
+    # The base template reads flash messages, which may load the session from the database
+    return await sync_to_async(render)(request, 'billing/purchase_history.html', context)
+
+@require_safe
+async def purchase_history_api(request):
+    """Purchase history pages as JSON; follow next_cursor until it is null"""
+    try:
+        email, cursor, page_size = _history_params(request)
+        purchases, next_cursor = await aget_history_page(email, cursor, page_size)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'purchases': [
+            {
+                'purchase_id': purchase['purchase_id'],
+                'customer_email': purchase['customer_email'],
+                'created_at': purchase['created_at'],
+                'item_count': purchase['item_count'],
+                'grand_total': purchase['grand_total'],
+            }
+            for purchase in purchases
+        ],
+        'next_cursor': next_cursor
+    })
 
 def purchase_detail(request, purchase_id):
-    purchase = get_object_or_404(Purchase, purchase_id=purchase_id)
-    return render(request, 'billing/purchase_detail.html', {'purchase': purchase})
+    # Served from the invoice rendered at commit; one query when it is stored
+    invoice_html = get_invoice_html(purchase_id)
+    if invoice_html is None:
+        raise Http404('Purchase not found')
+    return render(request, 'billing/purchase_detail.html', {'purchase_id': purchase_id, 'invoice_html': invoice_html})
+
+def _report_range(request):
+    """(start, end) local days from ?start=&end= (inclusive end); defaults to the last 30 days"""
+    end = request.GET.get('end')
+    end = date.fromisoformat(end) if end else timezone.localdate()
+    start = request.GET.get('start')
+    start = date.fromisoformat(start) if start else end - timedelta(days=29)
+    if end < start:
+        raise ValueError('end must not be before start')
+    return start, end
+
+def sales_report(request):
+    """Daily revenue, tax and units from the rollup tables"""
+    try:
+        start, end = _report_range(request)
+    except ValueError as e:
+        messages.error(request, f'Invalid date range: {e}')
+        start, end = timezone.localdate() - timedelta(days=29), timezone.localdate()
+    
+    context = {
+        'start': start,
+        'end': end,
+        'report': rollups.sales_report(start, end + timedelta(days=1)),
+    }
+    return render(request, 'billing/sales_report.html', context)
+
+@require_safe
+def sales_report_api(request):
+    try:
+        start, end = _report_range(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    report = rollups.sales_report(start, end + timedelta(days=1))
+    return JsonResponse({
+        'success': True,
+        'start': start,
+        'end': end,
+        'days': report['days'],
+        'products': [
+            {
+                'product_id': row['product__product_id'],
+                'name': row['product__name'],
+                'units': row['units'],
+                'revenue': row['revenue'],
+                'tax_amount': row['tax_amount'],
+            }
+            for row in report['products']
+        ],
+        'tax_rates': report['tax_rates'],
+        'totals': report['totals'],
+    })
+
+@require_safe
+def export_purchases(request):
+    """Stream purchases with their items and change breakdown as CSV or JSON Lines
+    ?format=csv|jsonl&start=YYYY-MM-DD&end=YYYY-MM-DD&email=...&gzip=1"""
+    export_format = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    try:
+        start = request.GET.get('start')
+        start = date.fromisoformat(start) if start else None
+        end = request.GET.get('end')
+        end = date.fromisoformat(end) if end else None
+        chunks = export.export_purchases(export_format, start, end, request.GET.get('email', '').strip(), compress)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    filename = f'purchases.{export_format}' + ('.gz' if compress else '')
+    content_type = 'application/gzip' if compress else {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}[export_format]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 # Product Management Views
 def product_list(request):
@@ -601,6 +471,38 @@ def product_create(request):
     
     return render(request, 'billing/product_form.html', {'form': form, 'title': 'Add Product'})
 
+def product_import(request):
+    """Upload a CSV or JSON Lines product catalog; rows are upserted by product_id"""
+    result = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        import_format = request.POST.get('format') or detect_format(upload.name if upload else '')
+        try:
+            chunk_size = int(request.POST.get('chunk_size') or DEFAULT_IMPORT_CHUNK_SIZE)
+        except ValueError:
+            chunk_size = 0
+        if upload is None:
+            messages.error(request, 'Choose a file to import.')
+        elif import_format not in IMPORT_FORMATS:
+            messages.error(request, 'Unsupported file type; upload a .csv or .jsonl file.')
+        elif chunk_size < 1:
+            messages.error(request, 'Chunk size must be a positive number.')
+        else:
+            # Parsed straight from the upload stream; large uploads are spooled to disk by Django
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            result = import_products(stream, import_format, chunk_size).as_dict()
+            if request.headers.get('Accept') == 'application/json':
+                return JsonResponse({'success': True, **result})
+            if result['failed']:
+                messages.warning(request, f"Imported {result['imported']} of {result['rows']} rows; {result['failed']} rows failed.")
+            else:
+                messages.success(request, f"Imported {result['imported']} rows.")
+    
+    return render(request, 'billing/product_import.html', {
+        'result': result,
+        'chunk_size': DEFAULT_IMPORT_CHUNK_SIZE,
+    })
+
 def product_edit(request, pk):
     product = get_object_or_404(Product, pk=pk)
     
@@ -627,8 +529,24 @@ def product_delete(request, pk):
 
 # Denomination Management Views
 def denomination_list(request):
-    denominations = Denomination.objects.all().order_by('-value')
-    return render(request, 'billing/denomination_list.html', {'denominations': denominations})
+    denominations = Denomination.objects.select_related('register').order_by('register__code', '-value')
+    register = request.GET.get('register')
+    if register:
+        denominations = denominations.filter(register__code=register)
+    drawers = get_drawers()
+    # One column per denomination held by any register
+    for drawer in drawers['registers']:
+        drawer['counts'] = [drawer['drawer'].get(value, 0) for value in drawers['totals']]
+    return render(request, 'billing/denomination_list.html', {
+        'denominations': denominations,
+        'register': register,
+        'drawers': drawers,
+    })
+
+@require_safe
+def drawers_api(request):
+    """Every register's drawer and the totals across registers"""
+    return JsonResponse({'success': True, **get_drawers()})
 
 def denomination_create(request):
     if request.method == 'POST':
@@ -638,7 +556,7 @@ def denomination_create(request):
             messages.success(request, 'Denomination created successfully!')
             return redirect('denomination_list')
     else:
-        form = DenominationForm()
+        form = DenominationForm(initial={'register': Register.objects.filter(code=settings.DEFAULT_REGISTER).first()})
     
     return render(request, 'billing/denomination_form.html', {'form': form, 'title': 'Add Denomination'})
 
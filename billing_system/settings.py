@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -77,13 +78,82 @@ WSGI_APPLICATION = 'billing_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_PROFILE=production tunes SQLite for several tills writing at once:
+# WAL lets readers run alongside the single writer, BEGIN IMMEDIATE takes the write
+# lock when a transaction starts (a deferred transaction that reads and then writes
+# fails with "database is locked" instead of waiting), and connections are reused
+# across requests. `python manage.py bench_database` compares the profiles.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative values are KiB: 64 MiB of page cache per connection
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+DATABASE_PROFILES = {
+    'default': {},
+    'production': {
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
+    },
+}
+
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'default')
+if DATABASE_PROFILE not in DATABASE_PROFILES:
+    raise ImproperlyConfigured(f'DATABASE_PROFILE must be one of {", ".join(DATABASE_PROFILES)}')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        **DATABASE_PROFILES[DATABASE_PROFILE],
     }
 }
 
+# Cache
+# Set REDIS_URL so every worker shares the catalog version stamp; the in-memory
+# default only keeps a single process coherent
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Maximum number of products kept in each worker's in-process catalog cache
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '10000'))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '512'))
+# Seconds a worker keeps catalog entries when the cache above is process-local (no REDIS_URL)
+CATALOG_CACHE_LOCAL_TTL = int(os.getenv('CATALOG_CACHE_LOCAL_TTL', '60'))
+
+# Register (till) whose drawer a checkout uses when the bill does not name one
+DEFAULT_REGISTER = os.getenv('DEFAULT_REGISTER', 'main')
+
+# Drawer and stock change events pushed to open billing pages (see billing.events)
+# The in-process broker only reaches pages served by the same worker process
+BILLING_EVENT_BROKER = os.getenv('BILLING_EVENT_BROKER', 'billing.events.InProcessBroker')
+# Events queued for a slow page before it is told to resync instead
+BILLING_EVENTS_MAX_PENDING = int(os.getenv('BILLING_EVENTS_MAX_PENDING', '100'))
+# Seconds between keepalive comments on an idle event stream
+BILLING_EVENTS_KEEPALIVE = int(os.getenv('BILLING_EVENTS_KEEPALIVE', '15'))
+
 # email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -93,6 +163,46 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 
+# Local stand-in for SMTP so the email outbox can be exercised offline
+# EMAIL_LOCAL_BACKEND = 'locmem' keeps messages in memory, 'file' writes them to EMAIL_FILE_PATH
+EMAIL_LOCAL_BACKEND = os.getenv('EMAIL_LOCAL_BACKEND', '')
+if EMAIL_LOCAL_BACKEND == 'locmem':
+    EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+elif EMAIL_LOCAL_BACKEND == 'file':
+    EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+    EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
+
+# Seconds a generate_bill Idempotency-Key and its stored response are kept
+# Expired keys are removed by `python manage.py purge_idempotency_keys`
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+
+# Logging
+# BILLING_LOG_LEVEL=DEBUG shows per-bill checkout decisions; the default keeps request paths quiet
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'billing': {
+            'handlers': ['console'],
+            'level': os.getenv('BILLING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -5,7 +5,7 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'billing_system.settings')  # CHANGE THIS
 django.setup()
 
-from billing.models import Product, Denomination  # change 'billing' if your app name is different
+from billing.models import Product, Denomination, default_register  # change 'billing' if your app name is different
 
 # ---------------- Seed Functions ---------------- #
 def seed_products():
@@ -27,8 +27,9 @@ def seed_products():
 def seed_denominations():
     values = [500, 50, 20, 10, 5, 2, 1]
     count_in_hand = 100
+    register_id = default_register()
     for val in values:
-        obj, created = Denomination.objects.get_or_create(value=val)
+        obj, created = Denomination.objects.get_or_create(register_id=register_id, value=val)
         obj.count = count_in_hand
         obj.save()
         print(f"Set denomination {val} to count {count_in_hand} (created={created})")